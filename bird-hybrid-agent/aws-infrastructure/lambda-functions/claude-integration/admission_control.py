@@ -0,0 +1,333 @@
+"""
+Admission Control for Claude Traffic
+Token buckets for requests, input tokens and output tokens per minute,
+priority-ordered queueing and shedding, and limits that track the
+rate-limit headers Anthropic returns.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Callable, Mapping
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+# Lower level = admitted first
+PRIORITY_LEVELS = {
+    'emergency': 0,
+    'maintenance': 1,
+    'leasing': 2,
+    'conversational': 3,
+    'bulk': 4,
+    'marketing': 5
+}
+DEFAULT_PRIORITY = 'conversational'
+
+# Fraction of each bucket a priority must leave untouched for more urgent work
+PRIORITY_RESERVES = {0: 0.0, 1: 0.0, 2: 0.05, 3: 0.1, 4: 0.2, 5: 0.3}
+
+# Longest a request of each priority may queue before it is shed (seconds)
+PRIORITY_MAX_WAIT = {0: 30.0, 1: 30.0, 2: 15.0, 3: 10.0, 4: 60.0, 5: 5.0}
+
+# Anthropic rate-limit header prefix for each bucket
+RATE_LIMIT_HEADERS = {
+    'requests': 'anthropic-ratelimit-requests',
+    'input_tokens': 'anthropic-ratelimit-input-tokens',
+    'output_tokens': 'anthropic-ratelimit-output-tokens'
+}
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a request is shed instead of queued"""
+
+
+@dataclass
+class Admission:
+    """Budget reserved for one admitted request"""
+    priority: str
+    costs: Dict[str, int]
+    waited_ms: int
+
+
+class TokenBucket:
+    """Per-minute token bucket refilled continuously"""
+
+    def __init__(self, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.updated_at = clock()
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / 60.0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def time_until_available(self, amount: float, reserve: float = 0.0) -> float:
+        """Seconds until `amount` can be taken while leaving `reserve` of capacity"""
+        self._refill()
+        needed = min(amount, self.capacity) + reserve * self.capacity - self.tokens
+        return 0.0 if needed <= 0 else needed / self.refill_rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def update_limit(self, limit: float, remaining: Optional[float] = None):
+        """Adopt the server-side limit and never believe we have more than it says remains"""
+        self._refill()
+        if limit > 0:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+        self.tokens = min(self.tokens, self.capacity)
+
+
+class InProcessBucketBackend:
+    """Buckets held in this process only"""
+
+    def __init__(self, limits: Dict[str, int], clock: Callable[[], float] = time.monotonic):
+        self.buckets = {name: TokenBucket(limit, clock) for name, limit in limits.items()}
+
+    def try_acquire(self, costs: Dict[str, int], reserve: float) -> float:
+        """Take all costs atomically; returns 0 on success or seconds to wait"""
+        wait = max(self.buckets[name].time_until_available(cost, reserve) for name, cost in costs.items())
+        if wait > 0:
+            return wait
+        for name, cost in costs.items():
+            self.buckets[name].consume(cost)
+        return 0.0
+
+    def refund(self, costs: Dict[str, int]):
+        for name, amount in costs.items():
+            if amount > 0:
+                self.buckets[name].refund(amount)
+            elif amount < 0:
+                self.buckets[name].consume(-amount)
+
+    def update_limit(self, name: str, limit: float, remaining: Optional[float]):
+        self.buckets[name].update_limit(limit, remaining)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {name: {'capacity': b.capacity, 'available': round(b.tokens, 1)} for name, b in self.buckets.items()}
+
+
+class RedisBucketBackend:
+    """Buckets shared by every worker through Redis, updated atomically in Lua"""
+
+    ACQUIRE_SCRIPT = """
+    local now_parts = redis.call('TIME')
+    local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+    local reserve = tonumber(ARGV[1])
+    local wait = 0
+    local levels = {}
+    for i, key in ipairs(KEYS) do
+        local state = redis.call('HMGET', key, 'capacity', 'tokens', 'updated_at')
+        local capacity = tonumber(state[1]) or tonumber(ARGV[1 + i * 2])
+        local tokens = tonumber(state[2]) or capacity
+        local updated_at = tonumber(state[3]) or now
+        local rate = capacity / 60
+        tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+        local cost = math.min(tonumber(ARGV[i * 2]), capacity)
+        local needed = cost + reserve * capacity - tokens
+        if needed > 0 then
+            wait = math.max(wait, needed / rate)
+        end
+        levels[i] = {capacity, tokens, cost}
+    end
+    for i, key in ipairs(KEYS) do
+        local tokens = levels[i][2]
+        if wait == 0 then
+            tokens = tokens - levels[i][3]
+        end
+        redis.call('HSET', key, 'capacity', levels[i][1], 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', key, 3600)
+    end
+    return tostring(wait)
+    """
+
+    ADJUST_SCRIPT = """
+    local now_parts = redis.call('TIME')
+    local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+    local key = KEYS[1]
+    local capacity = tonumber(ARGV[1])
+    local refund = tonumber(ARGV[2])
+    local remaining = tonumber(ARGV[3])
+    local state = redis.call('HMGET', key, 'capacity', 'tokens', 'updated_at')
+    local current = tonumber(state[1]) or capacity
+    if capacity <= 0 then capacity = current end
+    if current <= 0 then return 0 end
+    local tokens = tonumber(state[2]) or current
+    local updated_at = tonumber(state[3]) or now
+    tokens = math.min(current, tokens + (now - updated_at) * current / 60)
+    tokens = math.min(capacity, tokens + refund)
+    if remaining >= 0 then tokens = math.min(tokens, remaining) end
+    redis.call('HSET', key, 'capacity', capacity, 'tokens', tokens, 'updated_at', now)
+    redis.call('EXPIRE', key, 3600)
+    return 1
+    """
+
+    def __init__(self, redis_url: str, limits: Dict[str, int], key_prefix: str = 'claude-admission'):
+        import redis
+
+        self.redis = redis.Redis.from_url(redis_url)
+        self.limits = dict(limits)
+        self.key_prefix = key_prefix
+        self._acquire = self.redis.register_script(self.ACQUIRE_SCRIPT)
+        self._adjust = self.redis.register_script(self.ADJUST_SCRIPT)
+
+    def _key(self, name: str) -> str:
+        return f"{self.key_prefix}:{name}"
+
+    def try_acquire(self, costs: Dict[str, int], reserve: float) -> float:
+        names = list(costs)
+        args = [reserve]
+        for name in names:
+            args.extend([costs[name], self.limits[name]])
+        return float(self._acquire(keys=[self._key(name) for name in names], args=args))
+
+    def refund(self, costs: Dict[str, int]):
+        for name, amount in costs.items():
+            if amount != 0:
+                self._adjust(keys=[self._key(name)], args=[0, amount, -1])
+
+    def update_limit(self, name: str, limit: float, remaining: Optional[float]):
+        if limit > 0:
+            self.limits[name] = int(limit)
+        self._adjust(keys=[self._key(name)], args=[limit, 0, -1 if remaining is None else remaining])
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        snapshot = {}
+        for name in self.limits:
+            state = self.redis.hgetall(self._key(name))
+            snapshot[name] = {
+                'capacity': float(state.get(b'capacity', self.limits[name])),
+                'available': round(float(state.get(b'tokens', self.limits[name])), 1)
+            }
+        return snapshot
+
+
+class AdmissionController:
+    """Admits Claude requests against RPM/ITPM/OTPM budgets in priority order"""
+
+    def __init__(self, backend=None, limits: Dict[str, int] = None, poll_interval: float = 0.05,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limits = limits or {
+            'requests': int(os.environ.get('CLAUDE_RPM_LIMIT', '50')),
+            'input_tokens': int(os.environ.get('CLAUDE_ITPM_LIMIT', '40000')),
+            'output_tokens': int(os.environ.get('CLAUDE_OTPM_LIMIT', '8000'))
+        }
+        self.backend = backend or InProcessBucketBackend(self.limits, clock)
+        self.poll_interval = poll_interval
+        self.clock = clock
+
+        self._queue = []
+        self._sequence = itertools.count()
+        self.stats = {'admitted': 0, 'shed': 0, 'total_wait_ms': 0}
+
+    @classmethod
+    def from_environment(cls) -> 'AdmissionController':
+        """In-process buckets, or shared Redis buckets when CLAUDE_ADMISSION_REDIS_URL is set"""
+        controller = cls()
+        redis_url = os.environ.get('CLAUDE_ADMISSION_REDIS_URL')
+        if redis_url:
+            controller.backend = RedisBucketBackend(redis_url, controller.limits)
+        return controller
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    async def admit(self, input_tokens: int, output_tokens: int, priority: str = DEFAULT_PRIORITY) -> Admission:
+        """Wait for budget in priority order; raises AdmissionRejectedError if it would wait too long"""
+
+        level = PRIORITY_LEVELS.get(priority, PRIORITY_LEVELS[DEFAULT_PRIORITY])
+        costs = {'requests': 1, 'input_tokens': input_tokens, 'output_tokens': output_tokens}
+        reserve = PRIORITY_RESERVES[level]
+        deadline = self.clock() + PRIORITY_MAX_WAIT[level]
+        start_time = self.clock()
+
+        ticket = (level, next(self._sequence))
+        heapq.heappush(self._queue, ticket)
+        try:
+            while True:
+                wait = self.poll_interval
+                if self._queue[0] == ticket:
+                    wait = self.backend.try_acquire(costs, reserve)
+                    if wait == 0:
+                        break
+
+                if self.clock() + wait > deadline:
+                    self.stats['shed'] += 1
+                    metrics.add_metric(name="ClaudeAdmissionShed", unit=MetricUnit.Count, value=1)
+                    logger.warning("Shedding Claude request over rate budget",
+                                   priority=priority, estimated_wait_seconds=round(wait, 2))
+                    raise AdmissionRejectedError(f"Claude rate budget exhausted for {priority} traffic")
+
+                await asyncio.sleep(min(wait, self.poll_interval * 10))
+        finally:
+            self._remove(ticket)
+
+        waited_ms = int((self.clock() - start_time) * 1000)
+        self.stats['admitted'] += 1
+        self.stats['total_wait_ms'] += waited_ms
+        metrics.add_metric(name="ClaudeAdmissionWait", unit=MetricUnit.Milliseconds, value=waited_ms)
+
+        return Admission(priority=priority, costs=costs, waited_ms=waited_ms)
+
+    def settle(self, admission: Admission, input_tokens: int, output_tokens: int):
+        """Reconcile the estimate with actual usage (refunds or charges the difference)"""
+        self.backend.refund({
+            'input_tokens': admission.costs['input_tokens'] - input_tokens,
+            'output_tokens': admission.costs['output_tokens'] - output_tokens
+        })
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """Track the limits and remaining budget reported by the API"""
+        for name, prefix in RATE_LIMIT_HEADERS.items():
+            limit = headers.get(f'{prefix}-limit')
+            if limit is None:
+                continue
+            remaining = headers.get(f'{prefix}-remaining')
+            try:
+                self.backend.update_limit(name, float(limit), float(remaining) if remaining is not None else None)
+                self.limits[name] = int(float(limit))
+            except ValueError:
+                logger.warning(f"Ignoring malformed rate-limit header {prefix}-limit={limit}")
+
+    def _remove(self, ticket):
+        try:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+        except ValueError:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get admission statistics and current bucket levels"""
+        return {
+            **self.stats,
+            'queue_depth': self.queue_depth,
+            'buckets': self.backend.snapshot()
+        }
+
+
+# Export main classes
+__all__ = ['AdmissionController', 'AdmissionRejectedError', 'Admission', 'TokenBucket',
+           'InProcessBucketBackend', 'RedisBucketBackend', 'PRIORITY_LEVELS']
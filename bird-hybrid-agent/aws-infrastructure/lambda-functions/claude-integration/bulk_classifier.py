@@ -0,0 +1,352 @@
+"""
+Bulk Intent Classification
+Reclassifies large message backlogs after routing-rule or prompt changes,
+streaming results back through bounded live concurrency, the Message
+Batches API, or a local stub, with a resumable JSONL checkpoint.
+"""
+
+import os
+import json
+import time
+import asyncio
+from typing import Dict, List, Any, Optional, Iterable, Iterator, AsyncIterator, Callable, Awaitable
+
+import httpx
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+# Returned when Claude's answer is not valid classification JSON
+FALLBACK_CLASSIFICATION = {
+    "intent": "others",
+    "confidence": 0.5,
+    "routing_recommendation": "conversation-ai"
+}
+
+# Message Batches API (beta header required by the pinned SDK version)
+BATCHES_PATH = '/v1/messages/batches'
+BATCHES_BETA_HEADER = {'anthropic-beta': 'message-batches-2024-09-24'}
+MAX_BATCH_REQUESTS = 10000
+
+
+def _custom_id(index: int) -> str:
+    """custom_id of the index-th request of a batch
+
+    WhatsApp message ids ('wamid.HBgM...==') break the API's
+    ^[a-zA-Z0-9_-]{1,64}$ rule, so requests are numbered instead and the
+    checkpoint keeps each batch's message ids in request order.
+    """
+    return f'msg_{index}'
+
+
+def parse_classification(text: str) -> Dict[str, Any]:
+    """Parse Claude's JSON classification, falling back to 'others'"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        logger.warning("Failed to parse intent classification JSON")
+        return dict(FALLBACK_CLASSIFICATION)
+
+
+class BulkCheckpoint:
+    """Append-only JSONL log of finished messages and open batches
+
+    A batch entry lists its message ids in request order, which maps each
+    _custom_id back to its message.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed: Dict[str, Dict[str, Any]] = {}
+        self.pending_batches: Dict[str, List[str]] = {}
+        self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, encoding='utf-8') as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final line from an interrupted run
+                    continue
+
+                if entry['type'] == 'result':
+                    self.completed[entry['message_id']] = entry['classification']
+                elif entry['type'] == 'batch':
+                    self.pending_batches[entry['batch_id']] = entry['message_ids']
+                elif entry['type'] == 'batch_done':
+                    self.pending_batches.pop(entry['batch_id'], None)
+
+    def _append(self, entry: Dict[str, Any]):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def is_done(self, message_id: str) -> bool:
+        return message_id in self.completed
+
+    def pending_message_ids(self) -> set:
+        return {message_id for message_ids in self.pending_batches.values() for message_id in message_ids}
+
+    def record_result(self, message_id: str, classification: Dict[str, Any]):
+        self.completed[message_id] = classification
+        self._append({'type': 'result', 'message_id': message_id, 'classification': classification})
+
+    def record_batch(self, batch_id: str, message_ids: List[str]):
+        self.pending_batches[batch_id] = message_ids
+        self._append({'type': 'batch', 'batch_id': batch_id, 'message_ids': message_ids})
+
+    def finish_batch(self, batch_id: str):
+        self.pending_batches.pop(batch_id, None)
+        self._append({'type': 'batch_done', 'batch_id': batch_id})
+
+    def close(self):
+        self._file.close()
+
+
+def _result(message_id: str, classification: Dict[str, Any] = None, error: str = None) -> Dict[str, Any]:
+    if error is not None:
+        return {'message_id': message_id, 'status': 'errored', 'error': error}
+    return {'message_id': message_id, 'status': 'succeeded', 'classification': classification}
+
+
+class LiveBackend:
+    """Classifies through the regular Messages API with bounded concurrency"""
+
+    name = 'live'
+
+    def __init__(self, classify: Callable[[str], Awaitable[Dict[str, Any]]], concurrency: int = None):
+        self.classify = classify
+        self.concurrency = concurrency or int(os.environ.get('CLAUDE_BULK_CONCURRENCY', '8'))
+
+    async def _classify_one(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return _result(message['message_id'], await self.classify(message['text']))
+        except Exception as e:
+            return _result(message['message_id'], error=str(e))
+
+    async def stream(self, messages: Iterator[Dict[str, Any]], checkpoint: Optional[BulkCheckpoint]) -> AsyncIterator[Dict[str, Any]]:
+        # Only `concurrency` messages are pulled from the iterator at a time
+        in_flight = set()
+
+        try:
+            for message in messages:
+                if len(in_flight) >= self.concurrency:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                in_flight.add(asyncio.ensure_future(self._classify_one(message)))
+
+            while in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # Consumer stopped early: unfinished messages are picked up on resume
+            for task in in_flight:
+                task.cancel()
+
+
+class StubBackend(LiveBackend):
+    """Local backend for tests and dry runs; never calls Claude"""
+
+    name = 'stub'
+
+    def __init__(self, responder: Callable[[str], Dict[str, Any]] = None, latency: float = 0.0, concurrency: int = None):
+        self.responder = responder or (lambda text: dict(FALLBACK_CLASSIFICATION))
+        self.latency = latency
+        self.calls = 0
+        super().__init__(self._respond, concurrency)
+
+    async def _respond(self, text: str) -> Dict[str, Any]:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.responder(text)
+
+
+class MessageBatchesBackend:
+    """Submits classifications through the Message Batches API for cheap offline jobs"""
+
+    name = 'batch'
+
+    def __init__(self, client: Any, model: str, system_prompt: str, max_tokens: int = 1000,
+                 temperature: float = 0.1, batch_size: int = None, max_open_batches: int = 4,
+                 poll_interval: float = None, on_usage: Callable[[Dict[str, Any]], None] = None,
+                 render_message: Callable[[str], str] = None):
+        self.client = client
+        self.model = model
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.batch_size = min(batch_size or int(os.environ.get('CLAUDE_BULK_BATCH_SIZE', '1000')), MAX_BATCH_REQUESTS)
+        self.max_open_batches = max_open_batches
+        self.poll_interval = poll_interval if poll_interval is not None else \
+            float(os.environ.get('CLAUDE_BULK_POLL_INTERVAL', '30'))
+        self.on_usage = on_usage
+        # Wraps each text in the prompt's user message template, as live classification does
+        self.render_message = render_message or (lambda text: text)
+
+    def _request(self, method: str, path: str, body: Dict[str, Any] = None) -> httpx.Response:
+        options = {'headers': BATCHES_BETA_HEADER}
+        if method == 'post':
+            return self.client.post(path, cast_to=httpx.Response, body=body, options=options)
+        return self.client.get(path, cast_to=httpx.Response, options=options)
+
+    def _submit(self, chunk: List[Dict[str, Any]]) -> str:
+        response = self._request('post', BATCHES_PATH, {
+            'requests': [
+                {
+                    'custom_id': _custom_id(index),
+                    'params': {
+                        'model': self.model,
+                        'max_tokens': self.max_tokens,
+                        'temperature': self.temperature,
+                        'system': self.system_prompt,
+                        'messages': [{'role': 'user', 'content': self.render_message(message['text'])}]
+                    }
+                }
+                for index, message in enumerate(chunk)
+            ]
+        })
+        return response.json()['id']
+
+    def _is_ended(self, batch_id: str) -> bool:
+        return self._request('get', f"{BATCHES_PATH}/{batch_id}").json()['processing_status'] == 'ended'
+
+    def _results(self, batch_id: str, message_ids: List[str]) -> List[Dict[str, Any]]:
+        response = self._request('get', f"{BATCHES_PATH}/{batch_id}/results")
+        by_custom_id = {_custom_id(index): message_id for index, message_id in enumerate(message_ids)}
+
+        results = []
+        for line in response.text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            # Batches submitted before numbered custom_ids used the message id itself
+            message_id = by_custom_id.get(entry['custom_id'], entry['custom_id'])
+            outcome = entry['result']
+            if outcome['type'] == 'succeeded':
+                message = outcome['message']
+                if self.on_usage:
+                    self.on_usage(message.get('usage', {}))
+                results.append(_result(message_id, parse_classification(message['content'][0]['text'])))
+            else:
+                error = outcome.get('error', {}).get('error', {}).get('message') or outcome['type']
+                results.append(_result(message_id, error=error))
+        return results
+
+    async def _drain_one(self, open_batches: Dict[str, List[str]],
+                         checkpoint: Optional[BulkCheckpoint]) -> List[Dict[str, Any]]:
+        """Wait for any open batch to end and return its results"""
+        while True:
+            for batch_id in list(open_batches):
+                if await asyncio.to_thread(self._is_ended, batch_id):
+                    results = await asyncio.to_thread(self._results, batch_id, open_batches.pop(batch_id))
+                    if checkpoint:
+                        # Record results before closing the batch so a crash in between loses nothing
+                        for result in results:
+                            if result['status'] == 'succeeded':
+                                checkpoint.record_result(result['message_id'], result['classification'])
+                        checkpoint.finish_batch(batch_id)
+                    return results
+            await asyncio.sleep(self.poll_interval)
+
+    async def _open_batch(self, chunk: List[Dict[str, Any]], open_batches: Dict[str, List[str]],
+                          checkpoint: Optional[BulkCheckpoint]):
+        batch_id = await asyncio.to_thread(self._submit, chunk)
+        message_ids = [m['message_id'] for m in chunk]
+        if checkpoint:
+            checkpoint.record_batch(batch_id, message_ids)
+        open_batches[batch_id] = message_ids
+        logger.info("Submitted classification batch", batch_id=batch_id, request_count=len(chunk))
+
+    async def stream(self, messages: Iterator[Dict[str, Any]], checkpoint: Optional[BulkCheckpoint]) -> AsyncIterator[Dict[str, Any]]:
+        # Batches submitted by an interrupted run are collected, not resubmitted
+        open_batches = dict(checkpoint.pending_batches) if checkpoint else {}
+
+        chunk = []
+        for message in messages:
+            chunk.append(message)
+            if len(chunk) < self.batch_size:
+                continue
+
+            while len(open_batches) >= self.max_open_batches:
+                for result in await self._drain_one(open_batches, checkpoint):
+                    yield result
+
+            await self._open_batch(chunk, open_batches, checkpoint)
+            chunk = []
+
+        if chunk:
+            await self._open_batch(chunk, open_batches, checkpoint)
+
+        while open_batches:
+            for result in await self._drain_one(open_batches, checkpoint):
+                yield result
+
+
+class BulkClassifier:
+    """Streams classifications for an iterator of messages, skipping checkpointed ones"""
+
+    def __init__(self, backend: Any, checkpoint_path: str = None):
+        self.backend = backend
+        self.checkpoint = BulkCheckpoint(checkpoint_path) if checkpoint_path else None
+        self.stats = {'classified': 0, 'errored': 0, 'skipped': 0, 'elapsed_seconds': 0.0}
+
+    @property
+    def messages_per_minute(self) -> float:
+        elapsed = self.stats['elapsed_seconds']
+        return (self.stats['classified'] + self.stats['errored']) * 60 / elapsed if elapsed else 0.0
+
+    def _remaining(self, messages: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        skip = set()
+        if self.checkpoint:
+            skip = self.checkpoint.pending_message_ids()
+
+        for message in messages:
+            if self.checkpoint and (self.checkpoint.is_done(message['message_id']) or message['message_id'] in skip):
+                self.stats['skipped'] += 1
+                continue
+            yield message
+
+    async def run(self, messages: Iterable[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        start_time = time.perf_counter()
+        try:
+            async for result in self.backend.stream(self._remaining(messages), self.checkpoint):
+                if result['status'] == 'succeeded':
+                    self.stats['classified'] += 1
+                    if self.checkpoint and not self.checkpoint.is_done(result['message_id']):
+                        self.checkpoint.record_result(result['message_id'], result['classification'])
+                else:
+                    self.stats['errored'] += 1
+
+                self.stats['elapsed_seconds'] = time.perf_counter() - start_time
+                yield result
+        finally:
+            self.stats['elapsed_seconds'] = time.perf_counter() - start_time
+            if self.checkpoint:
+                self.checkpoint.close()
+
+            metrics.add_metric(name="BulkMessagesClassified", unit=MetricUnit.Count, value=self.stats['classified'])
+            metrics.add_metric(name="BulkClassificationErrors", unit=MetricUnit.Count, value=self.stats['errored'])
+            metrics.add_metric(name="BulkMessagesPerMinute", unit=MetricUnit.Count, value=self.messages_per_minute)
+            logger.info("Bulk classification finished",
+                        backend=self.backend.name,
+                        messages_per_minute=round(self.messages_per_minute, 1),
+                        **self.stats)
+
+
+# Export main classes
+__all__ = [
+    'BulkClassifier', 'BulkCheckpoint', 'LiveBackend', 'StubBackend', 'MessageBatchesBackend',
+    'parse_classification', 'FALLBACK_CLASSIFICATION'
+]
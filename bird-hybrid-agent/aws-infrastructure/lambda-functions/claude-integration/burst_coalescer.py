@@ -0,0 +1,237 @@
+"""
+Inbound Burst Coalescing for the Webhook Processor
+Users often split one request over several quick messages ("hola" /
+"tengo una fuga" / "en el baño" / "urgente"). Each webhook appends its
+message to a per-conversation buffer in DynamoDB; only the newest message
+of a burst waits out the quiet period and then takes the whole burst, so
+it is classified, stored and routed once. Added delay is capped by
+max_delay_seconds, and emergency keywords flush the burst immediately.
+If the flushing invocation dies first, the next message of the
+conversation or the scheduled sweep takes the burst instead.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+# Words that must never wait for the rest of a burst (accent-folded, lowercase)
+EMERGENCY_KEYWORDS = (
+    'urgente', 'emergencia', 'fuga', 'inundacion', 'incendio', 'fuego', 'humo',
+    'gas', 'corto circuito', 'chispas', 'atrapado', 'robo'
+)
+
+# Whole words, plurals included, so 'gas' does not match 'gastos'
+EMERGENCY_PATTERN = re.compile(r'\b(?:' + '|'.join(map(re.escape, EMERGENCY_KEYWORDS)) + r')(?:e?s)?\b')
+
+MEDIA_TYPES = ('image', 'voice', 'document', 'video')
+
+
+def fold(text: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def has_emergency_keyword(text: str) -> bool:
+    return EMERGENCY_PATTERN.search(fold(text or '')) is not None
+
+
+def _attachments(message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if message.get('attachments'):
+        return list(message['attachments'])
+    if message.get('type') in MEDIA_TYPES:
+        return [{key: value for key, value in message.items() if key != 'text'}]
+    return []
+
+
+@dataclass(frozen=True, slots=True)
+class Burst:
+    """Webhook payloads of one conversation to be handled as a single turn"""
+    conversation_id: str
+    messages: List[Dict[str, Any]]  # webhook payloads, in arrival order
+    reason: str  # quiet, max_delay, emergency, unbuffered or recovered
+
+    def merged(self) -> Dict[str, Any]:
+        """One webhook payload standing for the whole burst
+
+        The texts are joined in order. The last media message, if any,
+        supplies the message type and media fields, and the media of every
+        message is listed under 'attachments'.
+        """
+
+        if len(self.messages) == 1:
+            return self.messages[0]
+
+        messages = [payload.get('message', {}) for payload in self.messages]
+        base = next((message for message in reversed(messages) if message.get('type') in MEDIA_TYPES), messages[-1])
+        text = '\n'.join(message['text'] for message in messages if message.get('text'))
+        merged = {**base, 'text': text, 'burst_size': len(messages)}
+
+        attachments = [attachment for message in messages for attachment in _attachments(message)]
+        if attachments:
+            merged['attachments'] = attachments
+
+        return {
+            **self.messages[-1],
+            'message': merged,
+            'burst': messages
+        }
+
+
+class BurstCoalescer:
+    """Per-conversation message buffer shared by concurrent webhook invocations
+
+    Each burst item holds the JSON payloads, a burst_id and a version that
+    every append bumps. The invocation whose append is still the newest
+    after the quiet period takes the burst with a delete; everyone else
+    returns without processing, their message travels with that burst.
+
+    A burst left behind by an invocation that timed out or crashed is taken
+    by the next append (its max_delay has passed), or by sweep() once it is
+    stale_seconds old.
+    """
+
+    def __init__(self, table_name: str = None, quiet_seconds: float = None, max_delay_seconds: float = None,
+                 stale_seconds: float = None):
+        self.table = boto3.resource('dynamodb').Table(
+            table_name or os.environ.get('BURST_TABLE', 'bird-message-bursts')
+        )
+        self.quiet_seconds = quiet_seconds if quiet_seconds is not None \
+            else float(os.environ.get('BURST_QUIET_SECONDS', '2.0'))
+        self.max_delay_seconds = max_delay_seconds if max_delay_seconds is not None \
+            else float(os.environ.get('BURST_MAX_DELAY_SECONDS', '6.0'))
+        self.stale_seconds = stale_seconds if stale_seconds is not None \
+            else float(os.environ.get('BURST_STALE_SECONDS', '60'))
+
+    async def add(self, conversation_id: str, message_data: Dict[str, Any], urgent: bool = None) -> Optional[Burst]:
+        """Buffer a webhook payload; returns the burst to process now, or None if a later message carries it
+
+        urgent overrides the built-in emergency keyword check, e.g. with an urgency scorer's verdict.
+        """
+
+        now = time.time()
+        try:
+            item = await asyncio.to_thread(self._append, conversation_id, message_data, now)
+        except ClientError as e:
+            # Without the buffer every message is simply its own turn
+            logger.warning("Burst buffer unavailable, processing message alone", error=str(e))
+            return Burst(conversation_id, [message_data], 'unbuffered')
+
+        marker = (item['burst_id'], int(item['version']))
+        if urgent is None:
+            urgent = has_emergency_keyword(message_data.get('message', {}).get('text', ''))
+        if urgent:
+            reason = 'emergency'
+        else:
+            wait = min(self.quiet_seconds, float(item['first_at']) + self.max_delay_seconds - now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                current = await asyncio.to_thread(self._current, conversation_id)
+                if current != marker:
+                    # A newer message (or an emergency flush) took over this burst
+                    metrics.add_metric(name="BurstMessageBuffered", unit=MetricUnit.Count, value=1)
+                    return None
+                reason = 'quiet'
+            else:
+                reason = 'max_delay'
+
+        burst = await asyncio.to_thread(self._take, conversation_id, reason)
+        if burst is None:
+            metrics.add_metric(name="BurstMessageBuffered", unit=MetricUnit.Count, value=1)
+            return None
+
+        metrics.add_metric(name="BurstFlushed", unit=MetricUnit.Count, value=1)
+        metrics.add_metric(name="BurstSize", unit=MetricUnit.Count, value=len(burst.messages))
+        logger.info("Burst flushed", conversation_id=conversation_id, reason=reason, size=len(burst.messages))
+        return burst
+
+    def sweep(self) -> List[Burst]:
+        """Take every burst whose flushing invocation never came back
+
+        Run on a schedule. stale_seconds must exceed max_delay_seconds plus
+        the quiet period, so bursts that still have a live owner are left alone.
+        """
+
+        cutoff = time.time() - self.stale_seconds
+        stale = []
+        kwargs = {'ProjectionExpression': 'conversation_id, first_at'}
+        while True:
+            page = self.table.scan(**kwargs)
+            stale.extend(item for item in page.get('Items', []) if float(item['first_at']) < cutoff)
+            if 'LastEvaluatedKey' not in page:
+                break
+            kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+        bursts = []
+        for item in stale:
+            burst = self._take(item['conversation_id'], 'recovered', first_at=item['first_at'])
+            if burst is not None:
+                bursts.append(burst)
+
+        if bursts:
+            metrics.add_metric(name="BurstRecovered", unit=MetricUnit.Count, value=len(bursts))
+            logger.warning("Recovered abandoned bursts", count=len(bursts))
+        return bursts
+
+    def _append(self, conversation_id: str, message_data: Dict[str, Any], now: float) -> Dict[str, Any]:
+        return self.table.update_item(
+            Key={'conversation_id': conversation_id},
+            UpdateExpression='SET messages = list_append(if_not_exists(messages, :empty), :message), '
+                             'burst_id = if_not_exists(burst_id, :burst_id), '
+                             'first_at = if_not_exists(first_at, :now), #ttl = :ttl '
+                             'ADD #version :one',
+            ExpressionAttributeNames={'#ttl': 'ttl', '#version': 'version'},
+            ExpressionAttributeValues={
+                ':empty': [],
+                ':message': [json.dumps(message_data, ensure_ascii=False)],
+                ':burst_id': uuid.uuid4().hex,
+                ':now': str(now),
+                ':ttl': int(now) + 3600,
+                ':one': 1
+            },
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+
+    def _current(self, conversation_id: str) -> Optional[tuple]:
+        item = self.table.get_item(Key={'conversation_id': conversation_id}, ConsistentRead=True,
+                                   ProjectionExpression='burst_id, #version',
+                                   ExpressionAttributeNames={'#version': 'version'}).get('Item')
+        return (item['burst_id'], int(item['version'])) if item else None
+
+    def _take(self, conversation_id: str, reason: str, first_at: str = None) -> Optional[Burst]:
+        # Whoever deletes the item owns every message appended to it so far
+        kwargs = {}
+        if first_at is not None:
+            # Only the burst that was found stale, not a fresh one started since
+            kwargs = {'ConditionExpression': 'first_at = :first_at',
+                      'ExpressionAttributeValues': {':first_at': first_at}}
+        try:
+            old = self.table.delete_item(Key={'conversation_id': conversation_id}, ReturnValues='ALL_OLD',
+                                         **kwargs).get('Attributes')
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return None
+        if not old:
+            return None
+        return Burst(conversation_id, [json.loads(message) for message in old['messages']], reason)
+
+
+# Export main classes
+__all__ = ['BurstCoalescer', 'Burst', 'has_emergency_keyword', 'EMERGENCY_KEYWORDS']
@@ -7,7 +7,9 @@ prompt optimization, and response processing.
 import os
 import json
 import time
-from typing import Dict, List, Any, Optional, Union
+import asyncio
+from typing import Dict, List, Any, Optional, Union, Iterable, AsyncIterator
+from types import SimpleNamespace
 from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
 import anthropic
@@ -18,12 +20,24 @@ from botocore.exceptions import ClientError
 from aws_lambda_powertools import Logger, Tracer, Metrics
 from aws_lambda_powertools.metrics import MetricUnit
 
+from request_coalescer import RequestCoalescer, build_request_key
+from image_preprocessor import ImagePreprocessor
+from claude_resilience import ResilientCaller
+from admission_control import AdmissionController, DEFAULT_PRIORITY
+from image_preprocessor import MAX_IMAGE_TOKENS
+from usage_accounting import UsageAccountant, extract_usage, empty_usage, USAGE_COUNTERS
+from prompt_registry import get_prompt_registry
+from response_cache import ResponseCache
+from speculation import SpeculationController
+from compact_records import ConversationMessage, compact_messages, messages_to_items
+from bulk_classifier import BulkClassifier, LiveBackend, StubBackend, MessageBatchesBackend, parse_classification
+
 # Initialize observability tools
 logger = Logger(service="claude-integration")
 tracer = Tracer(service="claude-integration") 
 metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
 
-@dataclass
+@dataclass(slots=True)
 class ConversationContext:
     """Conversation context structure for Claude interactions"""
     conversation_id: str
@@ -35,8 +49,43 @@ class ConversationContext:
     last_updated: datetime = None
     total_tokens_used: int = 0
     conversation_summary: str = ""
+    input_tokens_used: int = 0
+    output_tokens_used: int = 0
+    cache_read_tokens_used: int = 0
+    cache_write_tokens_used: int = 0
+    
+    @classmethod
+    def from_dynamodb_item(cls, item: Dict[str, Any]) -> 'ConversationContext':
+        """Build a context from a stored item, compacting its message history"""
+        return cls(
+            conversation_id=item['conversation_id'],
+            user_id=item.get('user_id', ''),
+            messages=compact_messages(item.get('messages', [])),
+            user_preferences=item.get('user_preferences', {}),
+            property_interests=item.get('property_interests', []),
+            session_start=datetime.fromisoformat(item['session_start']) if 'session_start' in item else datetime.now(),
+            last_updated=datetime.fromisoformat(item['last_updated']) if 'last_updated' in item else datetime.now(),
+            total_tokens_used=int(item.get('total_tokens_used', 0)),
+            conversation_summary=item.get('conversation_summary', ''),
+            input_tokens_used=int(item.get('input_tokens_used', 0)),
+            output_tokens_used=int(item.get('output_tokens_used', 0)),
+            cache_read_tokens_used=int(item.get('cache_read_tokens_used', 0)),
+            cache_write_tokens_used=int(item.get('cache_write_tokens_used', 0))
+        )
+    
+    def to_dynamodb_item(self) -> Dict[str, Any]:
+        """Attributes overwritten on save; token counters are only ever incremented and are not included"""
+        return {
+            'user_id': self.user_id,
+            'messages': messages_to_items(self.messages),
+            'user_preferences': self.user_preferences or {},
+            'property_interests': self.property_interests or [],
+            'session_start': self.session_start.isoformat() if self.session_start else datetime.now().isoformat(),
+            'last_updated': self.last_updated.isoformat(),
+            'conversation_summary': self.conversation_summary
+        }
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ClaudeRequest:
     """Structure for Claude API requests"""
     prompt_type: str  # intent-classification, response-generation, multimodal-processing
@@ -47,8 +96,11 @@ class ClaudeRequest:
     system_prompt: str = ""
     include_images: bool = False
     image_data: List[str] = None
+    priority: str = DEFAULT_PRIORITY  # emergency, maintenance, leasing, conversational, bulk, marketing
+    persist_context: bool = True  # False for speculative drafts, committed only if kept
+    history_content: str = None  # stored in the conversation instead of a templated content
 
-@dataclass  
+@dataclass(frozen=True, slots=True)
 class ClaudeResponse:
     """Structure for Claude API responses"""
     content: str
@@ -86,17 +138,7 @@ class ClaudeContextManager:
             item = response['Item']
             
             # Convert to ConversationContext object
-            context = ConversationContext(
-                conversation_id=item['conversation_id'],
-                user_id=item.get('user_id', ''),
-                messages=item.get('messages', []),
-                user_preferences=item.get('user_preferences', {}),
-                property_interests=item.get('property_interests', []),
-                session_start=datetime.fromisoformat(item.get('session_start', datetime.now().isoformat())),
-                last_updated=datetime.fromisoformat(item.get('last_updated', datetime.now().isoformat())),
-                total_tokens_used=item.get('total_tokens_used', 0),
-                conversation_summary=item.get('conversation_summary', '')
-            )
+            context = ConversationContext.from_dynamodb_item(item)
             
             return context
             
@@ -105,27 +147,41 @@ class ClaudeContextManager:
             return None
     
     @tracer.capture_method 
-    def save_conversation_context(self, context: ConversationContext):
-        """Save conversation context to storage"""
+    def save_conversation_context(self, context: ConversationContext, usage: Dict[str, int] = None):
+        """Save conversation context to storage, atomically adding this turn's token usage"""
         try:
             # Update timestamp
             context.last_updated = datetime.now()
             
-            # Convert to DynamoDB item
+            # Attributes to overwrite; token counters are only ever incremented
             item = {
-                'conversation_id': context.conversation_id,
-                'user_id': context.user_id,
-                'messages': context.messages,
-                'user_preferences': context.user_preferences or {},
-                'property_interests': context.property_interests or [],
-                'session_start': context.session_start.isoformat() if context.session_start else datetime.now().isoformat(),
-                'last_updated': context.last_updated.isoformat(),
-                'total_tokens_used': context.total_tokens_used,
-                'conversation_summary': context.conversation_summary,
+                **context.to_dynamodb_item(),
                 'ttl': int(time.time()) + (30 * 24 * 3600)  # 30 days TTL
             }
             
-            self.context_table.put_item(Item=item)
+            update_expression = "SET " + ", ".join(f"#{name} = :{name}" for name in item)
+            attribute_names = {f"#{name}": name for name in item}
+            attribute_values = {f":{name}": value for name, value in item.items()}
+            
+            if usage:
+                update_expression += " ADD " + ", ".join(f"#{counter}_used :{counter}_used" for counter in USAGE_COUNTERS)
+                for counter in USAGE_COUNTERS:
+                    attribute_names[f"#{counter}_used"] = f"{counter}_used"
+                    attribute_values[f":{counter}_used"] = usage[counter]
+            
+            response = self.context_table.update_item(
+                Key={'conversation_id': context.conversation_id},
+                UpdateExpression=update_expression,
+                ExpressionAttributeNames=attribute_names,
+                ExpressionAttributeValues=attribute_values,
+                ReturnValues='UPDATED_NEW' if usage else 'NONE'
+            )
+            
+            # Adopt the stored totals, which include turns saved by other workers
+            if usage:
+                attributes = response.get('Attributes', {})
+                for counter in USAGE_COUNTERS:
+                    setattr(context, f"{counter}_used", int(attributes.get(f"{counter}_used", 0)))
             
             logger.info(f"Saved context for conversation {context.conversation_id}")
             
@@ -134,7 +190,7 @@ class ClaudeContextManager:
             raise
     
     @tracer.capture_method
-    def optimize_context_for_claude(self, context: ConversationContext) -> List[Dict[str, str]]:
+    def optimize_context_for_claude(self, context: ConversationContext, max_messages: int = None) -> List[Dict[str, str]]:
         """Optimize conversation context for Claude API call"""
         
         # If we have too many messages, summarize older ones
@@ -152,7 +208,7 @@ class ClaudeContextManager:
             })
         
         # Add recent messages
-        recent_messages = context.messages[-self.max_messages_in_context:]
+        recent_messages = context.messages[-(max_messages or self.max_messages_in_context):]
         
         for msg in recent_messages:
             claude_messages.append({
@@ -178,19 +234,7 @@ class ClaudeContextManager:
             for msg in messages_to_summarize
         ])
         
-        summary_prompt = f"""
-        Resume esta conversación de WhatsApp entre un usuario y el asistente de UrbanHub, 
-        manteniendo información clave sobre:
-        - Preferencias de propiedades mencionadas
-        - Presupuesto y requisitos
-        - Propiedades específicas discutidas
-        - Decisiones o compromisos establecidos
-        - Estado actual de la búsqueda
-        
-        Conversación:
-        {messages_text}
-        
-        Resumen:"""
+        summary_prompt = get_prompt_registry().get('conversation-summary').render_user(messages_text=messages_text)
         
         try:
             # Use Claude to create summary
@@ -200,6 +244,7 @@ class ClaudeContextManager:
                 model="claude-3-5-sonnet-20241022",
                 max_tokens=500,
                 temperature=0.1,
+                system=get_prompt_registry().get('conversation-summary').render_system(),
                 messages=[{"role": "user", "content": summary_prompt}]
             )
             
@@ -226,14 +271,38 @@ class ClaudeClient:
     """Main Claude API client with advanced features"""
     
     def __init__(self):
-        self.client = anthropic.Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'])
+        # SDK retries are disabled; the resilience layer owns retries and backoff
+        self.client = anthropic.Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'], max_retries=0)
         self.context_manager = ClaudeContextManager(
             dynamodb_table=os.environ.get('CONTEXT_TABLE', 'conversation-context'),
             s3_bucket=os.environ.get('CONTEXT_BUCKET', 'claude-context-storage')
         )
         
-        # Load system prompts
-        self.system_prompts = self._load_system_prompts()
+        # Single-flight coalescing of identical in-flight requests
+        self.coalesce_requests = os.environ.get('CLAUDE_COALESCE_REQUESTS', 'true').lower() == 'true'
+        self.request_coalescer = RequestCoalescer()
+        
+        # Image normalization and downscaling for multimodal requests
+        self.image_preprocessor = ImagePreprocessor()
+        
+        # Retries, hedging and circuit breaker for outbound calls
+        self.resilience = ResilientCaller()
+        
+        # RPM/ITPM/OTPM admission control, shared across workers when Redis is configured
+        self.admission_controller = AdmissionController.from_environment()
+        
+        # Token accounting and budgets
+        self.usage_accountant = UsageAccountant()
+        self.budget_model = os.environ.get('CLAUDE_BUDGET_MODEL', 'claude-3-5-haiku-20241022')
+        self.budget_max_context_messages = int(os.environ.get('CLAUDE_BUDGET_MAX_CONTEXT_MESSAGES', '10'))
+        
+        # Vetted FAQ answers served locally for paraphrased questions
+        self.response_cache_enabled = os.environ.get('CLAUDE_RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+        self.response_cache = ResponseCache()
+        
+        # Draft replies in parallel with classification (off by default: failed guesses cost tokens)
+        self.speculation_enabled = os.environ.get('CLAUDE_SPECULATION_ENABLED', 'false').lower() == 'true'
+        self.speculation = SpeculationController()
         
         # Model configurations
         self.model_config = {
@@ -253,16 +322,15 @@ class ClaudeClient:
                 'max_tokens': 4000
             }
         }
+        
+        # Load system prompts (versioned by content hash)
+        self.system_prompts = self._load_system_prompts()
     
     def _load_system_prompts(self) -> Dict[str, str]:
-        """Load system prompts from configuration"""
-        # In production, these would be loaded from S3 or parameter store
-        # For now, return basic prompts
-        return {
-            'intent-classification': "You are an expert intent classifier for UrbanHub's AI system.",
-            'response-generation': "You are UrbanHub's conversational AI assistant.",
-            'multimodal-processing': "You are UrbanHub's multimodal content analysis specialist."
-        }
+        """Load system prompts from the claude-prompts registry"""
+        registry = get_prompt_registry()
+        self.prompt_versions = {name: registry.get(name).version for name in self.model_config}
+        return {name: registry.get(name).render_system() for name in self.model_config}
     
     @tracer.capture_method
     async def process_request(self, request: ClaudeRequest) -> ClaudeResponse:
@@ -274,68 +342,151 @@ class ClaudeClient:
             # Get model configuration
             config = self.model_config.get(request.prompt_type, self.model_config['response-generation'])
             
+            # Conversations over budget get a cheaper model and tighter context
+            budget_exceeded = None
+            if request.context:
+                budget_exceeded = self.usage_accountant.check_budget(
+                    request.context.conversation_id,
+                    request.context.user_id,
+                    request.context.total_tokens_used
+                )
+            if budget_exceeded:
+                config = {**config, 'model': self.budget_model}
+            
             # Prepare messages for Claude
-            messages = self._prepare_messages(request)
+            messages = self._prepare_messages(
+                request,
+                max_context_messages=self.budget_max_context_messages if budget_exceeded else None
+            )
             
             # Get system prompt
             system_prompt = request.system_prompt or self.system_prompts.get(request.prompt_type, "")
             
-            # Make Claude API call
-            if request.include_images and request.image_data:
-                response = await self._call_claude_with_images(
+            # Only the caller that actually made the API call is charged for it
+            made_call = False
+            
+            async def call_claude():
+                nonlocal made_call
+                made_call = True
+                return await self._admitted_call(request, messages, system_prompt, config)
+            
+            # Make Claude API call, sharing it with identical requests already in flight
+            if self.coalesce_requests:
+                request_key = build_request_key(
+                    prompt_type=request.prompt_type,
+                    model=config['model'],
                     messages=messages,
                     system_prompt=system_prompt,
-                    config=config,
-                    image_data=request.image_data
+                    temperature=config['temperature'],
+                    max_tokens=config['max_tokens'],
+                    image_data=request.image_data if request.include_images else None
                 )
+                response = await self.request_coalescer.run(request_key, call_claude)
             else:
-                response = await self._call_claude_text_only(
-                    messages=messages,
-                    system_prompt=system_prompt,
-                    config=config
-                )
+                response = await call_claude()
             
             # Calculate processing time
             processing_time_ms = int((time.time() - start_time) * 1000)
             
+            usage = extract_usage(response)
+            charged_usage = usage if made_call else empty_usage()
+            
             # Update context if provided
-            if request.context:
-                await self._update_conversation_context(request.context, request.content, response.content[0].text)
+            if request.context and request.persist_context:
+                await self._update_conversation_context(request.context, request.history_content or request.content,
+                                                        response.content[0].text, charged_usage)
+            
+            if made_call:
+                self.usage_accountant.record_usage(
+                    request.context.user_id if request.context else None,
+                    usage,
+                    config['model']
+                )
             
             # Create response object
             claude_response = ClaudeResponse(
                 content=response.content[0].text,
-                usage={
-                    'input_tokens': response.usage.input_tokens,
-                    'output_tokens': response.usage.output_tokens,
-                    'total_tokens': response.usage.input_tokens + response.usage.output_tokens
-                },
+                usage=usage,
                 model_used=config['model'],
                 processing_time_ms=processing_time_ms,
                 confidence_score=self._calculate_confidence_score(response.content[0].text),
                 metadata={
                     'prompt_type': request.prompt_type,
-                    'context_used': request.context is not None
+                    'prompt_version': self.prompt_versions.get(request.prompt_type) if not request.system_prompt else None,
+                    'context_used': request.context is not None,
+                    'coalesced': not made_call,
+                    'budget_exceeded': budget_exceeded
                 }
             )
             
             # Add metrics
-            metrics.add_metric("ClaudeAPICall", 1, MetricUnit.Count)
-            metrics.add_metric("ClaudeLatency", processing_time_ms, MetricUnit.Milliseconds)
-            metrics.add_metric("ClaudeTokensUsed", claude_response.usage['total_tokens'], MetricUnit.Count)
+            metrics.add_metric(name="ClaudeAPICall", unit=MetricUnit.Count, value=1)
+            metrics.add_metric(name="ClaudeLatency", unit=MetricUnit.Milliseconds, value=processing_time_ms)
+            metrics.add_metric(name="ClaudeTokensUsed", unit=MetricUnit.Count, value=charged_usage['total_tokens'])
             
             return claude_response
             
         except Exception as e:
             logger.error(f"Claude API request failed: {str(e)}")
-            metrics.add_metric("ClaudeAPIErrors", 1, MetricUnit.Count)
+            metrics.add_metric(name="ClaudeAPIErrors", unit=MetricUnit.Count, value=1)
             raise
     
+    async def _admitted_call(self, request: ClaudeRequest, messages: List[Dict], system_prompt: str, config: Dict) -> Any:
+        """Call Claude with retries, admitting and reconciling every attempt against the rate budget
+        
+        Retries and hedged duplicates are real requests, so each one waits for
+        its own budget instead of riding on the first attempt's reservation.
+        """
+        
+        input_tokens = self._estimate_input_tokens(request, messages, system_prompt)
+        
+        async def admitted_attempt():
+            admission = await self.admission_controller.admit(
+                input_tokens=input_tokens,
+                output_tokens=config['max_tokens'],
+                priority=request.priority
+            )
+            try:
+                response = await self._call_claude(request, messages, system_prompt, config)
+            except BaseException:
+                # Failed or cancelled (a losing hedge): the request and its prompt count, unsent output does not
+                self.admission_controller.settle(admission, input_tokens, 0)
+                raise
+            self.admission_controller.settle(admission, response.usage.input_tokens, response.usage.output_tokens)
+            return response
+        
+        return await self.resilience.call(admitted_attempt)
+    
+    def _estimate_input_tokens(self, request: ClaudeRequest, messages: List[Dict], system_prompt: str) -> int:
+        """Estimate input tokens before sending, for admission control"""
+        
+        text = system_prompt + "".join(str(msg.get('content', '')) for msg in messages)
+        image_count = len(request.image_data or []) if request.include_images else 0
+        
+        return self.context_manager.estimate_token_count(text) + image_count * MAX_IMAGE_TOKENS
+    
+    async def _call_claude(self, request: ClaudeRequest, messages: List[Dict], system_prompt: str, config: Dict) -> Any:
+        """Dispatch to the text-only or multimodal Claude API call"""
+        
+        if request.include_images and request.image_data:
+            return await self._call_claude_with_images(
+                messages=messages,
+                system_prompt=system_prompt,
+                config=config,
+                image_data=request.image_data
+            )
+        
+        return await self._call_claude_text_only(
+            messages=messages,
+            system_prompt=system_prompt,
+            config=config
+        )
+    
     @tracer.capture_method
     async def _call_claude_text_only(self, messages: List[Dict], system_prompt: str, config: Dict) -> Any:
         """Make text-only Claude API call"""
         
-        return self.client.messages.create(
+        return await self._create_message(
             model=config['model'],
             max_tokens=config['max_tokens'],
             temperature=config['temperature'],
@@ -351,22 +502,26 @@ class ClaudeClient:
         if messages and image_data:
             last_message = messages[-1]
             if last_message.get('role') == 'user':
+                # Detect real format, fix orientation and downscale before upload
+                prepared_images = await self.image_preprocessor.prepare_images(image_data)
+                
                 # Create multimodal content
                 content_parts = [{"type": "text", "text": last_message['content']}]
                 
-                for img_data in image_data:
+                for image in prepared_images:
                     content_parts.append({
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": img_data
+                            "media_type": image.media_type,
+                            "data": image.data
                         }
                     })
                 
-                last_message['content'] = content_parts
+                # Build a new message list so retries and hedges start from the original
+                messages = messages[:-1] + [{**last_message, 'content': content_parts}]
         
-        return self.client.messages.create(
+        return await self._create_message(
             model=config['model'],
             max_tokens=config['max_tokens'],
             temperature=config['temperature'],
@@ -374,14 +529,27 @@ class ClaudeClient:
             messages=messages
         )
     
-    def _prepare_messages(self, request: ClaudeRequest) -> List[Dict[str, str]]:
+    async def _create_message(self, **kwargs) -> Any:
+        """Call the Messages API and feed its rate-limit headers to admission control"""
+        
+        # Run the blocking SDK call off the event loop so concurrent requests overlap
+        try:
+            raw_response = await asyncio.to_thread(self.client.messages.with_raw_response.create, **kwargs)
+        except anthropic.APIStatusError as e:
+            self.admission_controller.update_from_headers(e.response.headers)
+            raise
+        
+        self.admission_controller.update_from_headers(raw_response.headers)
+        return raw_response.parse()
+    
+    def _prepare_messages(self, request: ClaudeRequest, max_context_messages: int = None) -> List[Dict[str, str]]:
         """Prepare messages for Claude API call"""
         
         messages = []
         
         # Add conversation context if available
         if request.context:
-            context_messages = self.context_manager.optimize_context_for_claude(request.context)
+            context_messages = self.context_manager.optimize_context_for_claude(request.context, max_context_messages)
             messages.extend(context_messages)
         
         # Add current message
@@ -392,17 +560,18 @@ class ClaudeClient:
         
         return messages
     
-    async def _update_conversation_context(self, context: ConversationContext, user_message: str, assistant_response: str):
-        """Update conversation context with new exchange"""
+    async def _update_conversation_context(self, context: ConversationContext, user_message: str, assistant_response: str,
+                                           usage: Dict[str, int] = None, assistant_metadata: Dict[str, Any] = None):
+        """Update conversation context with new exchange and its token usage"""
         
         # Add messages to context
         context.messages.extend([
-            {"role": "user", "content": user_message, "timestamp": datetime.now().isoformat()},
-            {"role": "assistant", "content": assistant_response, "timestamp": datetime.now().isoformat()}
+            ConversationMessage("user", user_message, datetime.now().isoformat()),
+            ConversationMessage("assistant", assistant_response, datetime.now().isoformat(), assistant_metadata)
         ])
         
         # Save updated context
-        self.context_manager.save_conversation_context(context)
+        self.context_manager.save_conversation_context(context, usage)
     
     def _calculate_confidence_score(self, response: str) -> float:
         """Calculate confidence score based on response characteristics"""
@@ -425,35 +594,110 @@ class ClaudeClient:
     # Utility methods for specific prompt types
     
     @tracer.capture_method
-    async def classify_intent(self, message: str, context: ConversationContext = None) -> Dict[str, Any]:
-        """Classify user intent using Claude"""
+    async def classify_intent(self, message: str, context: ConversationContext = None, priority: str = DEFAULT_PRIORITY) -> Dict[str, Any]:
+        """Classify user intent using Claude
+        
+        The message goes through the prompt's user message template, like the
+        webhook's classifier, so the prompt version in the response metadata
+        describes what was actually sent.
+        """
         
         request = ClaudeRequest(
             prompt_type="intent-classification",
-            content=message,
+            content=self._render_classification_message(message),
+            history_content=message,
             context=context,
             temperature=0.1,
-            max_tokens=1000
+            max_tokens=1000,
+            priority=priority
         )
         
         response = await self.process_request(request)
         
-        try:
-            # Parse JSON response
-            classification = json.loads(response.content)
-            return classification
-        except json.JSONDecodeError:
-            # Fallback classification
-            logger.warning("Failed to parse intent classification JSON")
-            return {
-                "intent": "others",
-                "confidence": 0.5,
-                "routing_recommendation": "conversation-ai"
-            }
+        # Parse JSON response, falling back to 'others'
+        return parse_classification(response.content)
+    
+    @staticmethod
+    def _render_classification_message(message: str) -> str:
+        """The intent prompt's user message template, without sender or conversation context"""
+        return get_prompt_registry().get('intent-classification').render_user(
+            message_text=message,
+            sender_name='',
+            message_context={}
+        )
+    
+    async def classify_intents_bulk(self, messages: Iterable[Dict[str, Any]], backend: str = 'live',
+                                    concurrency: int = None, checkpoint_path: str = None,
+                                    classifier: BulkClassifier = None) -> AsyncIterator[Dict[str, Any]]:
+        """Reclassify many messages ({'message_id', 'text'}), streaming results as they finish
+        
+        backend: 'live' (bounded concurrency on the Messages API), 'batch'
+        (Message Batches API, cheaper but minutes to hours) or 'stub' (no API calls).
+        checkpoint_path makes the job resumable: finished messages are skipped on rerun.
+        """
+        
+        if classifier is None:
+            if backend == 'live':
+                bulk_backend = LiveBackend(lambda text: self.classify_intent(text, priority='bulk'), concurrency)
+            elif backend == 'batch':
+                config = self.model_config['intent-classification']
+                bulk_backend = MessageBatchesBackend(
+                    self.client,
+                    model=config['model'],
+                    system_prompt=self.system_prompts['intent-classification'],
+                    max_tokens=config['max_tokens'],
+                    temperature=config['temperature'],
+                    on_usage=self._record_batch_usage,
+                    render_message=self._render_classification_message
+                )
+            elif backend == 'stub':
+                bulk_backend = StubBackend(concurrency=concurrency)
+            else:
+                raise ValueError(f"Unknown bulk classification backend: {backend}")
+            classifier = BulkClassifier(bulk_backend, checkpoint_path)
+        
+        async for result in classifier.run(messages):
+            yield result
+    
+    def _record_batch_usage(self, usage: Dict[str, Any]):
+        """Charge a Message Batches result to the daily rollup"""
+        self.usage_accountant.record_usage(
+            None,
+            extract_usage(SimpleNamespace(usage=SimpleNamespace(**usage))),
+            self.model_config['intent-classification']['model']
+        )
+    
+    def _cached_answer(self, message: str, intent: str, property_id: str = None,
+                       property_data: Dict[str, Any] = None):
+        """Vetted FAQ answer for the message, after dropping answers vetted against stale property data"""
+        
+        if not (self.response_cache_enabled and intent):
+            return None
+        if property_id and property_data is not None:
+            self.response_cache.sync_property(property_id, property_data)
+        return self.response_cache.lookup(message, intent, property_id)
     
     @tracer.capture_method
-    async def generate_response(self, message: str, context: ConversationContext = None) -> str:
-        """Generate conversational response using Claude"""
+    async def generate_response(self, message: str, context: ConversationContext = None,
+                                intent: str = None, property_id: str = None,
+                                property_data: Dict[str, Any] = None) -> str:
+        """Generate conversational response using Claude
+        
+        When the caller knows the intent (and optionally the property), vetted FAQ
+        answers for paraphrases of the same question are served without a Claude call.
+        Pass the property's current data so answers vetted against older data are
+        invalidated instead of served.
+        """
+        
+        match = self._cached_answer(message, intent, property_id, property_data)
+        if match:
+            if context:
+                # The matched key is stored with the answer so it can be audited later
+                await self._update_conversation_context(
+                    context, message, match.answer, empty_usage(),
+                    assistant_metadata={'cache_key': match.key}
+                )
+            return match.answer
         
         request = ClaudeRequest(
             prompt_type="response-generation", 
@@ -466,6 +710,91 @@ class ClaudeClient:
         response = await self.process_request(request)
         return response.content
     
+    @tracer.capture_method
+    async def classify_and_respond(self, message: str, context: ConversationContext = None,
+                                   property_id: str = None, property_data: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Classify a message and generate the reply for its intent
+        
+        With speculation enabled, a draft reply for the keyword-predicted intent runs
+        in parallel with classification. It is kept when Claude agrees and cancelled
+        otherwise, saving one model round trip on correct guesses.
+        """
+        
+        predicted = None
+        if self.speculation_enabled:
+            over_budget = context and self.usage_accountant.conversation_budget and \
+                context.total_tokens_used >= self.usage_accountant.conversation_budget
+            if not over_budget:
+                predicted = self.speculation.choose_intent(message)
+        
+        draft_task = None
+        if predicted:
+            draft_task = asyncio.ensure_future(self._draft_response(message, context, predicted, property_id, property_data))
+        
+        try:
+            classification = await self.classify_intent(message)
+        except BaseException:
+            if draft_task:
+                draft_task.cancel()
+            raise
+        
+        intent = str(classification.get('intent', '')).lower()
+        
+        if draft_task and intent == predicted:
+            try:
+                text, usage, assistant_metadata = await draft_task
+            except Exception as e:
+                logger.warning(f"Speculative draft failed, generating normally: {str(e)}")
+            else:
+                if context:
+                    await self._update_conversation_context(context, message, text, usage, assistant_metadata)
+                self.speculation.record_hit(predicted)
+                return {'classification': classification, 'response': text, 'speculation': 'hit'}
+        elif draft_task:
+            self.speculation.record_miss(predicted, intent, await self._discard_draft(draft_task, message, context))
+        
+        response = await self.generate_response(message, context, intent=intent, property_id=property_id,
+                                                property_data=property_data)
+        return {
+            'classification': classification,
+            'response': response,
+            'speculation': 'miss' if draft_task else 'none'
+        }
+    
+    async def _draft_response(self, message: str, context: Optional[ConversationContext], intent: str,
+                              property_id: str = None, property_data: Dict[str, Any] = None) -> tuple:
+        """generate_response without touching the conversation; returns (text, usage, assistant metadata)"""
+        
+        match = self._cached_answer(message, intent, property_id, property_data)
+        if match:
+            return match.answer, empty_usage(), {'cache_key': match.key}
+        
+        response = await self.process_request(ClaudeRequest(
+            prompt_type="response-generation",
+            content=message,
+            context=context,
+            temperature=0.7,
+            max_tokens=4000,
+            persist_context=False
+        ))
+        usage = empty_usage() if response.metadata['coalesced'] else response.usage
+        return response.content, usage, None
+    
+    async def _discard_draft(self, draft_task: asyncio.Future, message: str, context: Optional[ConversationContext]) -> int:
+        """Cancel or drop a draft; returns the tokens it cost (estimated when cancelled mid-flight)"""
+        
+        if draft_task.done():
+            if draft_task.cancelled() or draft_task.exception():
+                return 0
+            return draft_task.result()[1]['total_tokens']
+        
+        draft_task.cancel()
+        # Billing is unknown once cancelled: count at least the prompt that was sent
+        history = "".join(str(msg.get('content', '')) for msg in (context.messages if context else []))
+        return self.context_manager.estimate_token_count(
+            self.system_prompts['response-generation'] + history + message
+        )
+    
     @tracer.capture_method
     async def process_multimodal_content(self, content: str, image_data: List[str] = None, context: ConversationContext = None) -> str:
         """Process multimodal content (text + images) using Claude"""
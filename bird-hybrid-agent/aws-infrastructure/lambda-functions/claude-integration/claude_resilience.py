@@ -0,0 +1,312 @@
+"""
+Resilience Layer for Outbound Claude Calls
+Jittered retries for retryable errors, optional hedged requests after a
+p95-based delay, and a circuit breaker that fails fast while the Claude
+API is unhealthy. Rate limits (429) are retried with backoff but never
+count against the breaker: they mean "slow down", not "unhealthy".
+"""
+
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Callable, Awaitable, Set, Tuple
+
+import anthropic
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is rejecting Claude calls"""
+
+
+@dataclass
+class RetryPolicy:
+    """Retry configuration for Claude calls"""
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    # 408 timeout, 409 conflict, 429 rate limited, 5xx server errors, 529 overloaded
+    retryable_status_codes: Set[int] = field(default_factory=lambda: {408, 409, 429, 500, 502, 503, 504, 529})
+
+    @classmethod
+    def from_environment(cls) -> 'RetryPolicy':
+        return cls(
+            max_attempts=int(os.environ.get('CLAUDE_MAX_ATTEMPTS', '3')),
+            base_delay=float(os.environ.get('CLAUDE_RETRY_BASE_DELAY', '0.5')),
+            max_delay=float(os.environ.get('CLAUDE_RETRY_MAX_DELAY', '8.0'))
+        )
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Whether an error is worth retrying"""
+        if isinstance(error, (anthropic.APIConnectionError, TimeoutError, ConnectionError)):
+            return True
+        return getattr(error, 'status_code', None) in self.retryable_status_codes
+
+    def backoff_delay(self, attempt: int, error: Exception = None) -> float:
+        """Full-jitter exponential backoff, honoring retry-after when the API sends it"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+
+        return min(delay, self.max_delay)
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, window_size: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window_size)
+        self.min_samples = min_samples
+
+    def record(self, latency_seconds: float):
+        self.samples.append(latency_seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Latency at the given percentile, or None until enough samples exist"""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(percentile * len(ordered)))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for the Claude API"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    # Numeric state exported as a metric
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    @classmethod
+    def from_environment(cls) -> 'CircuitBreaker':
+        return cls(
+            failure_threshold=int(os.environ.get('CLAUDE_BREAKER_FAILURE_THRESHOLD', '5')),
+            recovery_timeout=float(os.environ.get('CLAUDE_BREAKER_RECOVERY_SECONDS', '30'))
+        )
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self.clock() - self._opened_at >= self.recovery_timeout:
+            self._transition(self.HALF_OPEN)
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a call may go out right now"""
+        state = self.state
+
+        if state == self.CLOSED:
+            return True
+
+        if state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return True
+
+        return False
+
+    def release_probe(self):
+        """Give back a half-open probe slot whose call ended without an answer from the API"""
+        if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self):
+        self._consecutive_failures = 0
+        if self._state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+        if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self._transition(self.OPEN)
+            self._opened_at = self.clock()
+
+    def _transition(self, new_state: str):
+        logger.warning(f"Claude circuit breaker {self._state} -> {new_state}",
+                       consecutive_failures=self._consecutive_failures)
+
+        self._state = new_state
+        self._half_open_calls = 0
+
+        metrics.add_metric(name="ClaudeCircuitState", unit=MetricUnit.Count, value=self.STATE_VALUES[new_state])
+        if new_state == self.OPEN:
+            metrics.add_metric(name="ClaudeCircuitOpened", unit=MetricUnit.Count, value=1)
+
+
+class ResilientCaller:
+    """Wraps an async Claude call with retries, hedging and a circuit breaker"""
+
+    def __init__(self, retry_policy: RetryPolicy = None, circuit_breaker: CircuitBreaker = None,
+                 hedging_enabled: bool = None, hedge_percentile: float = 0.95,
+                 hedge_min_delay: float = 0.5, latency_tracker: LatencyTracker = None):
+        self.retry_policy = retry_policy or RetryPolicy.from_environment()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker.from_environment()
+        self.latency_tracker = latency_tracker or LatencyTracker()
+
+        if hedging_enabled is None:
+            hedging_enabled = os.environ.get('CLAUDE_HEDGING_ENABLED', 'false').lower() == 'true'
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+
+        self.stats = {
+            'calls': 0,
+            'retries': 0,
+            'hedges_sent': 0,
+            'hedges_won': 0,
+            'rejected_by_breaker': 0
+        }
+
+    def _allow(self) -> Tuple[bool, bool]:
+        """(allowed, whether the call holds a half-open probe slot)"""
+        probing = self.circuit_breaker.state == CircuitBreaker.HALF_OPEN
+        allowed = self.circuit_breaker.allow_request()
+        return allowed, allowed and probing
+
+    async def call(self, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `make_call` with retries; raises CircuitOpenError while the API is unhealthy
+
+        A half-open probe that ends without a verdict from the API (shed by
+        admission control, rate limited, or cancelled) gives its slot back,
+        so the breaker is never stuck half-open.
+        """
+
+        allowed, probing = self._allow()
+        if not allowed:
+            self.stats['rejected_by_breaker'] += 1
+            metrics.add_metric(name="ClaudeCircuitRejected", unit=MetricUnit.Count, value=1)
+            raise CircuitOpenError("Claude API circuit breaker is open")
+
+        self.stats['calls'] += 1
+        attempt = 0
+        verdict = False
+
+        try:
+            while True:
+                attempt += 1
+                try:
+                    result = await self._hedged_attempt(make_call)
+                except Exception as e:
+                    status_code = getattr(e, 'status_code', None)
+                    if not self.retry_policy.is_retryable(e):
+                        if status_code is not None:
+                            # The API answered; the request itself was bad
+                            self.circuit_breaker.record_success()
+                            verdict = True
+                        # Errors raised before any request (e.g. admission shedding) say nothing about the API
+                        raise
+
+                    if status_code != 429:
+                        self.circuit_breaker.record_failure()
+                        verdict = True
+                    if attempt >= self.retry_policy.max_attempts:
+                        raise
+                    allowed, retry_probing = self._allow()
+                    probing = probing or retry_probing
+                    if not allowed:
+                        raise
+
+                    delay = self.retry_policy.backoff_delay(attempt, e)
+                    self.stats['retries'] += 1
+                    metrics.add_metric(name="ClaudeRetries", unit=MetricUnit.Count, value=1)
+                    logger.warning(f"Retrying Claude call after error: {str(e)}",
+                                   attempt=attempt, delay_seconds=round(delay, 3))
+                    await asyncio.sleep(delay)
+                    verdict = False
+                    continue
+
+                self.circuit_breaker.record_success()
+                verdict = True
+                return result
+        finally:
+            if probing and not verdict:
+                self.circuit_breaker.release_probe()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Delay before sending a hedged duplicate, or None when hedging is off"""
+        if not self.hedging_enabled:
+            return None
+        tail_latency = self.latency_tracker.percentile(self.hedge_percentile)
+        if tail_latency is None:
+            return None
+        return max(self.hedge_min_delay, tail_latency)
+
+    async def _hedged_attempt(self, make_call: Callable[[], Awaitable[Any]]) -> Any:
+        """One attempt, duplicated if the first call is slower than the tail latency"""
+
+        start_time = time.monotonic()
+        delay = self.hedge_delay()
+
+        if delay is None:
+            result = await make_call()
+            self.latency_tracker.record(time.monotonic() - start_time)
+            return result
+
+        primary = asyncio.ensure_future(make_call())
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                hedge = asyncio.ensure_future(make_call())
+                pending.add(hedge)
+                self.stats['hedges_sent'] += 1
+                metrics.add_metric(name="ClaudeHedgedRequests", unit=MetricUnit.Count, value=1)
+
+            last_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats['hedges_won'] += 1
+                            metrics.add_metric(name="ClaudeHedgeWins", unit=MetricUnit.Count, value=1)
+                        self.latency_tracker.record(time.monotonic() - start_time)
+                        return task.result()
+                    last_error = task.exception()
+
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get resilience statistics"""
+        return {
+            **self.stats,
+            'circuit_state': self.circuit_breaker.state,
+            'hedge_delay_seconds': self.hedge_delay()
+        }
+
+
+# Export main classes
+__all__ = ['ResilientCaller', 'RetryPolicy', 'CircuitBreaker', 'CircuitOpenError', 'LatencyTracker']
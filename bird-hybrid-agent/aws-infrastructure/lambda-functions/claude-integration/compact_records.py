@@ -0,0 +1,80 @@
+"""
+Compact Conversation Records
+Slotted message records with interned keys for warm conversation caches.
+They read like the plain dicts they replace and convert directly to and
+from DynamoDB items.
+"""
+
+import sys
+from collections.abc import Mapping
+from typing import Dict, List, Any, Iterable, Iterator, Optional
+
+# Fields stored in slots; anything else goes to the (usually empty) extras dict
+MESSAGE_FIELDS = ('role', 'content', 'timestamp')
+
+
+class ConversationMessage(Mapping):
+    """One conversation turn; a read-only mapping with the same keys as the legacy dict"""
+
+    __slots__ = ('role', 'content', 'timestamp', 'extra')
+
+    def __init__(self, role: str, content: Any, timestamp: Optional[str] = None, extra: Dict[str, Any] = None):
+        # Roles repeat on every message, so share one string object per role
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp
+        self.extra = {sys.intern(key): value for key, value in extra.items()} if extra else None
+
+    @classmethod
+    def from_item(cls, item: Mapping) -> 'ConversationMessage':
+        if isinstance(item, cls):
+            return item
+        extra = {key: value for key, value in item.items() if key not in MESSAGE_FIELDS}
+        return cls(item.get('role', 'user'), item.get('content', ''), item.get('timestamp'), extra)
+
+    def to_item(self) -> Dict[str, Any]:
+        item = {'role': self.role, 'content': self.content}
+        if self.timestamp is not None:
+            item['timestamp'] = self.timestamp
+        if self.extra:
+            item.update(self.extra)
+        return item
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'role':
+            return self.role
+        if key == 'content':
+            return self.content
+        if key == 'timestamp' and self.timestamp is not None:
+            return self.timestamp
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        yield 'role'
+        yield 'content'
+        if self.timestamp is not None:
+            yield 'timestamp'
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return 2 + (self.timestamp is not None) + (len(self.extra) if self.extra else 0)
+
+    def __repr__(self) -> str:
+        return f"ConversationMessage({self.to_item()!r})"
+
+
+def compact_messages(items: Iterable[Mapping]) -> List[ConversationMessage]:
+    """Convert stored message dicts into compact records"""
+    return [ConversationMessage.from_item(item) for item in items]
+
+
+def messages_to_items(messages: Iterable[Mapping]) -> List[Dict[str, Any]]:
+    """Plain dicts for DynamoDB; accepts compact records and legacy dicts alike"""
+    return [message.to_item() if isinstance(message, ConversationMessage) else dict(message) for message in messages]
+
+
+# Export main classes
+__all__ = ['ConversationMessage', 'compact_messages', 'messages_to_items']
@@ -0,0 +1,194 @@
+"""
+Image Preprocessing for Claude Multimodal Requests
+Detects the real image format, applies EXIF orientation, downscales to a
+maximum edge and re-encodes before images are sent to Claude.
+"""
+
+import os
+import io
+import base64
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageOps
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+# Formats Claude accepts, keyed by Pillow format name
+SUPPORTED_MEDIA_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp'
+}
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+@dataclass
+class PreparedImage:
+    """Image ready to be sent to Claude"""
+    data: str  # base64 encoded
+    media_type: str
+    width: int
+    height: int
+    original_bytes: int
+    prepared_bytes: int
+    original_tokens: int
+    prepared_tokens: int
+
+# Claude resizes larger images itself, so no image costs more than this
+MAX_IMAGE_TOKENS = 1600
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimate Claude input tokens for an image (~width * height / 750)"""
+    return min(MAX_IMAGE_TOKENS, max(1, (width * height) // 750))
+
+class ImagePreprocessor:
+    """Normalizes, downscales and re-encodes images for Claude"""
+
+    def __init__(self, max_edge: int = None, jpeg_quality: int = None,
+                 max_workers: int = None, cache_size: int = 128):
+        # Claude downscales anything with a long edge over 1568px anyway
+        self.max_edge = max_edge or int(os.environ.get('CLAUDE_IMAGE_MAX_EDGE', '1568'))
+        self.jpeg_quality = jpeg_quality or int(os.environ.get('CLAUDE_IMAGE_QUALITY', '85'))
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.environ.get('CLAUDE_IMAGE_WORKERS', '4')),
+            thread_name_prefix='image-preprocess'
+        )
+
+        # LRU cache of prepared images keyed by content hash
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    async def prepare_images(self, image_data: List[str]) -> List[PreparedImage]:
+        """Prepare several base64 images concurrently on the thread pool"""
+
+        loop = asyncio.get_running_loop()
+        prepared = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, self.prepare_image, img_data)
+            for img_data in image_data
+        ])
+
+        self._report_savings(prepared)
+        return list(prepared)
+
+    def prepare_image(self, image_data: str) -> PreparedImage:
+        """Prepare a single base64 image, reusing the cached result when available"""
+
+        raw = base64.b64decode(image_data)
+        content_hash = hashlib.sha256(raw).hexdigest()
+
+        with self._cache_lock:
+            cached = self._cache.get(content_hash)
+            if cached is not None:
+                self._cache.move_to_end(content_hash)
+                return cached
+
+        try:
+            prepared = self._process(raw, image_data)
+        except Exception as e:
+            # Send the image untouched rather than dropping it
+            logger.warning(f"Image preprocessing failed, sending original: {str(e)}")
+            prepared = PreparedImage(
+                data=image_data,
+                media_type='image/jpeg',
+                width=0,
+                height=0,
+                original_bytes=len(raw),
+                prepared_bytes=len(raw),
+                original_tokens=0,
+                prepared_tokens=0
+            )
+
+        with self._cache_lock:
+            self._cache[content_hash] = prepared
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return prepared
+
+    def _process(self, raw: bytes, image_data: str) -> PreparedImage:
+        """Detect format, fix orientation, downscale and re-encode"""
+
+        with Image.open(io.BytesIO(raw)) as image:
+            source_format = image.format
+            original_width, original_height = image.size
+
+            needs_rotation = image.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1
+            needs_resize = max(image.size) > self.max_edge
+
+            if not needs_resize and not needs_rotation and source_format in SUPPORTED_MEDIA_TYPES:
+                # Already fine: just label it correctly
+                return PreparedImage(
+                    data=image_data,
+                    media_type=SUPPORTED_MEDIA_TYPES[source_format],
+                    width=original_width,
+                    height=original_height,
+                    original_bytes=len(raw),
+                    prepared_bytes=len(raw),
+                    original_tokens=estimate_image_tokens(original_width, original_height),
+                    prepared_tokens=estimate_image_tokens(original_width, original_height)
+                )
+
+            oriented = ImageOps.exif_transpose(image)
+            if needs_resize:
+                oriented.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+
+            encoded, media_type = self._encode(oriented)
+
+        width, height = oriented.size
+        return PreparedImage(
+            data=base64.b64encode(encoded).decode('ascii'),
+            media_type=media_type,
+            width=width,
+            height=height,
+            original_bytes=len(raw),
+            prepared_bytes=len(encoded),
+            original_tokens=estimate_image_tokens(original_width, original_height),
+            prepared_tokens=estimate_image_tokens(width, height)
+        )
+
+    def _encode(self, image: Image.Image) -> Tuple[bytes, str]:
+        """Re-encode as JPEG, or PNG when the image has transparency"""
+
+        buffer = io.BytesIO()
+
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image.save(buffer, format='PNG', optimize=True)
+            return buffer.getvalue(), 'image/png'
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        image.save(buffer, format='JPEG', quality=self.jpeg_quality, optimize=True)
+        return buffer.getvalue(), 'image/jpeg'
+
+    def _report_savings(self, prepared: List[PreparedImage]):
+        """Publish per-call byte and token savings"""
+
+        bytes_saved = sum(img.original_bytes - img.prepared_bytes for img in prepared)
+        tokens_saved = sum(img.original_tokens - img.prepared_tokens for img in prepared)
+
+        metrics.add_metric(name="ImagesPreprocessed", unit=MetricUnit.Count, value=len(prepared))
+        metrics.add_metric(name="ImageBytesSaved", unit=MetricUnit.Bytes, value=bytes_saved)
+        metrics.add_metric(name="ImageTokensSaved", unit=MetricUnit.Count, value=tokens_saved)
+
+        logger.info("Preprocessed images for Claude",
+                    image_count=len(prepared),
+                    bytes_saved=bytes_saved,
+                    tokens_saved=tokens_saved)
+
+# Export main classes
+__all__ = ['ImagePreprocessor', 'PreparedImage', 'estimate_image_tokens']
@@ -0,0 +1,261 @@
+"""
+Multimodal Attachment Dispatcher for the Webhook Processor
+Runs every attachment of a message through its own pipeline concurrently
+(image header, voice metadata, document text extraction, S3 upload) and
+merges the results into one media_analysis. CPU-bound steps run on
+bounded per-type thread pools, so a message with four photos takes about
+as long as one.
+"""
+
+import io
+import os
+import re
+import wave
+import zlib
+import base64
+import struct
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+
+from PIL import Image
+
+from image_preprocessor import estimate_image_tokens
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+# Specialist agent that handles each attachment type
+PROCESSING_AGENTS = {
+    'image': 'visual-analyzer',
+    'voice': 'voice-assistant',
+    'document': 'document-processor'
+}
+
+MEDIA_TYPES = ('image', 'voice', 'document', 'video')
+
+# Characters of document text passed on; agents fetch the full file from S3
+DOCUMENT_TEXT_LIMIT = 4000
+
+_PDF_STREAM = re.compile(rb'stream\r?\n(.*?)\r?\nendstream', re.S)
+_PDF_TEXT_BLOCK = re.compile(rb'BT(.*?)ET', re.S)
+_PDF_STRING = re.compile(rb'\(((?:\\.|[^\\()])*)\)', re.S)
+_PDF_PAGE = re.compile(rb'/Type\s*/Page\b')
+_PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+def extract_attachments(message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Every attachment of a message, whether listed in 'attachments' or carried by the message itself"""
+
+    attachments = [dict(attachment) for attachment in message.get('attachments', [])
+                   if attachment.get('type') in MEDIA_TYPES]
+    if not attachments and message.get('type') in MEDIA_TYPES:
+        attachments = [{key: message[key] for key in ('type', 'media_data', 'filename', 'mime_type', 'caption')
+                        if key in message}]
+
+    for index, attachment in enumerate(attachments):
+        attachment['index'] = index
+    return attachments
+
+
+def decode_media(media_data: Any) -> bytes:
+    if isinstance(media_data, bytes):
+        return media_data
+    try:
+        return base64.b64decode(media_data or '', validate=True)
+    except ValueError:
+        return str(media_data).encode('utf-8')
+
+
+def image_metadata(raw: bytes) -> Dict[str, Any]:
+    """Format and dimensions from the image header; the pixels are never decoded"""
+
+    with Image.open(io.BytesIO(raw)) as image:
+        width, height = image.size
+        return {
+            'media_type': Image.MIME.get(image.format, 'application/octet-stream'),
+            'width': width,
+            'height': height,
+            'bytes': len(raw),
+            'estimated_tokens': estimate_image_tokens(width, height)
+        }
+
+
+def voice_metadata(raw: bytes) -> Dict[str, Any]:
+    """Container, codec and duration from the audio headers, without decoding the audio"""
+
+    metadata = {'bytes': len(raw), 'container': 'unknown', 'codec': None, 'duration_seconds': None}
+
+    if raw.startswith(b'OggS'):
+        metadata['container'] = 'ogg'
+        last_page = raw.rfind(b'OggS')
+        granule = struct.unpack_from('<q', raw, last_page + 6)[0] if last_page + 14 <= len(raw) else -1
+        if b'OpusHead' in raw[:512]:
+            # Opus granule positions always count 48 kHz samples
+            metadata['codec'] = 'opus'
+            rate = 48000
+        elif b'\x01vorbis' in raw[:512]:
+            metadata['codec'] = 'vorbis'
+            header = raw.index(b'\x01vorbis')
+            rate = struct.unpack_from('<I', raw, header + 12)[0]
+        else:
+            rate = 0
+        if rate and granule > 0:
+            metadata['duration_seconds'] = round(granule / rate, 2)
+
+    elif raw.startswith(b'RIFF') and raw[8:12] == b'WAVE':
+        metadata.update(container='wav', codec='pcm')
+        with wave.open(io.BytesIO(raw)) as audio:
+            metadata['duration_seconds'] = round(audio.getnframes() / audio.getframerate(), 2)
+
+    elif raw.startswith(b'ID3') or raw[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
+        metadata.update(container='mp3', codec='mp3')
+
+    elif raw[4:8] == b'ftyp':
+        metadata.update(container='mp4', codec='aac')
+
+    return metadata
+
+
+def _pdf_string(literal: bytes) -> bytes:
+    out = bytearray()
+    i = 0
+    while i < len(literal):
+        char = literal[i:i + 1]
+        if char == b'\\' and i + 1 < len(literal):
+            escaped = literal[i + 1:i + 2]
+            out += _PDF_ESCAPES.get(escaped, escaped)
+            i += 2
+        else:
+            out += char
+            i += 1
+    return bytes(out)
+
+
+def document_text(raw: bytes, mime_type: str = '') -> Dict[str, Any]:
+    """Page count and leading text of a PDF (or plain text file)"""
+
+    if not raw.startswith(b'%PDF'):
+        if mime_type.startswith('text/'):
+            text = raw.decode('utf-8', errors='replace')
+            return {'bytes': len(raw), 'format': 'text', 'pages': None, 'text': text[:DOCUMENT_TEXT_LIMIT]}
+        return {'bytes': len(raw), 'format': 'unknown', 'pages': None, 'text': ''}
+
+    chunks = []
+    length = 0
+    for stream in _PDF_STREAM.findall(raw):
+        try:
+            stream = zlib.decompress(stream)
+        except zlib.error:
+            pass  # uncompressed content stream
+        for block in _PDF_TEXT_BLOCK.findall(stream):
+            for literal in _PDF_STRING.findall(block):
+                chunk = _pdf_string(literal).decode('latin-1')
+                chunks.append(chunk)
+                length += len(chunk)
+        if length >= DOCUMENT_TEXT_LIMIT:
+            break
+
+    text = re.sub(r'\s+', ' ', ' '.join(chunks)).strip()
+    return {'bytes': len(raw), 'format': 'pdf', 'pages': len(_PDF_PAGE.findall(raw)),
+            'text': text[:DOCUMENT_TEXT_LIMIT]}
+
+
+class MultimodalDispatcher:
+    """Fans a message's attachments out to per-type pipelines and merges the results
+
+    Image, voice and document extraction each get a bounded pool
+    (MULTIMODAL_WORKERS per type), so a message full of PDFs cannot starve
+    voice notes. Uploads run alongside. Images are only measured here;
+    resizing for Claude stays with the agent that sends them.
+    One failing attachment is reported in its entry and never fails the
+    others.
+    """
+
+    def __init__(self, workers: int = None):
+        workers = workers or int(os.environ.get('MULTIMODAL_WORKERS', '4'))
+        self.pools = {
+            'image': ThreadPoolExecutor(max_workers=workers, thread_name_prefix='multimodal-image'),
+            'voice': ThreadPoolExecutor(max_workers=workers, thread_name_prefix='multimodal-voice'),
+            'document': ThreadPoolExecutor(max_workers=workers, thread_name_prefix='multimodal-document'),
+        }
+
+    async def _run(self, attachment: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        media_type = attachment['type']
+
+        if media_type == 'image':
+            return await loop.run_in_executor(self.pools['image'], image_metadata,
+                                              decode_media(attachment.get('media_data')))
+        if media_type == 'voice':
+            return await loop.run_in_executor(self.pools['voice'], voice_metadata,
+                                              decode_media(attachment.get('media_data')))
+        if media_type == 'document':
+            return await loop.run_in_executor(self.pools['document'], document_text,
+                                              decode_media(attachment.get('media_data')),
+                                              attachment.get('mime_type', ''))
+        return None
+
+    async def _process(self, attachment: Dict[str, Any],
+                       store: Optional[Callable[[Dict[str, Any]], Awaitable[str]]]) -> Dict[str, Any]:
+        result = {'index': attachment['index'], 'type': attachment['type']}
+        if attachment.get('caption'):
+            result['caption'] = attachment['caption']
+
+        # Analysis and upload of the same attachment overlap too
+        analysis, s3_url = await asyncio.gather(
+            self._run(attachment),
+            store(attachment) if store else asyncio.sleep(0),
+            return_exceptions=True
+        )
+
+        for name, value in (('analysis', analysis), ('s3_url', s3_url)):
+            if isinstance(value, Exception):
+                logger.warning(f"Attachment {name} failed", index=attachment['index'],
+                               media_type=attachment['type'], error=str(value))
+                result.setdefault('errors', {})[name] = str(value)
+            elif value is not None:
+                result[name] = value
+        return result
+
+    async def analyze(self, message: Dict[str, Any],
+                      store: Callable[[Dict[str, Any]], Awaitable[str]] = None) -> Dict[str, Any]:
+        """media_analysis for a message; store(attachment) uploads one attachment and returns its URL"""
+
+        attachments = extract_attachments(message)
+        content_analysis = {
+            'has_media': bool(attachments),
+            'media_types': [],
+            'processing_required': []
+        }
+        if not attachments:
+            return content_analysis
+
+        results = await asyncio.gather(*[self._process(attachment, store) for attachment in attachments])
+
+        for result in results:
+            if result['type'] not in content_analysis['media_types']:
+                content_analysis['media_types'].append(result['type'])
+            agent = PROCESSING_AGENTS.get(result['type'])
+            if agent and agent not in content_analysis['processing_required']:
+                content_analysis['processing_required'].append(agent)
+
+        content_analysis['attachments'] = list(results)
+        # Single-attachment consumers read the first upload here
+        first_url = next((result['s3_url'] for result in results if result.get('s3_url')), None)
+        if first_url:
+            content_analysis['s3_url'] = first_url
+
+        metrics.add_metric(name="AttachmentsProcessed", unit=MetricUnit.Count, value=len(results))
+        metrics.add_metric(name="AttachmentsFailed", unit=MetricUnit.Count,
+                           value=sum(1 for result in results if result.get('errors')))
+        return content_analysis
+
+
+# Export main classes
+__all__ = ['MultimodalDispatcher', 'extract_attachments', 'image_metadata', 'voice_metadata', 'document_text']
@@ -0,0 +1,202 @@
+"""
+Prompt Registry for Claude Integration
+Loads the markdown prompts in claude-prompts/ once per cold start (or from a
+prebuilt snapshot), precompiles them into templates with declared variables,
+and versions each prompt by content hash.
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, FrozenSet
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+# Template variables use {{name}}; single braces (JSON examples) are literal text
+VARIABLE_PATTERN = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+
+# Section holding the user-turn template; everything else is the system prompt
+USER_TEMPLATE_HEADING = '## User Message Template'
+
+FENCED_BLOCK_PATTERN = re.compile(r'```[^\n]*\n(.*?)\n```', re.DOTALL)
+
+
+class CompiledTemplate:
+    """Template split once into literal and variable segments"""
+
+    __slots__ = ('segments', 'variables')
+
+    def __init__(self, source: str):
+        # re.split with one group alternates literal, variable, literal, ...
+        self.segments = tuple(VARIABLE_PATTERN.split(source))
+        self.variables: FrozenSet[str] = frozenset(self.segments[1::2])
+
+    def render(self, values: Dict[str, Any] = None) -> str:
+        if not self.variables:
+            return self.segments[0]
+
+        values = values or {}
+        missing = self.variables - values.keys()
+        if missing:
+            raise ValueError(f"Missing prompt variables: {', '.join(sorted(missing))}")
+
+        return ''.join(
+            segment if index % 2 == 0 else str(values[segment])
+            for index, segment in enumerate(self.segments)
+        )
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """A versioned prompt with its system and optional user-turn templates"""
+    name: str
+    version: str
+    system: CompiledTemplate
+    user: Optional[CompiledTemplate] = None
+
+    @property
+    def variables(self) -> FrozenSet[str]:
+        return self.system.variables | (self.user.variables if self.user else frozenset())
+
+    def render_system(self, **values) -> str:
+        return self.system.render(values)
+
+    def render_user(self, **values) -> str:
+        if self.user is None:
+            raise ValueError(f"Prompt {self.name} has no user message template")
+        return self.user.render(values)
+
+
+def parse_prompt_markdown(name: str, source: str) -> PromptTemplate:
+    """Compile a claude-prompts markdown file into a PromptTemplate"""
+
+    lines = source.strip().splitlines()
+
+    # The H1 title describes the file, it is not part of the prompt
+    if lines and lines[0].startswith('# '):
+        lines = lines[1:]
+
+    system_lines = []
+    user_section = []
+    in_user_section = False
+
+    for line in lines:
+        if line.strip() == USER_TEMPLATE_HEADING:
+            in_user_section = True
+            continue
+        if in_user_section and line.startswith('## '):
+            in_user_section = False
+
+        (user_section if in_user_section else system_lines).append(line)
+
+    user_template = None
+    if user_section:
+        block = FENCED_BLOCK_PATTERN.search('\n'.join(user_section))
+        user_template = CompiledTemplate(block.group(1) if block else '\n'.join(user_section).strip())
+
+    return PromptTemplate(
+        name=name,
+        version=hashlib.sha256(source.encode('utf-8')).hexdigest()[:12],
+        system=CompiledTemplate('\n'.join(system_lines).strip()),
+        user=user_template
+    )
+
+
+def _default_prompts_dir() -> str:
+    """claude-prompts/ packaged next to this module, else the repository copy"""
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    candidates = [
+        os.path.join(module_dir, 'claude-prompts'),
+        os.path.join(module_dir, '..', '..', '..', 'claude-prompts')
+    ]
+    for candidate in candidates:
+        if os.path.isdir(candidate):
+            return os.path.normpath(candidate)
+    return candidates[0]
+
+
+class PromptRegistry:
+    """Loads and serves compiled, versioned prompts"""
+
+    def __init__(self, prompts_dir: str = None, snapshot_path: str = None):
+        self.prompts_dir = prompts_dir or os.environ.get('CLAUDE_PROMPTS_DIR') or _default_prompts_dir()
+        self.snapshot_path = snapshot_path if snapshot_path is not None else os.environ.get('CLAUDE_PROMPTS_SNAPSHOT')
+        self.prompts: Dict[str, PromptTemplate] = {}
+        self.sources: Dict[str, str] = {}
+        self.load_time_ms = 0.0
+        self.load()
+
+    def load(self):
+        """Parse all prompts, preferring the prebuilt snapshot when one is configured"""
+
+        start_time = time.perf_counter()
+
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as snapshot_file:
+                self.sources = json.load(snapshot_file)['prompts']
+            origin = self.snapshot_path
+        else:
+            self.sources = {}
+            for path in sorted(glob.glob(os.path.join(self.prompts_dir, '*.md'))):
+                with open(path, encoding='utf-8') as prompt_file:
+                    self.sources[os.path.splitext(os.path.basename(path))[0]] = prompt_file.read()
+            origin = self.prompts_dir
+
+        self.prompts = {name: parse_prompt_markdown(name, source) for name, source in self.sources.items()}
+
+        self.load_time_ms = (time.perf_counter() - start_time) * 1000
+        metrics.add_metric(name="PromptRegistryLoadTime", unit=MetricUnit.Milliseconds, value=self.load_time_ms)
+        logger.info("Loaded prompt registry",
+                    origin=origin,
+                    prompt_count=len(self.prompts),
+                    versions={name: prompt.version for name, prompt in self.prompts.items()},
+                    load_time_ms=round(self.load_time_ms, 2))
+
+    def get(self, name: str) -> PromptTemplate:
+        if name not in self.prompts:
+            raise ValueError(f"Prompt {name} not found")
+        return self.prompts[name]
+
+    def names(self) -> List[str]:
+        return sorted(self.prompts)
+
+    def write_snapshot(self, path: str):
+        """Write all prompt sources to one JSON file for faster cold starts"""
+        with open(path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump({
+                'prompts': self.sources,
+                'versions': {name: prompt.version for name, prompt in self.prompts.items()}
+            }, snapshot_file, ensure_ascii=False, indent=2)
+
+
+_registry: Optional[PromptRegistry] = None
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """Process-wide registry, loaded once per cold start"""
+    global _registry
+    if _registry is None:
+        _registry = PromptRegistry()
+    return _registry
+
+
+# Export main classes
+__all__ = ['PromptRegistry', 'PromptTemplate', 'CompiledTemplate', 'parse_prompt_markdown', 'get_prompt_registry']
+
+
+if __name__ == "__main__":
+    # Build a snapshot at packaging time: python prompt_registry.py prompts-snapshot.json
+    registry = PromptRegistry(snapshot_path='')
+    registry.write_snapshot(sys.argv[1] if len(sys.argv) > 1 else 'prompts-snapshot.json')
+    print(json.dumps({name: registry.get(name).version for name in registry.names()}, indent=2))
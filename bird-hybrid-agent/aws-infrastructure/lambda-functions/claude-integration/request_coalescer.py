@@ -0,0 +1,115 @@
+"""
+Single-flight Request Coalescing for Claude Integration
+Concurrent identical Claude requests (double-sends, overlapping webhook
+retries) share one in-flight API call and all receive its result.
+"""
+
+import json
+import hashlib
+import asyncio
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+
+def build_request_key(prompt_type: str, model: str, messages: List[Dict[str, Any]],
+                      system_prompt: str = "", temperature: float = None,
+                      max_tokens: int = None, image_data: List[str] = None) -> str:
+    """Build the canonical coalescing key for a Claude request"""
+
+    canonical = json.dumps({
+        'prompt_type': prompt_type,
+        'model': model,
+        'system': system_prompt,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'messages': messages,
+        'images': [hashlib.sha256(img.encode('utf-8')).hexdigest() for img in (image_data or [])]
+    }, sort_keys=True, ensure_ascii=False, default=str)
+
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class _InFlightCall:
+    """Shared in-flight call and the number of callers waiting on it"""
+
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class RequestCoalescer:
+    """Coalesces concurrent identical requests into a single in-flight call"""
+
+    def __init__(self):
+        self._in_flight: Dict[str, _InFlightCall] = {}
+        self.stats = {
+            'calls_started': 0,
+            'requests_coalesced': 0,
+            'calls_abandoned': 0
+        }
+
+    @property
+    def in_flight_count(self) -> int:
+        return len(self._in_flight)
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `call` once per key; concurrent callers with the same key share the result"""
+
+        entry = self._in_flight.get(key)
+
+        if entry is None:
+            entry = _InFlightCall(asyncio.ensure_future(call()))
+            self._in_flight[key] = entry
+            entry.task.add_done_callback(lambda task: self._release(key, task))
+            self.stats['calls_started'] += 1
+        else:
+            self.stats['requests_coalesced'] += 1
+            metrics.add_metric(name="ClaudeRequestsCoalesced", unit=MetricUnit.Count, value=1)
+            logger.info("Coalesced Claude request onto in-flight call", request_key=key[:16])
+
+        entry.waiters += 1
+        try:
+            # Shield so one cancelled caller does not cancel the call for the others
+            return await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            if entry.waiters == 1 and not entry.task.done():
+                # Nobody else is waiting for this result
+                entry.task.cancel()
+                self.stats['calls_abandoned'] += 1
+            raise
+        finally:
+            entry.waiters -= 1
+
+    def _release(self, key: str, task: asyncio.Task):
+        """Forget a finished call so later requests start a fresh one"""
+
+        entry = self._in_flight.get(key)
+        if entry is not None and entry.task is task:
+            del self._in_flight[key]
+
+        # Retrieve the exception so an abandoned failed call is not reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics"""
+
+        total_requests = self.stats['calls_started'] + self.stats['requests_coalesced']
+        return {
+            **self.stats,
+            'in_flight': self.in_flight_count,
+            'coalescing_rate': self.stats['requests_coalesced'] / total_requests if total_requests else 0.0
+        }
+
+
+# Export main classes
+__all__ = ['RequestCoalescer', 'build_request_key']
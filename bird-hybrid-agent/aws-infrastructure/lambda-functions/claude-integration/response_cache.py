@@ -0,0 +1,275 @@
+"""
+Similarity Response Cache for FAQ Questions
+Serves vetted answers to paraphrased FAQ questions (pets, included services,
+parking, tour hours) without calling Claude. Questions are compared by
+character-shingle MinHash with LSH banding, fully offline. Shingles cannot
+tell "sábado" from "domingo" or "incluido" from "no incluido", so a match
+must also agree on those key-fact tokens.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Tuple, FrozenSet
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 32  # 32 bands x 2 rows: pairs at 0.5 Jaccard share a band with >99.9% probability
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+
+# Tokens that change the answer while barely changing the shingles
+NEGATION_TOKENS = frozenset(['no', 'sin', 'nunca', 'ni', 'tampoco', 'nada', 'ningun', 'ninguna', 'ninguno'])
+DAY_TOKENS = frozenset(['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo',
+                        'hoy', 'manana', 'festivo', 'festivos'])
+MONTH_TOKENS = frozenset(['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto',
+                          'septiembre', 'octubre', 'noviembre', 'diciembre'])
+NUMBER_TOKENS = frozenset(['dos', 'tres', 'cuatro', 'cinco', 'seis', 'siete', 'ocho', 'nueve', 'diez',
+                           'once', 'doce', 'quince', 'veinte', 'treinta', 'cien', 'mil'])
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _permutation_params() -> List[Tuple[int, int]]:
+    # Deterministic across cold starts so snapshots and tests are reproducible
+    params = []
+    for i in range(NUM_PERMUTATIONS):
+        digest = hashlib.sha256(f"minhash-{i}".encode('utf-8')).digest()
+        params.append((int.from_bytes(digest[:8], 'big') % _MERSENNE_PRIME | 1,
+                       int.from_bytes(digest[8:16], 'big') % _MERSENNE_PRIME))
+    return params
+
+
+_PERMUTATIONS = _permutation_params()
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'[^a-z0-9ñ ]+', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def shingles(text: str) -> FrozenSet[str]:
+    normalized = normalize_question(text)
+    if len(normalized) <= SHINGLE_SIZE:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1))
+
+
+def key_facts(text: str) -> FrozenSet[str]:
+    """Negation, day, month and number tokens of a question"""
+
+    facts = set()
+    for token in normalize_question(text).split():
+        if token.endswith('s') and token[:-1] in DAY_TOKENS:
+            token = token[:-1]  # "los sabados" asks about sabado
+        if token in NEGATION_TOKENS or token in DAY_TOKENS or token in MONTH_TOKENS \
+                or token in NUMBER_TOKENS or token.isdigit():
+            facts.add(token)
+    return frozenset(facts)
+
+
+def minhash(shingle_set: FrozenSet[str]) -> Tuple[int, ...]:
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingle_set]
+    if not hashes:
+        return tuple([_MAX_HASH] * NUM_PERMUTATIONS)
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def jaccard(first: FrozenSet[str], second: FrozenSet[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def property_fingerprint(property_data: Dict[str, Any]) -> str:
+    """Stable version of a property's data; answers are tied to the version they were vetted against"""
+    canonical = json.dumps(property_data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    """A vetted answer and one of the questions it answers"""
+    key: str
+    intent: str
+    property_id: Optional[str]
+    question: str
+    answer: str
+    property_version: Optional[str]
+    shingles: FrozenSet[str]
+    signature: Tuple[int, ...]
+    facts: FrozenSet[str]
+
+
+@dataclass(frozen=True)
+class CacheMatch:
+    key: str
+    answer: str
+    similarity: float
+    question: str
+
+
+class ResponseCache:
+    """Per-intent, per-property index of vetted FAQ answers"""
+
+    def __init__(self, threshold: float = None, answers_path: str = None):
+        self.threshold = threshold if threshold is not None else \
+            float(os.environ.get('CLAUDE_RESPONSE_CACHE_THRESHOLD', '0.7'))
+
+        # (intent, property_id) -> entries, and LSH buckets per scope
+        self._entries: Dict[Tuple[str, Optional[str]], List[CachedAnswer]] = {}
+        self._buckets: Dict[Tuple[str, Optional[str], int, Tuple[int, ...]], List[CachedAnswer]] = {}
+        self._property_versions: Dict[str, str] = {}
+
+        self.stats = {'hits': 0, 'misses': 0}
+
+        answers_path = answers_path if answers_path is not None else os.environ.get('CLAUDE_FAQ_ANSWERS_PATH')
+        if answers_path and os.path.exists(answers_path):
+            self.load(answers_path)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def load(self, path: str):
+        """Load vetted answers: [{key?, intent, property_id?, questions: [...], answer, property_version?}]"""
+        with open(path, encoding='utf-8') as answers_file:
+            for item in json.load(answers_file):
+                self.add_answer(
+                    intent=item['intent'],
+                    questions=item['questions'],
+                    answer=item['answer'],
+                    property_id=item.get('property_id'),
+                    property_version=item.get('property_version'),
+                    key=item.get('key')
+                )
+        logger.info("Loaded FAQ response cache", path=path, entries=len(self))
+
+    def add_answer(self, intent: str, questions: List[str], answer: str, property_id: str = None,
+                   property_version: str = None, key: str = None) -> str:
+        """Index a vetted answer under each of its example questions; returns its audit key"""
+
+        key = key or f"{intent}#{property_id or '*'}#{hashlib.sha256(answer.encode('utf-8')).hexdigest()[:12]}"
+        property_version = property_version or (self._property_versions.get(property_id) if property_id else None)
+        scope = (intent, property_id)
+
+        for question in questions:
+            question_shingles = shingles(question)
+            entry = CachedAnswer(
+                key=key,
+                intent=intent,
+                property_id=property_id,
+                question=question,
+                answer=answer,
+                property_version=property_version,
+                shingles=question_shingles,
+                signature=minhash(question_shingles),
+                facts=key_facts(question)
+            )
+            self._entries.setdefault(scope, []).append(entry)
+            for band in range(LSH_BANDS):
+                band_key = entry.signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+                self._buckets.setdefault((intent, property_id, band, band_key), []).append(entry)
+
+        return key
+
+    def invalidate_property(self, property_id: str) -> int:
+        """Drop every answer tied to a property; returns the number of entries removed"""
+
+        removed = 0
+        for scope in [scope for scope in self._entries if scope[1] == property_id]:
+            removed += len(self._entries.pop(scope))
+        for bucket in [bucket for bucket in self._buckets if bucket[1] == property_id]:
+            del self._buckets[bucket]
+
+        if removed:
+            metrics.add_metric(name="ResponseCacheInvalidations", unit=MetricUnit.Count, value=removed)
+            logger.info("Invalidated cached answers", property_id=property_id, entries=removed)
+        return removed
+
+    def sync_property(self, property_id: str, property_data: Dict[str, Any]) -> bool:
+        """Record the property's current data; invalidates its answers if the data changed"""
+
+        version = property_fingerprint(property_data)
+        previous = self._property_versions.get(property_id)
+        self._property_versions[property_id] = version
+
+        if previous is not None and previous != version:
+            self.invalidate_property(property_id)
+            return True
+        return False
+
+    def _candidates(self, intent: str, property_id: Optional[str], signature: Tuple[int, ...]) -> Dict[int, CachedAnswer]:
+        candidates = {}
+        for band in range(LSH_BANDS):
+            band_key = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+            for entry in self._buckets.get((intent, property_id, band, band_key), ()):
+                candidates[id(entry)] = entry
+        return candidates
+
+    def lookup(self, question: str, intent: str, property_id: str = None) -> Optional[CacheMatch]:
+        """Best vetted answer above the threshold, checking the property scope then the global one"""
+
+        start_time = time.perf_counter()
+        question_shingles = shingles(question)
+        signature = minhash(question_shingles)
+        facts = key_facts(question)
+
+        best: Optional[CacheMatch] = None
+        scopes = [property_id, None] if property_id else [None]
+        for scope_property in scopes:
+            current_version = self._property_versions.get(scope_property) if scope_property else None
+            for entry in self._candidates(intent, scope_property, signature).values():
+                if current_version and entry.property_version and entry.property_version != current_version:
+                    continue
+                if entry.facts != facts:
+                    continue
+                similarity = jaccard(question_shingles, entry.shingles)
+                if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                    best = CacheMatch(key=entry.key, answer=entry.answer, similarity=similarity, question=entry.question)
+            if best:
+                break
+
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        self.stats['hits' if best else 'misses'] += 1
+
+        metrics.add_metric(name="ResponseCacheHit" if best else "ResponseCacheMiss", unit=MetricUnit.Count, value=1)
+        metrics.add_metric(name="ResponseCacheLookupLatency", unit=MetricUnit.Milliseconds, value=latency_ms)
+
+        if best:
+            logger.info("Serving cached FAQ answer",
+                        cache_key=best.key,
+                        matched_question=best.question,
+                        similarity=round(best.similarity, 3),
+                        intent=intent,
+                        property_id=property_id)
+        return best
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'hit_rate': self.hit_rate, 'entries': len(self)}
+
+
+# Export main classes
+__all__ = ['ResponseCache', 'CachedAnswer', 'CacheMatch', 'property_fingerprint', 'normalize_question', 'key_facts']
@@ -0,0 +1,114 @@
+"""
+Speculative Response Drafting
+Local keyword intent prediction and the bookkeeping for drafting a reply
+in parallel with Claude's intent classification: accuracy, wasted tokens,
+and a rolling cap on how many tokens failed speculation may burn.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Any, Optional, Tuple
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+# Same keyword sets the webhook processor uses for its fallback routing
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    'maintenance': ['problema', 'fuga', 'no funciona', 'reparar', 'aire acondicionado', 'plomería'],
+    'leasing': ['precio', 'disponible', 'tour', 'renta', 'contrato', 'propiedad'],
+    'payments': ['pago', 'recibo', 'factura', 'cobro', 'tarjeta'],
+    'amenities': ['gym', 'co-working', 'azotea', 'terraza', 'mascotas', 'reserva']
+}
+
+# Dominant flows where a correct guess saves a full round trip
+SPECULATIVE_INTENTS = ('maintenance', 'leasing')
+
+
+def predict_intent(text: str) -> Tuple[Optional[str], int]:
+    """Keyword-match the most likely intent; returns (intent, matched keyword count)"""
+
+    text = text.lower()
+    best_intent, best_score = None, 0
+    for intent, keywords in INTENT_KEYWORDS.items():
+        score = sum(1 for keyword in keywords if keyword in text)
+        if score > best_score:
+            best_intent, best_score = intent, score
+    return best_intent, best_score
+
+
+class SpeculationController:
+    """Decides when to speculate and tracks how speculation pays off"""
+
+    def __init__(self, max_wasted_tokens_per_hour: int = None, min_keyword_matches: int = 1,
+                 intents: Tuple[str, ...] = SPECULATIVE_INTENTS, window_seconds: float = 3600):
+        self.max_wasted_tokens = max_wasted_tokens_per_hour if max_wasted_tokens_per_hour is not None else \
+            int(os.environ.get('CLAUDE_SPECULATION_MAX_WASTED_TOKENS_PER_HOUR', '50000'))
+        self.min_keyword_matches = min_keyword_matches
+        self.intents = intents
+        self.window_seconds = window_seconds
+
+        # (timestamp, tokens) of discarded drafts inside the rolling window
+        self._waste = deque()
+        self._lock = threading.Lock()
+
+        self.stats = {'hits': 0, 'misses': 0, 'capped': 0, 'wasted_tokens': 0}
+
+    @property
+    def accuracy(self) -> float:
+        attempts = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / attempts if attempts else 0.0
+
+    def _window_waste(self) -> int:
+        cutoff = time.monotonic() - self.window_seconds
+        while self._waste and self._waste[0][0] < cutoff:
+            self._waste.popleft()
+        return sum(tokens for _, tokens in self._waste)
+
+    def choose_intent(self, text: str) -> Optional[str]:
+        """Intent to draft a reply for, or None when speculation is not worth it"""
+
+        intent, score = predict_intent(text)
+        if intent not in self.intents or score < self.min_keyword_matches:
+            return None
+
+        with self._lock:
+            if self.max_wasted_tokens and self._window_waste() >= self.max_wasted_tokens:
+                self.stats['capped'] += 1
+                metrics.add_metric(name="SpeculationCapped", unit=MetricUnit.Count, value=1)
+                return None
+        return intent
+
+    def record_hit(self, intent: str):
+        self.stats['hits'] += 1
+        metrics.add_metric(name="SpeculationHit", unit=MetricUnit.Count, value=1)
+        logger.info("Speculative draft kept", intent=intent, accuracy=round(self.accuracy, 3))
+
+    def record_miss(self, predicted: str, actual: str, wasted_tokens: int):
+        with self._lock:
+            self._waste.append((time.monotonic(), wasted_tokens))
+        self.stats['misses'] += 1
+        self.stats['wasted_tokens'] += wasted_tokens
+
+        metrics.add_metric(name="SpeculationMiss", unit=MetricUnit.Count, value=1)
+        metrics.add_metric(name="SpeculationWastedTokens", unit=MetricUnit.Count, value=wasted_tokens)
+        logger.info("Speculative draft discarded",
+                    predicted_intent=predicted,
+                    actual_intent=actual,
+                    wasted_tokens=wasted_tokens,
+                    accuracy=round(self.accuracy, 3))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            window_waste = self._window_waste()
+        return {**self.stats, 'accuracy': self.accuracy, 'window_wasted_tokens': window_waste}
+
+
+# Export main classes
+__all__ = ['SpeculationController', 'predict_intent', 'INTENT_KEYWORDS', 'SPECULATIVE_INTENTS']
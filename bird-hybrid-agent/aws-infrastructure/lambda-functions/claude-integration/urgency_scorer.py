@@ -0,0 +1,163 @@
+"""
+Local Urgency Scoring for Inbound Messages
+Scores a message for emergencies (gas, flooding, fire, electrical hazards)
+with one precompiled regex over accent-folded text, so the webhook can
+route emergencies before, and independently of, Claude classification.
+Negated mentions ("ya no huele a gas", "sin fuga") do not count; a
+negation only reaches to the end of its own clause.
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, Tuple
+
+# Hazard phrases -> (hazard, weight). Weights are summed and capped at 1.0.
+# Bare utility words stay below the emergency bar: "¿el gas está incluido?" is a billing question.
+HAZARD_TERMS: Dict[str, Tuple[str, float]] = {
+    'gas': ('gas', 0.4),
+    'olor a gas': ('gas', 1.0),
+    'olor de gas': ('gas', 1.0),
+    'huele a gas': ('gas', 1.0),
+    'fuga de gas': ('gas', 1.0),
+    'fuga del gas': ('gas', 1.0),
+    'inundacion': ('flooding', 0.9),
+    'inundado': ('flooding', 0.9),
+    'inundando': ('flooding', 0.9),
+    'se inunda': ('flooding', 0.9),
+    'fuga de agua': ('flooding', 0.5),
+    'tuberia rota': ('flooding', 0.6),
+    'incendio': ('fire', 1.0),
+    'fuego': ('fire', 1.0),
+    'humo': ('fire', 0.8),
+    'se quema': ('fire', 0.8),
+    'chispas': ('electrical', 0.8),
+    'corto circuito': ('electrical', 0.8),
+    'cortocircuito': ('electrical', 0.8),
+    'cable pelado': ('electrical', 0.7),
+    'descarga electrica': ('electrical', 0.9),
+    'olor a quemado': ('electrical', 0.8),
+    'atrapado': ('entrapment', 0.8),
+    'atrapada': ('entrapment', 0.8),
+    'elevador detenido': ('entrapment', 0.7),
+}
+
+# Words that make a hazard more pressing, but are not one on their own
+INTENSIFIERS: Dict[str, float] = {
+    'urgente': 0.3,
+    'emergencia': 0.4,
+    'ayuda': 0.15,
+    'rapido': 0.1,
+    'ahora': 0.1,
+    'peligro': 0.3,
+}
+
+# The webhook's maintenance routing keywords, used when none are passed in
+MAINTENANCE_KEYWORDS = ('problema', 'fuga', 'no funciona', 'reparar', 'aire acondicionado', 'plomeria')
+MAINTENANCE_WEIGHT = 0.15
+
+# Sentiment heuristic from the conversation simulator: frustration nudges the score up, thanks down
+NEGATIVE_WORDS = ('problema', 'malo', 'frustra', 'cansado', 'molesto')
+POSITIVE_WORDS = ('gracias', 'perfecto', 'excelente', 'me gusta', 'bueno')
+SENTIMENT_WEIGHT = 0.1
+
+# A term preceded by one of these within NEGATION_WINDOW words of its own clause is ignored
+NEGATIONS = ('no', 'sin', 'nunca', 'ningun', 'ninguna', 'ni', 'tampoco', 'nada')
+NEGATION_WINDOW = 3
+
+# Punctuation and conjunctions that end a negation's scope: "el elevador no abre, estoy atrapado"
+CLAUSE_BOUNDARY = re.compile(r'[,.;:!?¡¿]|\b(?:pero|y|e|aunque|sino|porque|pues)\b')
+
+EMERGENCY_THRESHOLD = 0.7
+
+_WORD = re.compile(r'\w+')
+
+
+def fold(text: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+@dataclass(frozen=True, slots=True)
+class UrgencyScore:
+    """Urgency of one message"""
+    score: float
+    is_emergency: bool
+    hazards: Tuple[str, ...]
+    matched: Tuple[str, ...]
+
+
+class UrgencyScorer:
+    """Compiled emergency lexicon with negation handling
+
+    Every phrase is one alternative of a single regex, longest first, so a
+    message is scanned once. Phrases that themselves start with a negation
+    ("no funciona") are matched as a whole before the negation check sees
+    the words in front of them.
+    """
+
+    def __init__(self, maintenance_keywords: Iterable[str] = MAINTENANCE_KEYWORDS,
+                 threshold: float = EMERGENCY_THRESHOLD):
+        self.threshold = threshold
+        self._weights: Dict[str, Tuple[str, float]] = {}
+        for word in NEGATIVE_WORDS:
+            self._weights[word] = ('', SENTIMENT_WEIGHT)
+        for word in POSITIVE_WORDS:
+            self._weights[word] = ('', -SENTIMENT_WEIGHT)
+        for keyword in maintenance_keywords:
+            self._weights[fold(keyword)] = ('', MAINTENANCE_WEIGHT)
+        for word, weight in INTENSIFIERS.items():
+            self._weights[word] = ('', weight)
+        self._weights.update(HAZARD_TERMS)
+
+        terms = sorted(self._weights, key=len, reverse=True)
+        # Group 1 is the lexicon term, group 2 an optional plural suffix
+        self._pattern = re.compile(r'\b(' + '|'.join(map(re.escape, terms)) + r')(e?s)?\b')
+
+    def _negated(self, text: str, start: int) -> bool:
+        window = text[max(0, start - 40):start]
+        clause_start = 0
+        for boundary in CLAUSE_BOUNDARY.finditer(window):
+            clause_start = boundary.end()
+        before = _WORD.findall(window[clause_start:])[-NEGATION_WINDOW:]
+        return any(word in NEGATIONS for word in before)
+
+    def score(self, text: str) -> UrgencyScore:
+        text = text or ''
+        folded = fold(text)
+        total = 0.0
+        hazard_total = 0.0
+        hazards = []
+        matched = []
+
+        for match in self._pattern.finditer(folded):
+            term = match.group(1)
+            hazard, weight = self._weights[term]
+            if self._negated(folded, match.start()):
+                continue
+            matched.append(match.group(0))
+            total += weight
+            if hazard:
+                hazard_total += weight
+                if hazard not in hazards:
+                    hazards.append(hazard)
+
+        # Shouting ("FUGA!!!") reads as urgency too
+        if '!!' in text or (len(text) > 8 and text.isupper()):
+            total += 0.1
+
+        score = round(max(0.0, min(1.0, total)), 2)
+        # Intensifiers and frustration alone never make an emergency
+        is_emergency = score >= self.threshold and hazard_total >= 0.5
+        return UrgencyScore(score, is_emergency, tuple(hazards), tuple(matched))
+
+
+@lru_cache(maxsize=8)
+def get_urgency_scorer(maintenance_keywords: Tuple[str, ...] = MAINTENANCE_KEYWORDS) -> UrgencyScorer:
+    """Scorer compiled once per keyword set and reused across warm invocations"""
+    return UrgencyScorer(maintenance_keywords)
+
+
+# Export main classes
+__all__ = ['UrgencyScorer', 'UrgencyScore', 'get_urgency_scorer', 'EMERGENCY_THRESHOLD']
@@ -0,0 +1,173 @@
+"""
+Claude Usage Accounting and Budgets
+Per-user and per-day token rollups in DynamoDB, and budget checks that
+switch expensive conversations to tighter context and a cheaper model.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Tuple
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Tracer, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="claude-integration")
+tracer = Tracer(service="claude-integration")
+metrics = Metrics(namespace="UrbanHub/ClaudeIntegration")
+
+# Counters kept per conversation and per rollup
+USAGE_COUNTERS = ('input_tokens', 'output_tokens', 'cache_read_tokens', 'cache_write_tokens', 'total_tokens')
+
+# Past this fraction of the daily budget the cached total is re-read on every check
+BUDGET_RECHECK_FRACTION = 0.9
+
+
+def extract_usage(response: Any) -> Dict[str, int]:
+    """Read input, output and prompt-cache token counts from a Messages API response"""
+
+    usage = response.usage
+    input_tokens = usage.input_tokens or 0
+    output_tokens = usage.output_tokens or 0
+    cache_read_tokens = getattr(usage, 'cache_read_input_tokens', 0) or 0
+    cache_write_tokens = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+
+    return {
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cache_read_tokens': cache_read_tokens,
+        'cache_write_tokens': cache_write_tokens,
+        'total_tokens': input_tokens + output_tokens + cache_read_tokens + cache_write_tokens
+    }
+
+
+def empty_usage() -> Dict[str, int]:
+    return {counter: 0 for counter in USAGE_COUNTERS}
+
+
+class UsageAccountant:
+    """Maintains per-user and per-day usage rollups and enforces token budgets"""
+
+    def __init__(self, usage_table: str = None, conversation_budget: int = None, user_daily_budget: int = None,
+                 cache_seconds: float = None):
+        self.dynamodb = boto3.resource('dynamodb')
+        self.usage_table = self.dynamodb.Table(usage_table or os.environ.get('CLAUDE_USAGE_TABLE', 'claude-usage-rollups'))
+
+        # Token budgets (0 disables the check)
+        self.conversation_budget = conversation_budget if conversation_budget is not None else \
+            int(os.environ.get('CLAUDE_CONVERSATION_TOKEN_BUDGET', '200000'))
+        self.user_daily_budget = user_daily_budget if user_daily_budget is not None else \
+            int(os.environ.get('CLAUDE_USER_DAILY_TOKEN_BUDGET', '500000'))
+
+        # Latest known rollup totals and when they were read. Other containers add to the same
+        # rollups, so entries expire after cache_seconds and are re-read near the budget.
+        self._rollup_totals: Dict[str, Tuple[int, float]] = {}
+        self.cache_seconds = cache_seconds if cache_seconds is not None else \
+            float(os.environ.get('CLAUDE_USAGE_CACHE_SECONDS', '30'))
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    @staticmethod
+    def user_rollup_id(user_id: str, day: str) -> str:
+        return f"user#{user_id}#{day}"
+
+    @staticmethod
+    def day_rollup_id(day: str) -> str:
+        return f"day#{day}"
+
+    @tracer.capture_method
+    def record_usage(self, user_id: Optional[str], usage: Dict[str, int], model: str):
+        """Atomically add one turn's usage to the user-day and day rollups"""
+
+        day = self._today()
+        rollups = [(self.day_rollup_id(day), 'day')]
+        if user_id:
+            rollups.append((self.user_rollup_id(user_id, day), 'user_day'))
+
+        for rollup_id, rollup_type in rollups:
+            try:
+                response = self.usage_table.update_item(
+                    Key={'rollup_id': rollup_id},
+                    UpdateExpression=(
+                        "SET rollup_type = :rollup_type, #day = :day, #ttl = :ttl "
+                        "ADD request_count :one, " +
+                        ", ".join(f"{counter} :{counter}" for counter in USAGE_COUNTERS)
+                    ),
+                    ExpressionAttributeNames={'#day': 'day', '#ttl': 'ttl'},
+                    ExpressionAttributeValues={
+                        ':rollup_type': rollup_type,
+                        ':day': day,
+                        ':ttl': int(time.time()) + (90 * 24 * 3600),  # 90 days TTL
+                        ':one': 1,
+                        **{f':{counter}': usage[counter] for counter in USAGE_COUNTERS}
+                    },
+                    ReturnValues='UPDATED_NEW'
+                )
+                self._rollup_totals[rollup_id] = (int(response['Attributes']['total_tokens']), time.monotonic())
+            except (ClientError, BotoCoreError) as e:
+                # Accounting must never break a reply
+                logger.error(f"Failed to update usage rollup {rollup_id}: {str(e)}")
+
+        logger.info("Recorded Claude usage", user_id=user_id, model=model, total_tokens=usage['total_tokens'])
+
+        metrics.add_metric(name="ClaudeInputTokens", unit=MetricUnit.Count, value=usage['input_tokens'])
+        metrics.add_metric(name="ClaudeOutputTokens", unit=MetricUnit.Count, value=usage['output_tokens'])
+        metrics.add_metric(name="ClaudeCacheReadTokens", unit=MetricUnit.Count, value=usage['cache_read_tokens'])
+        metrics.add_metric(name="ClaudeCacheWriteTokens", unit=MetricUnit.Count, value=usage['cache_write_tokens'])
+
+    def get_user_daily_total(self, user_id: str) -> int:
+        """Tokens used by a user today, across every container
+
+        Served from the warm cache while it is fresh and well under the
+        budget; close to the budget the rollup item is read every time.
+        """
+
+        rollup_id = self.user_rollup_id(user_id, self._today())
+        cached = self._rollup_totals.get(rollup_id)
+        if cached is not None:
+            total, read_at = cached
+            fresh = time.monotonic() - read_at < self.cache_seconds
+            near_budget = self.user_daily_budget and \
+                BUDGET_RECHECK_FRACTION * self.user_daily_budget <= total < self.user_daily_budget
+            if fresh and not near_budget:
+                return total
+
+        try:
+            response = self.usage_table.get_item(Key={'rollup_id': rollup_id}, ConsistentRead=True)
+            total = int(response.get('Item', {}).get('total_tokens', 0))
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f"Failed to read usage rollup {rollup_id}: {str(e)}")
+            return cached[0] if cached is not None else 0
+
+        self._rollup_totals[rollup_id] = (total, time.monotonic())
+        return total
+
+    def check_budget(self, conversation_id: str, user_id: str, conversation_tokens: int) -> Optional[str]:
+        """Return which budget is exceeded ('conversation' or 'user_daily'), or None"""
+
+        exceeded = None
+        if self.conversation_budget and conversation_tokens >= self.conversation_budget:
+            exceeded = 'conversation'
+        elif self.user_daily_budget and user_id and self.get_user_daily_total(user_id) >= self.user_daily_budget:
+            exceeded = 'user_daily'
+
+        if exceeded:
+            metrics.add_metric(name="ClaudeBudgetExceeded", unit=MetricUnit.Count, value=1)
+            logger.info("Conversation over token budget, degrading request",
+                        conversation_id=conversation_id,
+                        user_id=user_id,
+                        budget=exceeded,
+                        conversation_tokens=conversation_tokens)
+
+        return exceeded
+
+
+# Export main classes
+__all__ = ['UsageAccountant', 'extract_usage', 'empty_usage', 'USAGE_COUNTERS']
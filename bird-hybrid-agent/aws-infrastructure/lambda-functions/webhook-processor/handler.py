@@ -9,6 +9,7 @@ Bird.com webhook → AWS Lambda → Enhanced processing → Response to Bird.com
 import json
 import os
 import time
+import asyncio
 import hmac
 import hashlib
 from typing import Dict, Any, Optional
@@ -23,6 +24,13 @@ from aws_lambda_powertools.utilities.typing import LambdaContext
 from aws_lambda_powertools.metrics import MetricUnit
 import anthropic
 
+# Shared Claude integration modules (packaged alongside this handler)
+from claude_resilience import ResilientCaller, CircuitOpenError
+from prompt_registry import get_prompt_registry
+from burst_coalescer import BurstCoalescer, Burst
+from urgency_scorer import get_urgency_scorer, UrgencyScore
+from multimodal_dispatcher import MultimodalDispatcher
+
 # Initialize AWS Powertools
 logger = Logger(service="bird-webhook-processor")
 tracer = Tracer(service="bird-webhook-processor")  
@@ -33,8 +41,31 @@ dynamodb = boto3.resource('dynamodb')
 s3_client = boto3.client('s3')
 eventbridge = boto3.client('events')
 
-# Initialize Claude client
-claude_client = anthropic.Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'])
+# Initialize Claude client (retries are handled by the resilience layer)
+claude_client = anthropic.Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'], max_retries=0)
+
+# Module-level so breaker state and latency history survive across warm invocations
+claude_resilience = ResilientCaller()
+
+# Prompts are parsed once per cold start
+prompt_registry = get_prompt_registry()
+
+# Quick follow-up messages of a conversation are handled as one turn
+burst_coalescer = BurstCoalescer()
+
+# Per-type worker pools shared by every attachment of every warm invocation
+multimodal_dispatcher = MultimodalDispatcher()
+
+# Sent to the user as soon as an emergency is detected, before any Claude call
+EMERGENCY_ACKNOWLEDGEMENT = (
+    "Recibimos tu reporte de emergencia. Ya notificamos a Mantenimiento con prioridad URGENTE. "
+    "Si hay riesgo inmediato (gas, fuego, humo), sal del departamento y llama al 911."
+)
+
+# Routing events; a turn already routed by the emergency fast lane gets the second type,
+# so the orchestrator rule does not dispatch Maintenance twice
+ROUTING_DETAIL_TYPE = 'Agent Routing Required'
+ROUTING_FOLLOW_UP_DETAIL_TYPE = 'Agent Routing Classified'
 
 # Environment variables
 CONVERSATION_TABLE = os.environ['CONVERSATION_TABLE']
@@ -73,6 +104,9 @@ class WebhookProcessor:
                 'priority': 'low'
             }
         }
+        
+        # Compiled once per keyword set and reused across warm invocations
+        self.urgency_scorer = get_urgency_scorer(tuple(self.agent_routing['maintenance']['keywords']))
     
     @tracer.capture_method
     def verify_webhook_signature(self, payload: str, signature: str) -> bool:
@@ -97,51 +131,104 @@ class WebhookProcessor:
     async def classify_intent_with_claude(self, message: Dict[str, Any]) -> Dict[str, Any]:
         """Use Claude to classify user intent and extract entities"""
         
-        prompt = f"""
-        Analiza el siguiente mensaje de WhatsApp y clasifica la intención del usuario.
-        
-        Mensaje: "{message.get('text', '')}"
-        Usuario: {message.get('sender', {}).get('name', 'Anónimo')}
-        Contexto: {message.get('context', {})}
-        
-        Categorías posibles:
-        1. MANTENIMIENTO - Problemas técnicos, reparaciones, fallas
-        2. LEASING - Información de propiedades, precios, tours  
-        3. PAGOS - Facturación, recibos, problemas de pago
-        4. AMENIDADES - Reservas, uso de espacios comunes
-        5. OTROS - Consultas generales
-        
-        Responde en formato JSON con:
-        {{
-            "intent": "categoria_principal",
-            "confidence": 0.95,
-            "entities": {{"urgency": "high/medium/low", "property": "nombre_si_aplica"}},
-            "routing_recommendation": "agent_sugerido",
-            "reasoning": "justificación_breve"
-        }}
-        """
+        intent_prompt = prompt_registry.get('intent-classification')
+        prompt = intent_prompt.render_user(
+            message_text=message.get('text', ''),
+            sender_name=message.get('sender', {}).get('name', 'Anónimo'),
+            message_context=message.get('context', {})
+        )
         
         try:
-            response = claude_client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=1000,
-                temperature=0.1,
-                messages=[{"role": "user", "content": prompt}]
+            response = await claude_resilience.call(
+                lambda: asyncio.to_thread(
+                    claude_client.messages.create,
+                    model="claude-3-5-sonnet-20241022",
+                    max_tokens=1000,
+                    temperature=0.1,
+                    system=intent_prompt.render_system(),
+                    messages=[{"role": "user", "content": prompt}]
+                )
             )
             
             classification = json.loads(response.content[0].text)
             
             # Add processing metadata
+            classification['prompt_version'] = intent_prompt.version
             classification['processed_at'] = datetime.now().isoformat()
             classification['processing_time_ms'] = time.time() * 1000
             
             return classification
             
+        except CircuitOpenError:
+            # Claude is unhealthy: skip straight to keywords without waiting on the API
+            logger.warning("Claude circuit open, using keyword classification")
+            metrics.add_metric(name="ClassificationCircuitFallback", unit=MetricUnit.Count, value=1)
+            return self.fallback_classify_intent(message)
+            
         except Exception as e:
             logger.error("Claude classification failed", error=str(e))
             # Fallback to keyword-based classification
             return self.fallback_classify_intent(message)
     
+    @tracer.capture_method
+    async def process_webhook(self, conversation_id: str, message_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Classify, store and route one turn; None when a later message of the burst will carry this one"""
+        
+        # Scored locally in well under a millisecond, so emergencies never queue behind Claude
+        urgency = self.urgency_scorer.score(message_data.get('message', {}).get('text', ''))
+        if urgency.is_emergency and await self.publish_emergency_fast_lane(conversation_id, urgency, message_data):
+            # Kept with the buffered payload, so a recovered burst knows it was routed too
+            message_data = {**message_data, 'fast_lane_routed': True}
+        
+        burst = await burst_coalescer.add(conversation_id, message_data, urgent=urgency.is_emergency)
+        if burst is None:
+            return None
+        
+        return await self.process_burst(conversation_id, burst, urgency)
+    
+    @tracer.capture_method
+    async def recover_bursts(self) -> int:
+        """Process bursts whose flushing invocation timed out or crashed"""
+        
+        bursts = await asyncio.to_thread(burst_coalescer.sweep)
+        for burst in bursts:
+            # Emergencies got their fast lane on arrival; the score only annotates the analysis here
+            urgency = self.urgency_scorer.score(burst.merged().get('message', {}).get('text', ''))
+            await self.process_burst(burst.conversation_id, burst, urgency)
+        return len(bursts)
+    
+    @tracer.capture_method
+    async def process_burst(self, conversation_id: str, burst: Burst, urgency: UrgencyScore) -> Dict[str, Any]:
+        """Classify, store and route a burst of messages as one turn"""
+        
+        message_data = burst.merged()
+        message = message_data.get('message', {})
+        fast_lane_routed = any(payload.get('fast_lane_routed') for payload in burst.messages)
+        
+        # Classify intent using Claude
+        classification = await self.classify_intent_with_claude(message)
+        
+        # Process multimodal content
+        media_analysis = await self.process_multimodal_content(message)
+        
+        # Combine analysis results
+        enhanced_analysis = {
+            **classification,
+            'media_analysis': media_analysis,
+            'conversation_id': conversation_id,
+            'burst_size': len(burst.messages),
+            'urgency': {'score': urgency.score, 'hazards': list(urgency.hazards), 'fast_lane': fast_lane_routed}
+        }
+        
+        # Store conversation state and analysis
+        await self.store_conversation_state(conversation_id, message_data)
+        await self.store_analysis_result(conversation_id, enhanced_analysis)
+        
+        # Publish routing event for specialized agents
+        await self.publish_routing_event(enhanced_analysis, message_data, follow_up=fast_lane_routed)
+        
+        return enhanced_analysis
+    
     @tracer.capture_method
     def fallback_classify_intent(self, message: Dict[str, Any]) -> Dict[str, Any]:
         """Fallback keyword-based intent classification"""
@@ -199,8 +286,13 @@ class WebhookProcessor:
             raise
     
     @tracer.capture_method
-    async def publish_routing_event(self, classification: Dict[str, Any], message_data: Dict[str, Any]):
-        """Publish agent routing event to EventBridge"""
+    async def publish_routing_event(self, classification: Dict[str, Any], message_data: Dict[str, Any],
+                                    follow_up: bool = False):
+        """Publish agent routing event to EventBridge
+        
+        A follow-up to the emergency fast lane is published under its own
+        DetailType, which the orchestrator rule does not match.
+        """
         
         event_detail = {
             'routing_decision': classification,
@@ -213,7 +305,7 @@ class WebhookProcessor:
                 Entries=[
                     {
                         'Source': 'urbanhub.bird.webhook',
-                        'DetailType': 'Agent Routing Required',
+                        'DetailType': ROUTING_FOLLOW_UP_DETAIL_TYPE if follow_up else ROUTING_DETAIL_TYPE,
                         'Detail': json.dumps(event_detail),
                         'EventBusName': EVENT_BUS_NAME
                     }
@@ -227,54 +319,105 @@ class WebhookProcessor:
             raise
     
     @tracer.capture_method
-    async def process_multimodal_content(self, message: Dict[str, Any]) -> Dict[str, Any]:
-        """Process multimedia content (images, voice, documents)"""
+    async def publish_emergency_fast_lane(self, conversation_id: str, urgency: UrgencyScore,
+                                          message_data: Dict[str, Any]) -> bool:
+        """Route an emergency to Maintenance and acknowledge the user in one EventBridge call
+        
+        Returns whether the routing event was accepted. If so, the routing
+        event sent once Claude has classified the turn is a follow-up
+        (ROUTING_FOLLOW_UP_DETAIL_TYPE); otherwise it is the regular one.
+        The acknowledgement is delivered by the EmergencyAcknowledgementRule.
+        """
         
-        content_analysis = {
-            'has_media': False,
-            'media_types': [],
-            'processing_required': []
+        start_time = time.time()
+        routing_decision = {
+            'intent': 'maintenance',
+            'confidence': urgency.score,
+            'entities': {'urgency': 'urgent', 'hazards': list(urgency.hazards)},
+            'routing_recommendation': 'maintenance-agent',
+            'priority': self.agent_routing['maintenance']['priority'],
+            'reasoning': f"Local urgency scoring matched: {', '.join(urgency.matched)}",
+            'fast_lane': True
         }
+        timestamp = datetime.now().isoformat()
         
-        # Check for different content types
-        if message.get('type') == 'image':
-            content_analysis['has_media'] = True
-            content_analysis['media_types'].append('image')
-            content_analysis['processing_required'].append('visual-analyzer')
+        try:
+            response = await asyncio.to_thread(
+                eventbridge.put_events,
+                Entries=[
+                    {
+                        'Source': 'urbanhub.bird.webhook',
+                        'DetailType': ROUTING_DETAIL_TYPE,
+                        'Detail': json.dumps({
+                            'routing_decision': routing_decision,
+                            'message_data': message_data,
+                            'timestamp': timestamp
+                        }),
+                        'EventBusName': EVENT_BUS_NAME
+                    },
+                    {
+                        'Source': 'urbanhub.bird.webhook',
+                        'DetailType': 'User Acknowledgement Required',
+                        'Detail': json.dumps({
+                            'conversation_id': conversation_id,
+                            'text': EMERGENCY_ACKNOWLEDGEMENT,
+                            'message_data': message_data,
+                            'timestamp': timestamp
+                        }),
+                        'EventBusName': EVENT_BUS_NAME
+                    }
+                ]
+            )
             
-        elif message.get('type') == 'voice':
-            content_analysis['has_media'] = True
-            content_analysis['media_types'].append('voice')
-            content_analysis['processing_required'].append('voice-assistant')
+            if response.get('FailedEntryCount'):
+                logger.error("Emergency fast lane partially failed", conversation_id=conversation_id,
+                             entries=response.get('Entries'))
+            routed = 'ErrorCode' not in response['Entries'][0]
             
-        elif message.get('type') == 'document':
-            content_analysis['has_media'] = True
-            content_analysis['media_types'].append('document')
-            content_analysis['processing_required'].append('document-processor')
+            metrics.add_metric(name="EmergencyFastLane", unit=MetricUnit.Count, value=1)
+            metrics.add_metric(name="EmergencyFastLaneLatency", unit=MetricUnit.Milliseconds,
+                               value=int((time.time() - start_time) * 1000))
+            logger.info("Emergency routed via fast lane", conversation_id=conversation_id,
+                        hazards=list(urgency.hazards), score=urgency.score)
+            return routed
+            
+        except ClientError as e:
+            # The regular routing event still goes out after classification
+            logger.error("Failed to publish emergency fast lane", error=str(e))
+            return False
+    
+    @tracer.capture_method
+    async def process_multimodal_content(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Process multimedia content (images, voice, documents)
         
-        # Store media in S3 if present
-        if content_analysis['has_media']:
-            media_url = await self.store_media_in_s3(message)
-            content_analysis['s3_url'] = media_url
+        Every attachment is analyzed and stored concurrently, so a message
+        with several photos takes about as long as one.
+        """
         
-        return content_analysis
+        async def store(attachment: Dict[str, Any]) -> str:
+            return await self.store_media_in_s3(
+                {**attachment, 'conversation_id': message.get('conversation_id')}, attachment['index']
+            )
+        
+        return await multimodal_dispatcher.analyze(message, store=store)
 
     @tracer.capture_method
-    async def store_media_in_s3(self, message: Dict[str, Any]) -> str:
+    async def store_media_in_s3(self, message: Dict[str, Any], index: int = 0) -> str:
         """Store multimedia content in S3"""
         
         conversation_id = message.get('conversation_id')
         timestamp = int(time.time())
         
-        # Generate S3 key
+        # Generate S3 key (index keeps attachments of one message apart)
         file_extension = self.get_file_extension(message.get('type'))
-        s3_key = f"media/{conversation_id}/{timestamp}.{file_extension}"
+        s3_key = f"media/{conversation_id}/{timestamp}-{index}.{file_extension}"
         
         try:
             # Store media content (assuming base64 encoded)
             media_content = message.get('media_data', '')
             
-            s3_client.put_object(
+            await asyncio.to_thread(
+                s3_client.put_object,
                 Bucket=S3_BUCKET,
                 Key=s3_key,
                 Body=media_content,
@@ -316,6 +459,11 @@ def lambda_handler(event: Dict[str, Any], context: LambdaContext) -> Dict[str, A
     
     processor = WebhookProcessor()
     
+    if isinstance(event, dict) and event.get('source') == 'aws.events':
+        # Scheduled sweep for bursts abandoned by a timed-out or crashed invocation
+        recovered = asyncio.run(processor.recover_bursts())
+        return {'statusCode': 200, 'body': json.dumps({'success': True, 'recovered_bursts': recovered})}
+    
     try:
         # Parse the incoming webhook
         if isinstance(event, dict) and 'body' in event:
@@ -339,36 +487,29 @@ def lambda_handler(event: Dict[str, Any], context: LambdaContext) -> Dict[str, A
         # Parse message data
         message_data = json.loads(body)
         conversation_id = message_data.get('conversation_id')
-        message = message_data.get('message', {})
         
         logger.info("Processing webhook", conversation_id=conversation_id)
         
-        # Classify intent using Claude
-        classification = processor.classify_intent_with_claude(message)
-        
-        # Process multimodal content
-        media_analysis = processor.process_multimodal_content(message)
+        enhanced_analysis = asyncio.run(processor.process_webhook(conversation_id, message_data))
         
-        # Combine analysis results
-        enhanced_analysis = {
-            **classification,
-            'media_analysis': media_analysis,
-            'conversation_id': conversation_id
-        }
-        
-        # Store conversation state and analysis
-        processor.store_conversation_state(conversation_id, message_data)
-        processor.store_analysis_result(conversation_id, enhanced_analysis)
-        
-        # Publish routing event for specialized agents
-        processor.publish_routing_event(enhanced_analysis, message_data)
+        if enhanced_analysis is None:
+            # Buffered: the newest message of this burst answers for it
+            metrics.add_metric(name="WebhookBuffered", unit=MetricUnit.Count, value=1)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'success': True,
+                    'conversation_id': conversation_id,
+                    'buffered': True
+                })
+            }
         
         # Add metrics
-        metrics.add_metric("WebhookProcessed", 1, MetricUnit.Count)
-        metrics.add_metric("IntentClassified", 1, MetricUnit.Count)
+        metrics.add_metric(name="WebhookProcessed", unit=MetricUnit.Count, value=1)
+        metrics.add_metric(name="IntentClassified", unit=MetricUnit.Count, value=1)
         
         if enhanced_analysis['confidence'] > 0.9:
-            metrics.add_metric("HighConfidenceClassification", 1, MetricUnit.Count)
+            metrics.add_metric(name="HighConfidenceClassification", unit=MetricUnit.Count, value=1)
         
         # Return success response
         return {
@@ -391,7 +532,7 @@ def lambda_handler(event: Dict[str, Any], context: LambdaContext) -> Dict[str, A
         
     except Exception as e:
         logger.error("Webhook processing failed", error=str(e))
-        metrics.add_metric("WebhookErrors", 1, MetricUnit.Count)
+        metrics.add_metric(name="WebhookErrors", unit=MetricUnit.Count, value=1)
         
         return {
             'statusCode': 500,
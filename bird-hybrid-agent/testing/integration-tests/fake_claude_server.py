@@ -0,0 +1,144 @@
+"""
+Local Fake Claude API Server for Testing
+Speaks enough of the Anthropic Messages and Message Batches APIs to
+exercise the real SDK, with scripted status codes and injected latency.
+"""
+
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional
+
+
+class FakeClaudeServer:
+    """Threaded HTTP server emulating POST /v1/messages"""
+
+    def __init__(self, response_text: str = '{"intent": "maintenance", "confidence": 0.95}'):
+        self.response_text = response_text
+        self.script = deque()  # (status_code, latency_seconds) per request
+        self.default_latency = 0.0
+        self.requests: List[Dict[str, Any]] = []
+        self.response_headers: Dict[str, str] = {}
+        self.batches: Dict[str, List[Dict[str, Any]]] = {}
+        self.batch_polls_until_ended = 1
+        self._batch_polls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def enqueue(self, status_code: int = 200, latency: float = 0.0, count: int = 1):
+        """Script the next responses"""
+        for _ in range(count):
+            self.script.append((status_code, latency))
+
+    def start(self) -> 'FakeClaudeServer':
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('content-length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+
+                if self.path.startswith('/v1/messages/batches'):
+                    with server._lock:
+                        batch_id = f'msgbatch_{len(server.batches) + 1}'
+                        server.batches[batch_id] = body['requests']
+                    self._send_json(200, {'id': batch_id, 'type': 'message_batch', 'processing_status': 'in_progress'})
+                    return
+
+                with server._lock:
+                    server.requests.append(body)
+                    status_code, latency = server.script.popleft() if server.script else (200, server.default_latency)
+
+                time.sleep(latency)
+
+                if status_code == 200:
+                    payload = {
+                        'id': f'msg_{len(server.requests)}',
+                        'type': 'message',
+                        'role': 'assistant',
+                        'model': body.get('model', 'claude-test'),
+                        'content': [{'type': 'text', 'text': server.response_text}],
+                        'stop_reason': 'end_turn',
+                        'stop_sequence': None,
+                        'usage': {'input_tokens': 25, 'output_tokens': 12}
+                    }
+                else:
+                    payload = {'type': 'error', 'error': {'type': 'api_error', 'message': f'Injected {status_code}'}}
+
+                encoded = json.dumps(payload).encode('utf-8')
+                try:
+                    self.send_response(status_code)
+                    self.send_header('content-type', 'application/json')
+                    self.send_header('content-length', str(len(encoded)))
+                    for name, value in server.response_headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(encoded)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client gave up (e.g. a cancelled hedge)
+                    pass
+
+            def do_GET(self):
+                parts = self.path.split('?')[0].strip('/').split('/')  # v1/messages/batches/{id}[/results]
+                batch_id = parts[3]
+
+                if len(parts) == 5 and parts[4] == 'results':
+                    lines = [
+                        json.dumps({
+                            'custom_id': request['custom_id'],
+                            'result': {
+                                'type': 'succeeded',
+                                'message': {
+                                    'content': [{'type': 'text', 'text': server.response_text}],
+                                    'usage': {'input_tokens': 25, 'output_tokens': 12}
+                                }
+                            }
+                        })
+                        for request in server.batches[batch_id]
+                    ]
+                    encoded = '\n'.join(lines).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('content-type', 'application/binary')
+                    self.send_header('content-length', str(len(encoded)))
+                    self.end_headers()
+                    self.wfile.write(encoded)
+                    return
+
+                with server._lock:
+                    server._batch_polls[batch_id] = server._batch_polls.get(batch_id, 0) + 1
+                    ended = server._batch_polls[batch_id] >= server.batch_polls_until_ended
+                self._send_json(200, {
+                    'id': batch_id,
+                    'type': 'message_batch',
+                    'processing_status': 'ended' if ended else 'in_progress'
+                })
+
+            def _send_json(self, status_code, payload):
+                encoded = json.dumps(payload).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('content-type', 'application/json')
+                self.send_header('content-length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,187 @@
+"""
+Local Fake WhatsApp Graph API Server for Testing
+Accepts message sends, read receipts, media lookups and media uploads over
+HTTP/1.1 keep-alive, with scripted errors, injected latency and connection
+counting. Also serves /assets/ as a stand-in for our own asset origin.
+"""
+
+import json
+import ssl
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional
+
+
+def generated_chunk() -> bytes:
+    """64 KiB pattern that generated media repeats"""
+    return bytes(range(256)) * 256
+
+
+def generated_media_bytes(size: int) -> bytes:
+    """Full content of a generated media file, for checking what was uploaded"""
+    chunk = generated_chunk()
+    return (chunk * (size // len(chunk) + 1))[:size]
+
+
+class FakeGraphServer:
+    """Threaded HTTP(S) server emulating the Graph endpoints WhatsAppClient uses"""
+
+    def __init__(self, certfile: str = None, keyfile: str = None):
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.script = deque()  # (status_code, error_code, latency_seconds) per message send
+        self.default_latency = 0.0
+        self.requests: List[Dict[str, Any]] = []
+        self.media: Dict[str, bytes] = {}
+        self.generated_media: Dict[str, int] = {}  # media_id -> size, streamed without being held in memory
+        self.assets: Dict[str, bytes] = {}  # files on "our" origin, served under /assets/
+        self.asset_fetches = 0
+        self.uploads: List[Dict[str, Any]] = []  # files posted to /media
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        scheme = 'https' if self.certfile else 'http'
+        return f"{scheme}://{host}:{port}"
+
+    def enqueue(self, status_code: int = 200, error_code: int = None, latency: float = 0.0, count: int = 1):
+        """Script the next message-send responses (error_code is the Graph error.code)"""
+        for _ in range(count):
+            self.script.append((status_code, error_code, latency))
+
+    def start(self) -> 'FakeGraphServer':
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def _send_json(self, status_code: int, payload: Dict[str, Any]):
+                encoded = json.dumps(payload).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('content-type', 'application/json')
+                self.send_header('content-length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def do_POST(self):
+                length = int(self.headers.get('content-length', 0))
+                raw = self.rfile.read(length)
+
+                if self.path.endswith('/media'):
+                    with server._lock:
+                        media_id = f'uploaded{len(server.uploads) + 1}'
+                        server.uploads.append({'id': media_id, 'bytes': length, 'body': raw,
+                                               'content_type': self.headers.get('content-type', ''),
+                                               'chunked': 'transfer-encoding' in self.headers})
+                    self._send_json(200, {'id': media_id})
+                    return
+
+                body = json.loads(raw or b'{}')
+
+                with server._lock:
+                    server.requests.append({'path': self.path, 'body': body, 'time': time.monotonic()})
+                    count = len(server.requests)
+                    if body.get('status') == 'read':
+                        status_code, error_code, latency = 200, None, server.default_latency
+                    else:
+                        status_code, error_code, latency = server.script.popleft() if server.script \
+                            else (200, None, server.default_latency)
+
+                time.sleep(latency)
+
+                if status_code != 200:
+                    self._send_json(status_code, {'error': {
+                        'message': f'Injected error {error_code}',
+                        'type': 'OAuthException',
+                        'code': error_code or status_code
+                    }})
+                elif body.get('status') == 'read':
+                    self._send_json(200, {'success': True})
+                else:
+                    self._send_json(200, {
+                        'messaging_product': 'whatsapp',
+                        'contacts': [{'input': body.get('to'), 'wa_id': body.get('to')}],
+                        'messages': [{'id': f'wamid.fake{count}'}]
+                    })
+
+            def do_GET(self):
+                parts = self.path.split('?')[0].strip('/').split('/')
+                if parts[0] == 'assets':
+                    content = server.assets.get(parts[1])
+                    if content is None:
+                        self._send_json(404, {'error': 'not found'})
+                        return
+                    with server._lock:
+                        server.asset_fetches += 1
+                    self.send_response(200)
+                    self.send_header('content-type', 'application/pdf' if parts[1].endswith('.pdf') else 'image/jpeg')
+                    self.send_header('content-length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                    return
+
+                if parts[0] == 'media-bytes':
+                    if parts[1] in server.generated_media:
+                        self._stream_generated(server.generated_media[parts[1]])
+                        return
+                    content = server.media.get(parts[1], b'')
+                    self.send_response(200)
+                    self.send_header('content-type', 'application/octet-stream')
+                    self.send_header('content-length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                    return
+
+                media_id = parts[-1]
+                if media_id in server.generated_media:
+                    file_size = server.generated_media[media_id]
+                elif media_id in server.media:
+                    file_size = len(server.media[media_id])
+                else:
+                    self._send_json(404, {'error': {'message': 'Unknown media', 'code': 100}})
+                    return
+                self._send_json(200, {
+                    'url': f"{server.base_url}/media-bytes/{media_id}",
+                    'mime_type': 'application/octet-stream',
+                    'file_size': file_size,
+                    'id': media_id
+                })
+
+            def _stream_generated(self, size: int):
+                self.send_response(200)
+                self.send_header('content-type', 'application/octet-stream')
+                self.send_header('content-length', str(size))
+                self.end_headers()
+                chunk = generated_chunk()
+                remaining = size
+                while remaining:
+                    self.wfile.write(chunk[:remaining])
+                    remaining -= min(remaining, len(chunk))
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        if self.certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.certfile, self.keyfile)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,1227 @@
+"""
+Unit Tests for the Claude Integration Client
+Covers request handling features that can run without the live Claude API
+"""
+
+import io
+import os
+import re
+import sys
+import base64
+import time
+import wave
+import zlib
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+import anthropic
+import boto3
+import pytest
+from moto import mock_dynamodb
+from PIL import Image
+
+# Import our components
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../aws-infrastructure/lambda-functions/claude-integration'))
+from claude_client import ClaudeClient, ClaudeRequest, ConversationContext
+from request_coalescer import RequestCoalescer, build_request_key
+from image_preprocessor import ImagePreprocessor
+from claude_resilience import ResilientCaller, RetryPolicy, CircuitBreaker, CircuitOpenError, LatencyTracker
+from admission_control import AdmissionController, AdmissionRejectedError
+from prompt_registry import PromptRegistry, CompiledTemplate, parse_prompt_markdown, get_prompt_registry
+from bulk_classifier import BulkClassifier, BulkCheckpoint, StubBackend
+from response_cache import ResponseCache
+from usage_accounting import UsageAccountant, empty_usage
+from compact_records import ConversationMessage
+from speculation import SpeculationController
+from burst_coalescer import BurstCoalescer, Burst
+from urgency_scorer import UrgencyScorer
+from multimodal_dispatcher import MultimodalDispatcher
+from fake_claude_server import FakeClaudeServer
+
+
+def make_claude_response(text: str, input_tokens: int = 10, output_tokens: int = 5):
+    """Build an object shaped like an Anthropic Messages API response"""
+    return SimpleNamespace(
+        content=[SimpleNamespace(type='text', text=text)],
+        usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens),
+        stop_reason='end_turn'
+    )
+
+
+def make_image(width: int, height: int, fmt: str = 'JPEG', mode: str = 'RGB', orientation: int = None) -> str:
+    """Build a base64 encoded test image"""
+    image = Image.new(mode, (width, height), color='red')
+    buffer = io.BytesIO()
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(buffer, format=fmt, exif=exif)
+    else:
+        image.save(buffer, format=fmt)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def create_table(dynamodb, name: str, key: str):
+    dynamodb.create_table(
+        TableName=name,
+        KeySchema=[{'AttributeName': key, 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': key, 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+@pytest.fixture
+def claude_client(monkeypatch):
+    """Claude client with environment configured for tests and mocked DynamoDB tables"""
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-anthropic-key')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with mock_dynamodb():
+        dynamodb = boto3.resource('dynamodb')
+        create_table(dynamodb, 'conversation-context', 'conversation_id')
+        create_table(dynamodb, 'claude-usage-rollups', 'rollup_id')
+        yield ClaudeClient()
+
+
+@pytest.fixture
+def fake_claude_server():
+    """Local fake Claude API with injectable latency and errors"""
+    server = FakeClaudeServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def fake_server_client(claude_client, fake_claude_server):
+    """Claude client whose SDK talks to the local fake server"""
+    claude_client.client = anthropic.Anthropic(
+        api_key='test-anthropic-key',
+        base_url=fake_claude_server.base_url,
+        max_retries=0
+    )
+    claude_client.coalesce_requests = False
+    claude_client.resilience = ResilientCaller(
+        retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.05),
+        circuit_breaker=CircuitBreaker(failure_threshold=3, recovery_timeout=0.2)
+    )
+    return claude_client
+
+
+class TestRequestCoalescing:
+    """Single-flight coalescing of identical in-flight requests"""
+
+    @pytest.mark.asyncio
+    async def test_identical_requests_share_one_call(self, claude_client, monkeypatch):
+        calls = []
+
+        async def fake_call(messages, system_prompt, config):
+            calls.append(messages)
+            await asyncio.sleep(0.05)
+            return make_claude_response('{"intent": "maintenance"}')
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+
+        request = ClaudeRequest(prompt_type='intent-classification', content='tengo una fuga')
+        responses = await asyncio.gather(*[claude_client.process_request(request) for _ in range(5)])
+
+        assert len(calls) == 1
+        assert all(r.content == '{"intent": "maintenance"}' for r in responses)
+        assert claude_client.request_coalescer.get_stats()['requests_coalesced'] == 4
+        assert claude_client.request_coalescer.in_flight_count == 0
+
+    @pytest.mark.asyncio
+    async def test_different_requests_are_not_coalesced(self, claude_client, monkeypatch):
+        calls = []
+
+        async def fake_call(messages, system_prompt, config):
+            calls.append(messages)
+            await asyncio.sleep(0.01)
+            return make_claude_response('ok')
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+
+        await asyncio.gather(
+            claude_client.process_request(ClaudeRequest(prompt_type='intent-classification', content='hola')),
+            claude_client.process_request(ClaudeRequest(prompt_type='response-generation', content='hola')),
+            claude_client.process_request(ClaudeRequest(prompt_type='intent-classification', content='adiós'))
+        )
+
+        assert len(calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_shared_call(self):
+        coalescer = RequestCoalescer()
+
+        async def slow_call():
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        first = asyncio.ensure_future(coalescer.run('key', slow_call))
+        second = asyncio.ensure_future(coalescer.run('key', slow_call))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        assert await second == 'result'
+        assert first.cancelled()
+
+    @pytest.mark.asyncio
+    async def test_call_abandoned_when_all_callers_cancel(self):
+        coalescer = RequestCoalescer()
+        finished = []
+
+        async def slow_call():
+            await asyncio.sleep(1)
+            finished.append(True)
+
+        caller = asyncio.ensure_future(coalescer.run('key', slow_call))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0.01)
+
+        assert not finished
+        assert coalescer.get_stats()['calls_abandoned'] == 1
+        assert coalescer.in_flight_count == 0
+
+    @pytest.mark.asyncio
+    async def test_errors_propagate_to_every_caller(self):
+        coalescer = RequestCoalescer()
+
+        async def failing_call():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('overloaded')
+
+        results = await asyncio.gather(
+            coalescer.run('key', failing_call),
+            coalescer.run('key', failing_call),
+            return_exceptions=True
+        )
+
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    def test_request_key_is_canonical(self):
+        messages = [{"role": "user", "content": "hola"}]
+
+        assert build_request_key('intent-classification', 'model', messages) == \
+            build_request_key('intent-classification', 'model', [{"content": "hola", "role": "user"}])
+        assert build_request_key('intent-classification', 'model', messages) != \
+            build_request_key('response-generation', 'model', messages)
+
+
+class TestImagePreprocessing:
+    """Image normalization before multimodal Claude calls"""
+
+    def test_detects_real_format(self):
+        preprocessor = ImagePreprocessor(max_edge=1568)
+
+        prepared = preprocessor.prepare_image(make_image(100, 80, fmt='PNG'))
+
+        assert prepared.media_type == 'image/png'
+        assert (prepared.width, prepared.height) == (100, 80)
+
+    def test_downscales_to_max_edge(self):
+        preprocessor = ImagePreprocessor(max_edge=512)
+
+        prepared = preprocessor.prepare_image(make_image(4000, 3000))
+
+        assert max(prepared.width, prepared.height) == 512
+        assert prepared.media_type == 'image/jpeg'
+        assert prepared.prepared_bytes < prepared.original_bytes
+        assert prepared.prepared_tokens < prepared.original_tokens
+
+    def test_applies_exif_orientation(self):
+        preprocessor = ImagePreprocessor(max_edge=1568)
+
+        # Orientation 6 means the camera stored the photo rotated 90 degrees
+        prepared = preprocessor.prepare_image(make_image(200, 100, orientation=6))
+
+        assert (prepared.width, prepared.height) == (100, 200)
+
+    def test_unsupported_format_is_converted(self):
+        preprocessor = ImagePreprocessor(max_edge=1568)
+
+        prepared = preprocessor.prepare_image(make_image(50, 50, fmt='BMP'))
+
+        assert prepared.media_type == 'image/jpeg'
+
+    def test_results_are_cached_by_content(self):
+        preprocessor = ImagePreprocessor(max_edge=256)
+        image_data = make_image(1000, 1000)
+
+        assert preprocessor.prepare_image(image_data) is preprocessor.prepare_image(image_data)
+
+    @pytest.mark.asyncio
+    async def test_multimodal_call_uses_prepared_images(self, claude_client, monkeypatch):
+        sent = {}
+
+        async def fake_create(**kwargs):
+            sent.update(kwargs)
+            return make_claude_response('Veo una cocina amplia')
+
+        monkeypatch.setattr(claude_client, '_create_message', fake_create)
+
+        await claude_client.process_multimodal_content(
+            content='¿Qué opinas de esta propiedad?',
+            image_data=[make_image(3000, 2000, fmt='PNG'), make_image(64, 64, fmt='WEBP')]
+        )
+
+        images = [part for part in sent['messages'][-1]['content'] if part['type'] == 'image']
+        assert [img['source']['media_type'] for img in images] == ['image/jpeg', 'image/webp']
+
+
+class TestClaudeResilience:
+    """Retries, hedging and circuit breaking against a local fake Claude API"""
+
+    @pytest.mark.asyncio
+    async def test_retries_overloaded_errors(self, fake_server_client, fake_claude_server):
+        fake_claude_server.enqueue(status_code=529, count=2)
+
+        result = await fake_server_client.classify_intent('tengo una fuga de agua')
+
+        assert result['intent'] == 'maintenance'
+        assert len(fake_claude_server.requests) == 3
+        assert fake_server_client.resilience.stats['retries'] == 2
+
+    @pytest.mark.asyncio
+    async def test_does_not_retry_bad_requests(self, fake_server_client, fake_claude_server):
+        fake_claude_server.enqueue(status_code=400)
+
+        with pytest.raises(anthropic.BadRequestError):
+            await fake_server_client.classify_intent('hola')
+
+        assert len(fake_claude_server.requests) == 1
+        assert fake_server_client.resilience.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_breaker_opens_and_fails_fast(self, fake_server_client, fake_claude_server):
+        fake_claude_server.enqueue(status_code=503, count=3)
+
+        with pytest.raises(anthropic.InternalServerError):
+            await fake_server_client.classify_intent('hola')
+
+        assert fake_server_client.resilience.circuit_breaker.state == CircuitBreaker.OPEN
+
+        with pytest.raises(CircuitOpenError):
+            await fake_server_client.classify_intent('hola')
+        assert len(fake_claude_server.requests) == 3
+
+        # After the recovery timeout a probe is allowed through and closes the breaker
+        await asyncio.sleep(0.25)
+        result = await fake_server_client.classify_intent('hola')
+        assert result['intent'] == 'maintenance'
+        assert fake_server_client.resilience.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_hedges_slow_tail_calls(self, fake_server_client, fake_claude_server):
+        tracker = LatencyTracker(min_samples=5)
+        for _ in range(10):
+            tracker.record(0.02)
+        fake_server_client.resilience = ResilientCaller(
+            retry_policy=RetryPolicy(max_attempts=1),
+            circuit_breaker=CircuitBreaker(),
+            hedging_enabled=True,
+            hedge_min_delay=0.05,
+            latency_tracker=tracker
+        )
+
+        # First call stalls; the hedge sent after ~50ms answers quickly
+        fake_claude_server.enqueue(status_code=200, latency=2.0)
+        fake_claude_server.enqueue(status_code=200, latency=0.0)
+
+        start_time = time.monotonic()
+        result = await fake_server_client.classify_intent('el aire acondicionado no funciona')
+        elapsed = time.monotonic() - start_time
+
+        assert result['intent'] == 'maintenance'
+        assert elapsed < 1.0
+        assert fake_server_client.resilience.stats['hedges_sent'] == 1
+        assert fake_server_client.resilience.stats['hedges_won'] == 1
+
+    @staticmethod
+    def half_open_caller() -> ResilientCaller:
+        clock = {'now': 0.0}
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=1.0, clock=lambda: clock['now'])
+        breaker.record_failure()
+        clock['now'] = 2.0
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        return ResilientCaller(retry_policy=RetryPolicy(max_attempts=1), circuit_breaker=breaker)
+
+    @staticmethod
+    async def succeed():
+        return 'ok'
+
+    @pytest.mark.asyncio
+    async def test_shed_probe_releases_half_open_slot(self):
+        caller = self.half_open_caller()
+
+        async def shed():
+            raise AdmissionRejectedError('budget exhausted')
+
+        with pytest.raises(AdmissionRejectedError):
+            await caller.call(shed)
+
+        assert caller.circuit_breaker.state == CircuitBreaker.HALF_OPEN
+        assert await caller.call(self.succeed) == 'ok'
+        assert caller.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_cancelled_probe_releases_half_open_slot(self):
+        caller = self.half_open_caller()
+
+        probe = asyncio.ensure_future(caller.call(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        with pytest.raises(CircuitOpenError):
+            await caller.call(self.succeed)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        assert await caller.call(self.succeed) == 'ok'
+        assert caller.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_rate_limits_back_off_without_opening_breaker(self, fake_server_client, fake_claude_server):
+        fake_claude_server.enqueue(status_code=429, count=3)
+
+        with pytest.raises(anthropic.RateLimitError):
+            await fake_server_client.classify_intent('hola')
+
+        assert len(fake_claude_server.requests) == 3
+        assert fake_server_client.resilience.circuit_breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_every_attempt_is_admitted(self, fake_server_client, fake_claude_server):
+        fake_claude_server.enqueue(status_code=529, count=2)
+
+        await fake_server_client.classify_intent('tengo una fuga de agua')
+
+        assert fake_server_client.admission_controller.stats['admitted'] == 3
+        requests_bucket = fake_server_client.admission_controller.get_stats()['buckets']['requests']
+        assert requests_bucket['capacity'] - requests_bucket['available'] == pytest.approx(3, abs=0.1)
+
+    def test_backoff_is_jittered_and_capped(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=4.0)
+
+        delays = [policy.backoff_delay(attempt) for attempt in range(1, 10) for _ in range(20)]
+
+        assert all(0 <= delay <= 4.0 for delay in delays)
+        assert len(set(delays)) > 1
+
+
+class TestAdmissionControl:
+    """Token-bucket admission in front of the Claude API"""
+
+    @pytest.mark.asyncio
+    async def test_sheds_marketing_before_maintenance(self):
+        controller = AdmissionController(limits={'requests': 10, 'input_tokens': 100000, 'output_tokens': 100000})
+
+        for _ in range(7):
+            await controller.admit(100, 100, priority='maintenance')
+
+        # Marketing must leave 30% headroom, so it is shed rather than queued for minutes
+        with pytest.raises(AdmissionRejectedError):
+            await controller.admit(100, 100, priority='marketing')
+
+        await controller.admit(100, 100, priority='maintenance')
+        assert controller.get_stats()['shed'] == 1
+
+    @pytest.mark.asyncio
+    async def test_higher_priority_is_admitted_first(self):
+        controller = AdmissionController(limits={'requests': 600, 'input_tokens': 10 ** 7, 'output_tokens': 10 ** 7})
+        controller.backend.buckets['requests'].tokens = 0
+        admitted = []
+
+        async def admit(priority):
+            await controller.admit(10, 10, priority=priority)
+            admitted.append(priority)
+
+        bulk = asyncio.ensure_future(admit('bulk'))
+        await asyncio.sleep(0)
+        emergency = asyncio.ensure_future(admit('emergency'))
+
+        await asyncio.wait_for(emergency, timeout=2)
+        assert admitted == ['emergency']
+
+        bulk.cancel()
+        await asyncio.gather(bulk, return_exceptions=True)
+        assert controller.queue_depth == 0
+
+    @pytest.mark.asyncio
+    async def test_settle_refunds_unused_output_budget(self):
+        controller = AdmissionController(limits={'requests': 50, 'input_tokens': 40000, 'output_tokens': 8000})
+
+        admission = await controller.admit(1000, 4000)
+        controller.settle(admission, input_tokens=800, output_tokens=150)
+
+        buckets = controller.get_stats()['buckets']
+        assert buckets['output_tokens']['available'] == pytest.approx(7850, abs=5)
+        assert buckets['input_tokens']['available'] == pytest.approx(39200, abs=5)
+
+    @pytest.mark.asyncio
+    async def test_limits_follow_rate_limit_headers(self, fake_server_client, fake_claude_server):
+        fake_claude_server.response_headers = {
+            'anthropic-ratelimit-requests-limit': '5',
+            'anthropic-ratelimit-requests-remaining': '0',
+            'anthropic-ratelimit-output-tokens-limit': '16000',
+            'anthropic-ratelimit-output-tokens-remaining': '15000'
+        }
+
+        await fake_server_client.classify_intent('hola')
+
+        buckets = fake_server_client.admission_controller.get_stats()['buckets']
+        assert buckets['requests']['capacity'] == 5
+        assert buckets['requests']['available'] < 1
+        assert buckets['output_tokens']['capacity'] == 16000
+
+
+class TestUsageAccounting:
+    """Per-conversation token accounting, rollups and budgets"""
+
+    @staticmethod
+    def make_context(**kwargs) -> ConversationContext:
+        return ConversationContext(
+            conversation_id='conv_usage_1',
+            user_id='user_usage_1',
+            messages=[{"role": "user", "content": "Hola, me interesa Josefa"}],
+            **kwargs
+        )
+
+    @pytest.mark.asyncio
+    async def test_turn_usage_is_added_to_context(self, claude_client, monkeypatch):
+        async def fake_call(messages, system_prompt, config):
+            return make_claude_response('¡Claro!', input_tokens=120, output_tokens=30)
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+        context = self.make_context()
+
+        await claude_client.generate_response('¿Cuáles son los precios?', context)
+        await claude_client.generate_response('¿Aceptan mascotas?', context)
+
+        assert context.total_tokens_used == 300
+        assert context.input_tokens_used == 240
+        assert context.output_tokens_used == 60
+
+        stored = claude_client.context_manager.get_conversation_context('conv_usage_1')
+        assert stored.total_tokens_used == 300
+        assert len(stored.messages) == 5
+
+    @pytest.mark.asyncio
+    async def test_rollups_track_user_and_day(self, claude_client, monkeypatch):
+        async def fake_call(messages, system_prompt, config):
+            return make_claude_response('ok', input_tokens=100, output_tokens=50)
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+
+        await claude_client.generate_response('hola', self.make_context())
+
+        assert claude_client.usage_accountant.get_user_daily_total('user_usage_1') == 150
+
+    def test_daily_total_includes_other_containers(self, claude_client):
+        this_container = UsageAccountant(user_daily_budget=1000, cache_seconds=60)
+        other_container = UsageAccountant(user_daily_budget=1000, cache_seconds=60)
+
+        def spend(accountant, tokens):
+            accountant.record_usage('user_usage_2', {**empty_usage(), 'total_tokens': tokens}, 'model')
+
+        spend(this_container, 100)
+        spend(other_container, 800)
+        assert this_container.get_user_daily_total('user_usage_2') == 100  # fresh and far from the budget
+
+        this_container.cache_seconds = 0
+        assert this_container.get_user_daily_total('user_usage_2') == 900
+
+        # Near the budget the rollup is read on every check, however fresh the cache
+        this_container.cache_seconds = 60
+        spend(other_container, 150)
+        assert this_container.check_budget('conv_usage_2', 'user_usage_2', 0) == 'user_daily'
+
+    @pytest.mark.asyncio
+    async def test_over_budget_conversation_uses_cheaper_model(self, claude_client, monkeypatch):
+        sent = {}
+
+        async def fake_call(messages, system_prompt, config):
+            sent['model'] = config['model']
+            sent['messages'] = messages
+            return make_claude_response('ok')
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+        claude_client.usage_accountant.conversation_budget = 1000
+        context = self.make_context(total_tokens_used=5000)
+        context.messages = [{"role": "user", "content": f"mensaje {i}"} for i in range(30)]
+
+        response = await claude_client.generate_response('hola', context)
+
+        assert response == 'ok'
+        assert sent['model'] == claude_client.budget_model
+        assert len(sent['messages']) == claude_client.budget_max_context_messages + 1
+
+    @pytest.mark.asyncio
+    async def test_coalesced_requests_are_charged_once(self, claude_client, monkeypatch):
+        async def fake_call(messages, system_prompt, config):
+            await asyncio.sleep(0.02)
+            return make_claude_response('ok', input_tokens=100, output_tokens=50)
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+        request = ClaudeRequest(prompt_type='intent-classification', content='tengo una fuga')
+
+        responses = await asyncio.gather(*[claude_client.process_request(request) for _ in range(3)])
+
+        assert sum(not r.metadata['coalesced'] for r in responses) == 1
+
+
+class TestPromptRegistry:
+    """Markdown prompts compiled into versioned templates"""
+
+    def test_template_renders_variables(self):
+        template = CompiledTemplate('Mensaje: "{{message_text}}" de {{ sender_name }} {"json": true}')
+
+        assert template.variables == {'message_text', 'sender_name'}
+        assert template.render({'message_text': 'hola', 'sender_name': 'Ana'}) == 'Mensaje: "hola" de Ana {"json": true}'
+
+    def test_missing_variable_raises(self):
+        with pytest.raises(ValueError, match='message_text'):
+            CompiledTemplate('{{message_text}}').render({})
+
+    def test_repository_prompts_are_loaded(self):
+        registry = PromptRegistry(snapshot_path='')
+
+        intent_prompt = registry.get('intent-classification')
+        assert {'intent-classification', 'response-generation', 'multimodal-processing', 'conversation-summary'} <= set(registry.names())
+        assert not intent_prompt.render_system().startswith('# ')
+        assert 'User Message Template' not in intent_prompt.render_system()
+        assert 'tengo una fuga' in intent_prompt.render_user(message_text='tengo una fuga', sender_name='Ana', message_context={})
+
+    def test_snapshot_round_trip(self, tmp_path):
+        registry = PromptRegistry(snapshot_path='')
+        snapshot = tmp_path / 'prompts-snapshot.json'
+        registry.write_snapshot(str(snapshot))
+
+        restored = PromptRegistry(prompts_dir=str(tmp_path / 'missing'), snapshot_path=str(snapshot))
+
+        assert restored.names() == registry.names()
+        assert restored.get('response-generation').version == registry.get('response-generation').version
+
+    def test_version_changes_with_content(self):
+        first = parse_prompt_markdown('test', '# Test\nYou classify intents.')
+        second = parse_prompt_markdown('test', '# Test\nYou classify intents carefully.')
+
+        assert first.version != second.version
+        assert first.render_system() == 'You classify intents.'
+
+    @pytest.mark.asyncio
+    async def test_response_reports_prompt_version(self, claude_client, monkeypatch):
+        async def fake_call(messages, system_prompt, config):
+            assert system_prompt == claude_client.system_prompts['intent-classification']
+            return make_claude_response('{"intent": "maintenance"}')
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+
+        response = await claude_client.process_request(ClaudeRequest(prompt_type='intent-classification', content='fuga'))
+
+        assert response.metadata['prompt_version'] == claude_client.prompt_versions['intent-classification']
+
+    @pytest.mark.asyncio
+    async def test_classify_intent_sends_rendered_template(self, claude_client, monkeypatch):
+        sent = {}
+
+        async def fake_call(messages, system_prompt, config):
+            sent['content'] = messages[-1]['content']
+            return make_claude_response('{"intent": "maintenance"}')
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+        context = ConversationContext(conversation_id='conv_intent_1', user_id='user_intent_1', messages=[])
+
+        await claude_client.classify_intent('tengo una fuga', context)
+
+        expected = get_prompt_registry().get('intent-classification').render_user(
+            message_text='tengo una fuga', sender_name='', message_context={})
+        assert sent['content'] == expected != 'tengo una fuga'
+        stored = claude_client.context_manager.get_conversation_context('conv_intent_1')
+        assert stored.messages[0]['content'] == 'tengo una fuga'
+
+
+class TestBulkClassification:
+    """Streaming, resumable bulk reclassification"""
+
+    @staticmethod
+    def make_messages(count: int):
+        return ({'message_id': f'msg_{i}', 'text': f'mensaje {i}'} for i in range(count))
+
+    @pytest.mark.asyncio
+    async def test_stub_backend_streams_with_bounded_concurrency(self, claude_client):
+        active = {'now': 0, 'peak': 0}
+        backend = StubBackend(concurrency=4)
+        original = backend._respond
+
+        async def tracked(text):
+            active['now'] += 1
+            active['peak'] = max(active['peak'], active['now'])
+            await asyncio.sleep(0.01)
+            active['now'] -= 1
+            return await original(text)
+
+        backend.classify = tracked
+        classifier = BulkClassifier(backend)
+
+        results = [r async for r in claude_client.classify_intents_bulk(self.make_messages(20), classifier=classifier)]
+
+        assert sorted(r['message_id'] for r in results) == sorted(f'msg_{i}' for i in range(20))
+        assert all(r['status'] == 'succeeded' for r in results)
+        assert active['peak'] == 4
+        assert classifier.messages_per_minute > 0
+
+    @pytest.mark.asyncio
+    async def test_interrupted_job_resumes_from_checkpoint(self, tmp_path):
+        checkpoint_path = str(tmp_path / 'reclassify.jsonl')
+        first_backend = StubBackend(latency=0.001, concurrency=2)
+
+        async with contextlib.aclosing(BulkClassifier(first_backend, checkpoint_path).run(self.make_messages(10))) as results:
+            finished = []
+            async for result in results:
+                finished.append(result['message_id'])
+                if len(finished) == 4:
+                    break
+
+        second_backend = StubBackend(concurrency=2)
+        resumed = BulkClassifier(second_backend, checkpoint_path)
+        remaining = [r['message_id'] async for r in resumed.run(self.make_messages(10))]
+
+        assert set(finished).isdisjoint(remaining)
+        assert set(finished) | set(remaining) == {f'msg_{i}' for i in range(10)}
+        assert resumed.stats['skipped'] == 4
+        assert second_backend.calls == 6
+
+    @pytest.mark.asyncio
+    async def test_live_backend_against_fake_server(self, fake_server_client, fake_claude_server):
+        results = [r async for r in fake_server_client.classify_intents_bulk(self.make_messages(12), concurrency=4)]
+
+        assert len(fake_claude_server.requests) == 12
+        assert all(r['classification']['intent'] == 'maintenance' for r in results)
+
+    @pytest.mark.asyncio
+    async def test_message_batches_backend_is_resumable(self, fake_server_client, fake_claude_server, tmp_path, monkeypatch):
+        monkeypatch.setenv('CLAUDE_BULK_BATCH_SIZE', '4')
+        monkeypatch.setenv('CLAUDE_BULK_POLL_INTERVAL', '0.01')
+        fake_claude_server.batch_polls_until_ended = 2
+        checkpoint_path = str(tmp_path / 'batches.jsonl')
+
+        results = [r async for r in fake_server_client.classify_intents_bulk(
+            self.make_messages(10), backend='batch', checkpoint_path=checkpoint_path)]
+
+        assert len(fake_claude_server.batches) == 3
+        assert len(fake_claude_server.requests) == 0
+        assert {r['classification']['intent'] for r in results} == {'maintenance'}
+        first_request = fake_claude_server.batches['msgbatch_1'][0]
+        assert first_request['params']['messages'][0]['content'] == get_prompt_registry().get(
+            'intent-classification').render_user(message_text='mensaje 0', sender_name='', message_context={})
+
+        rerun = [r async for r in fake_server_client.classify_intents_bulk(
+            self.make_messages(10), backend='batch', checkpoint_path=checkpoint_path)]
+
+        assert rerun == []
+        assert len(fake_claude_server.batches) == 3
+
+
+    @pytest.mark.asyncio
+    async def test_batch_custom_ids_are_api_safe(self, fake_server_client, fake_claude_server, tmp_path, monkeypatch):
+        monkeypatch.setenv('CLAUDE_BULK_POLL_INTERVAL', '0.01')
+        messages = [{'message_id': f'wamid.HBgNNTIxNTUxMjM0NTY3OBUCABIYFjNFQjBCNkY{i}QzMyNDk2QkZBNjRBRQA=',
+                     'text': f'mensaje {i}'} for i in range(3)]
+        checkpoint_path = str(tmp_path / 'batches.jsonl')
+
+        results = [r async for r in fake_server_client.classify_intents_bulk(
+            iter(messages), backend='batch', checkpoint_path=checkpoint_path)]
+
+        custom_ids = [request['custom_id'] for batch in fake_claude_server.batches.values() for request in batch]
+        assert all(re.fullmatch(r'[a-zA-Z0-9_-]{1,64}', custom_id) for custom_id in custom_ids)
+        assert sorted(r['message_id'] for r in results) == sorted(m['message_id'] for m in messages)
+        assert BulkCheckpoint(checkpoint_path).completed.keys() == {m['message_id'] for m in messages}
+
+
+class TestResponseCache:
+    """Offline similarity cache for vetted FAQ answers"""
+
+    PET_ANSWER = 'Sí, en Josefa aceptamos mascotas pequeñas con un depósito adicional.'
+
+    @pytest.fixture
+    def faq_cache(self):
+        cache = ResponseCache(threshold=0.5, answers_path='')
+        cache.sync_property('josefa', {'pets_allowed': True, 'pet_deposit': 2000})
+        cache.add_answer('leasing', ['¿Aceptan mascotas?', '¿Se permiten mascotas en el edificio?'],
+                         self.PET_ANSWER, property_id='josefa', key='leasing#josefa#pets')
+        cache.add_answer('leasing', ['¿A qué hora son los tours?'], 'Los tours son de 9:00 a 18:00.', key='leasing#*#tour-hours')
+        return cache
+
+    def test_paraphrase_hits_with_audit_key(self, faq_cache):
+        match = faq_cache.lookup('¿aceptan las mascotas?', 'leasing', 'josefa')
+
+        assert match.key == 'leasing#josefa#pets'
+        assert match.similarity >= 0.5
+
+    def test_global_answers_apply_to_every_property(self, faq_cache):
+        assert faq_cache.lookup('a que hora son los tours', 'leasing', 'otra-propiedad').key == 'leasing#*#tour-hours'
+
+    def test_unrelated_question_and_other_intent_miss(self, faq_cache):
+        assert faq_cache.lookup('¿Cuánto cuesta el departamento de 2 recámaras?', 'leasing', 'josefa') is None
+        assert faq_cache.lookup('¿Aceptan mascotas?', 'maintenance', 'josefa') is None
+        assert faq_cache.get_stats()['hit_rate'] == 0.0
+
+    def test_property_change_invalidates_answers(self, faq_cache):
+        assert faq_cache.sync_property('josefa', {'pets_allowed': True, 'pet_deposit': 2000}) is False
+        assert faq_cache.sync_property('josefa', {'pets_allowed': False}) is True
+
+        assert faq_cache.lookup('¿Aceptan mascotas?', 'leasing', 'josefa') is None
+
+    @pytest.mark.parametrize('vetted, asked', [
+        ('¿Cuál es el horario de visitas el sábado?', '¿Cuál es el horario de visitas el domingo?'),
+        ('¿El estacionamiento está incluido?', '¿El estacionamiento no está incluido?'),
+        ('¿Cuánto cuesta el de 2 recámaras?', '¿Cuánto cuesta el de 3 recámaras?'),
+        ('¿Hay tours en diciembre?', '¿Hay tours en enero?'),
+    ])
+    def test_questions_differing_in_key_fact_miss(self, vetted, asked):
+        cache = ResponseCache(threshold=0.5, answers_path='')
+        cache.add_answer('leasing', [vetted], 'Respuesta revisada')
+
+        assert cache.lookup(vetted, 'leasing') is not None
+        assert cache.lookup(asked, 'leasing') is None
+
+    def test_default_threshold_and_plural_days(self, monkeypatch):
+        monkeypatch.delenv('CLAUDE_RESPONSE_CACHE_THRESHOLD', raising=False)
+        cache = ResponseCache(answers_path='')
+        cache.add_answer('leasing', ['¿Abren los sábados?'], 'Sí, de 10:00 a 14:00.')
+
+        assert cache.threshold == 0.7
+        assert cache.lookup('abren el sabado', 'leasing') is None  # similar facts, too few shared shingles
+        assert cache.lookup('¿abren los sabados?', 'leasing') is not None
+
+    @pytest.mark.asyncio
+    async def test_generate_response_invalidates_on_changed_property_data(self, claude_client, faq_cache, monkeypatch):
+        async def fake_call(messages, system_prompt, config):
+            return make_claude_response('Ya no aceptamos mascotas.')
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+        claude_client.response_cache = faq_cache
+
+        cached = await claude_client.generate_response('¿Aceptan mascotas?', intent='leasing', property_id='josefa',
+                                                       property_data={'pets_allowed': True, 'pet_deposit': 2000})
+        changed = await claude_client.generate_response('¿Aceptan mascotas?', intent='leasing', property_id='josefa',
+                                                        property_data={'pets_allowed': False})
+
+        assert cached == self.PET_ANSWER
+        assert changed == 'Ya no aceptamos mascotas.'
+
+    @pytest.mark.asyncio
+    async def test_generate_response_serves_cached_answer(self, claude_client, faq_cache, monkeypatch):
+        async def fake_call(messages, system_prompt, config):
+            raise AssertionError("Claude should not be called for a cached FAQ")
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+        claude_client.response_cache = faq_cache
+        context = ConversationContext(conversation_id='conv_faq_1', user_id='user_faq_1', messages=[])
+
+        response = await claude_client.generate_response('¿Aceptan mascotas?', context, intent='leasing', property_id='josefa')
+
+        assert response == self.PET_ANSWER
+        assert context.messages[-1]['cache_key'] == 'leasing#josefa#pets'
+        assert context.total_tokens_used == 0
+
+
+class TestCompactRecords:
+    """Slotted conversation records with dict-compatible messages"""
+
+    def test_message_reads_like_legacy_dict(self):
+        legacy = {'role': 'assistant', 'content': 'Hola', 'timestamp': '2024-01-01T12:00:00', 'cache_key': 'faq#1'}
+        message = ConversationMessage.from_item(legacy)
+
+        assert message == legacy
+        assert message.get('role') == 'assistant'
+        assert message['cache_key'] == 'faq#1'
+        assert message.to_item() == legacy
+        assert not hasattr(message, '__dict__')
+
+    @pytest.mark.asyncio
+    async def test_context_round_trips_through_dynamodb(self, claude_client, monkeypatch):
+        async def fake_call(messages, system_prompt, config):
+            return make_claude_response('¡Claro!')
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+        context = ConversationContext(conversation_id='conv_compact_1', user_id='user_1',
+                                      messages=[{'role': 'user', 'content': 'Hola'}])
+
+        await claude_client.generate_response('¿Precios?', context)
+        stored = claude_client.context_manager.get_conversation_context('conv_compact_1')
+
+        assert all(isinstance(message, ConversationMessage) for message in stored.messages)
+        assert [m['content'] for m in stored.messages] == ['Hola', '¿Precios?', '¡Claro!']
+        assert stored.messages[1]['role'] is stored.messages[0]['role']
+
+
+class TestSpeculativeDrafting:
+    """Drafting replies in parallel with intent classification"""
+
+    @staticmethod
+    def scripted_claude(claude_client, monkeypatch, intent: str, latency: float = 0.05):
+        calls = {'classification': 0, 'generation': 0}
+
+        async def fake_call(messages, system_prompt, config):
+            await asyncio.sleep(latency)
+            if system_prompt == claude_client.system_prompts['intent-classification']:
+                calls['classification'] += 1
+                return make_claude_response(f'{{"intent": "{intent}", "confidence": 0.9}}')
+            calls['generation'] += 1
+            return make_claude_response(f'respuesta {calls["generation"]}', input_tokens=200, output_tokens=100)
+
+        monkeypatch.setattr(claude_client, '_call_claude_text_only', fake_call)
+        claude_client.speculation_enabled = True
+        return calls
+
+    @pytest.mark.asyncio
+    async def test_correct_guess_saves_a_round_trip(self, claude_client, monkeypatch):
+        calls = self.scripted_claude(claude_client, monkeypatch, 'MAINTENANCE', latency=0.2)
+        context = ConversationContext(conversation_id='conv_spec_1', user_id='user_1', messages=[])
+
+        start = time.perf_counter()
+        result = await claude_client.classify_and_respond('Tengo una fuga en el baño', context)
+        elapsed = time.perf_counter() - start
+
+        assert result['speculation'] == 'hit'
+        assert result['response'] == 'respuesta 1'
+        assert elapsed < 0.35  # sequential classify + generate would take at least 0.4s
+        assert calls == {'classification': 1, 'generation': 1}
+        assert [m['role'] for m in context.messages] == ['user', 'assistant']
+        assert claude_client.speculation.accuracy == 1.0
+
+    @pytest.mark.asyncio
+    async def test_wrong_guess_is_discarded_and_counted(self, claude_client, monkeypatch):
+        self.scripted_claude(claude_client, monkeypatch, 'PAYMENTS')
+        context = ConversationContext(conversation_id='conv_spec_2', user_id='user_1', messages=[])
+
+        result = await claude_client.classify_and_respond('Hay un problema con mi recibo, no funciona el pago', context)
+
+        assert result['speculation'] == 'miss'
+        assert result['classification']['intent'] == 'PAYMENTS'
+        assert len(context.messages) == 2
+        assert claude_client.speculation.stats['misses'] == 1
+        assert claude_client.speculation.stats['wasted_tokens'] > 0
+
+    def test_cost_cap_stops_speculation(self):
+        controller = SpeculationController(max_wasted_tokens_per_hour=500)
+
+        assert controller.choose_intent('quiero agendar un tour, ¿qué precio tiene?') == 'leasing'
+        controller.record_miss('leasing', 'others', 600)
+
+        assert controller.choose_intent('quiero agendar un tour, ¿qué precio tiene?') is None
+        assert controller.choose_intent('hola') is None
+        assert controller.stats['capped'] == 1
+
+
+class TestBurstCoalescing:
+    """Quick follow-up messages are handled as one webhook turn"""
+
+    @pytest.fixture
+    def coalescer(self, monkeypatch):
+        monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+        with mock_dynamodb():
+            create_table(boto3.resource('dynamodb'), 'bird-message-bursts', 'conversation_id')
+            yield BurstCoalescer(quiet_seconds=0.2, max_delay_seconds=1.0)
+
+    @staticmethod
+    def webhook(text: str, **message):
+        return {'conversation_id': 'conv-1', 'message': {'type': 'text', 'text': text, **message}}
+
+    @staticmethod
+    async def arrive(coalescer, texts, gap):
+        tasks = []
+        for text in texts:
+            tasks.append(asyncio.create_task(coalescer.add('conv-1', TestBurstCoalescing.webhook(text))))
+            await asyncio.sleep(gap)
+        return await asyncio.gather(*tasks)
+
+    @pytest.mark.asyncio
+    async def test_burst_is_one_turn(self, coalescer):
+        results = await self.arrive(coalescer, ['hola', 'se rompió la llave', 'en el baño'], gap=0.05)
+
+        bursts = [burst for burst in results if burst is not None]
+        assert len(bursts) == 1 and results[-1] is bursts[0]
+        assert bursts[0].reason == 'quiet'
+        merged = bursts[0].merged()
+        assert merged['message']['text'] == 'hola\nse rompió la llave\nen el baño'
+        assert merged['message']['burst_size'] == 3
+
+    @pytest.mark.asyncio
+    async def test_emergency_keyword_flushes_immediately(self, coalescer):
+        first = asyncio.create_task(coalescer.add('conv-1', self.webhook('hola')))
+        await asyncio.sleep(0.02)
+
+        start = time.perf_counter()
+        burst = await coalescer.add('conv-1', self.webhook('tengo una fuga'))
+
+        assert time.perf_counter() - start < 0.1
+        assert (burst.reason, len(burst.messages)) == ('emergency', 2)
+        assert await first is None
+
+    @pytest.mark.asyncio
+    async def test_added_delay_is_bounded(self, coalescer):
+        coalescer.max_delay_seconds = 0.5
+        start = time.perf_counter()
+        results = await self.arrive(coalescer, [f'mensaje {i}' for i in range(10)], gap=0.1)
+
+        bursts = [burst for burst in results if burst is not None]
+        assert sum(len(burst.messages) for burst in bursts) == 10
+        # Messages arrive every 0.1s for a second, so no burst may span more than max_delay
+        assert len(bursts) >= 2
+        assert all(len(burst.messages) <= 7 for burst in bursts)
+        assert time.perf_counter() - start < 1.5
+
+    @pytest.mark.asyncio
+    async def test_media_message_survives_merge(self, coalescer):
+        coalescer.quiet_seconds = 0.1
+        first = asyncio.create_task(coalescer.add('conv-1', self.webhook('', type='image', media_url='s3://x/leak.jpg')))
+        # The text must be appended after the image, however slow the first append is
+        while coalescer.table.get_item(Key={'conversation_id': 'conv-1'}).get('Item') is None:
+            await asyncio.sleep(0.005)
+        burst = await coalescer.add('conv-1', self.webhook('mira la pared'))
+
+        assert await first is None
+        assert burst.merged()['message']['type'] == 'image'
+        assert burst.merged()['message']['text'] == 'mira la pared'
+
+    @staticmethod
+    async def crash_flusher(coalescer, texts):
+        """Buffer texts, then kill the invocation that would have flushed them"""
+        tasks = []
+        for text in texts:
+            tasks.append(asyncio.create_task(coalescer.add('conv-1', TestBurstCoalescing.webhook(text))))
+            await asyncio.sleep(0.05)
+        flusher = tasks.pop()
+        flusher.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flusher
+        assert await asyncio.gather(*tasks) == [None] * len(tasks)
+
+    @pytest.mark.asyncio
+    async def test_sweep_recovers_burst_of_crashed_invocation(self, coalescer):
+        coalescer.quiet_seconds = 0.5
+        await self.crash_flusher(coalescer, ['hola', 'se rompió la llave'])
+
+        coalescer.stale_seconds = 60
+        assert coalescer.sweep() == []  # still young enough to have a live owner
+        coalescer.stale_seconds = 0
+        recovered = coalescer.sweep()
+
+        assert len(recovered) == 1
+        assert recovered[0].reason == 'recovered'
+        assert recovered[0].merged()['message']['text'] == 'hola\nse rompió la llave'
+        assert coalescer.sweep() == []
+
+    @pytest.mark.asyncio
+    async def test_next_message_takes_over_abandoned_burst(self, coalescer):
+        coalescer.quiet_seconds = 0.5
+        coalescer.max_delay_seconds = 0.3
+        await self.crash_flusher(coalescer, ['hola', 'se rompió la llave'])
+        await asyncio.sleep(0.3)
+
+        burst = await coalescer.add('conv-1', self.webhook('¿me ayudan?'))
+
+        assert (burst.reason, len(burst.messages)) == ('max_delay', 3)
+
+
+class TestUrgencyScoring:
+    """Local emergency detection ahead of Claude classification"""
+
+    @pytest.fixture
+    def scorer(self):
+        return UrgencyScorer()
+
+    @pytest.mark.parametrize('text, hazard', [
+        ('Huele a gas en la cocina!!', 'gas'),
+        ('Se está inundando el baño, urgente', 'flooding'),
+        ('HAY HUMO EN EL PASILLO', 'fire'),
+        ('hay chispas en el contacto de la sala', 'electrical'),
+    ])
+    def test_hazards_are_emergencies(self, scorer, text, hazard):
+        result = scorer.score(text)
+        assert result.is_emergency
+        assert hazard in result.hazards
+
+    @pytest.mark.parametrize('text', [
+        'ya no huele a gas, gracias',
+        'no hay fuga, solo quería confirmar',
+        'el aire acondicionado no funciona',
+        'urgente: necesito mi recibo de pago',
+        '¿El gym abre los domingos?',
+    ])
+    def test_negated_or_routine_messages_are_not(self, scorer, text):
+        assert not scorer.score(text).is_emergency
+
+    @pytest.mark.parametrize('text, hazard', [
+        ('El elevador no abre, estoy atrapado', 'entrapment'),
+        ('No sé qué pasa. Huele a gas en el pasillo', 'gas'),
+        ('no hay luz pero sale humo del contacto', 'fire'),
+        ('ya no tenemos agua y se inunda el baño', 'flooding'),
+        ('¿No viene nadie? ¡Hay fuego en la cocina!', 'fire'),
+    ])
+    def test_negation_ends_at_clause_boundary(self, scorer, text, hazard):
+        result = scorer.score(text)
+        assert result.is_emergency
+        assert hazard in result.hazards
+
+    @pytest.mark.parametrize('text', [
+        '¿El gas está incluido en la renta?',
+        '¿La renta incluye agua, luz y gas?',
+        '¿Cómo pago el recibo de la luz?',
+        '¿Cuánto sale el gas al mes, más o menos?',
+        '¿El agua caliente es con boiler o con calentador eléctrico?',
+    ])
+    def test_utility_service_questions_are_not(self, scorer, text):
+        assert not scorer.score(text).is_emergency
+
+    @pytest.mark.parametrize('text, term', [
+        ('hay cosas urgentes', 'urgentes'),
+        ('excelentes noticias', 'excelentes'),
+        ('tengo varios problemas', 'problemas'),
+    ])
+    def test_plural_forms_of_lexicon_terms(self, scorer, text, term):
+        assert scorer.score(text).matched == (term,)
+
+    def test_missing_text_scores_zero(self, scorer):
+        assert scorer.score(None) == scorer.score('')
+        assert not scorer.score(None).is_emergency
+
+    def test_scores_well_under_a_millisecond(self, scorer):
+        text = ('Hola, buenas tardes. Se está inundando el baño del departamento 302 y huele raro, '
+                'por favor manden a alguien urgente')
+        start = time.perf_counter()
+        for _ in range(1000):
+            scorer.score(text)
+        assert (time.perf_counter() - start) / 1000 < 0.001
+
+    @pytest.mark.asyncio
+    async def test_urgent_verdict_flushes_burst(self, monkeypatch):
+        monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+        with mock_dynamodb():
+            create_table(boto3.resource('dynamodb'), 'bird-message-bursts', 'conversation_id')
+            coalescer = BurstCoalescer(quiet_seconds=5.0, max_delay_seconds=10.0)
+            message = {'conversation_id': 'conv-1', 'message': {'type': 'text', 'text': 'sale humo del contacto'}}
+
+            burst = await asyncio.wait_for(coalescer.add('conv-1', message, urgent=True), timeout=1.0)
+
+        assert burst.reason == 'emergency'
+
+
+class TestMultimodalDispatch:
+    """Concurrent per-attachment pipelines for webhook media"""
+
+    @staticmethod
+    def photo(color: str) -> dict:
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 600), color).save(buffer, format='JPEG')
+        return {'type': 'image', 'media_data': base64.b64encode(buffer.getvalue()).decode()}
+
+    @staticmethod
+    def voice_note(seconds: float) -> dict:
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as audio:
+            audio.setnchannels(1)
+            audio.setsampwidth(2)
+            audio.setframerate(8000)
+            audio.writeframes(b'\x00\x00' * int(8000 * seconds))
+        return {'type': 'voice', 'media_data': base64.b64encode(buffer.getvalue()).decode()}
+
+    @staticmethod
+    def pdf(text: str) -> dict:
+        stream = zlib.compress(f'BT /F1 12 Tf 72 712 Td ({text}) Tj ET'.encode())
+        raw = (b'%PDF-1.4\n1 0 obj << /Type /Page >> endobj\n2 0 obj << /Filter /FlateDecode >>\nstream\n'
+               + stream + b'\nendstream\nendobj\n%%EOF')
+        return {'type': 'document', 'media_data': base64.b64encode(raw).decode(), 'mime_type': 'application/pdf'}
+
+    @pytest.fixture
+    def dispatcher(self):
+        return MultimodalDispatcher(workers=4)
+
+    @pytest.mark.asyncio
+    async def test_four_photos_take_as_long_as_one(self, dispatcher):
+        async def slow_store(attachment):
+            await asyncio.sleep(0.2)
+            return f"s3://media/{attachment['index']}.jpg"
+
+        message = {'type': 'text', 'attachments': [self.photo(color) for color in ('red', 'green', 'blue', 'white')]}
+        start = time.perf_counter()
+        analysis = await dispatcher.analyze(message, store=slow_store)
+
+        assert time.perf_counter() - start < 0.5
+        assert [attachment['s3_url'] for attachment in analysis['attachments']] == [
+            f"s3://media/{index}.jpg" for index in range(4)]
+        assert all(attachment['analysis']['width'] == 800 for attachment in analysis['attachments'])
+        assert analysis['attachments'][0]['analysis']['media_type'] == 'image/jpeg'
+        assert analysis['media_types'] == ['image']
+        assert analysis['s3_url'] == 's3://media/0.jpg'
+
+    @pytest.mark.asyncio
+    async def test_mixed_attachments_merge_into_one_analysis(self, dispatcher):
+        message = {'type': 'text', 'text': 'te mando el contrato',
+                   'attachments': [self.photo('red'), self.voice_note(1.5), self.pdf('Contrato de arrendamiento')]}
+
+        analysis = await dispatcher.analyze(message)
+
+        assert analysis['has_media']
+        assert analysis['media_types'] == ['image', 'voice', 'document']
+        assert analysis['processing_required'] == ['visual-analyzer', 'voice-assistant', 'document-processor']
+        image, voice, document = analysis['attachments']
+        assert voice['analysis']['container'] == 'wav'
+        assert voice['analysis']['duration_seconds'] == 1.5
+        assert document['analysis']['pages'] == 1
+        assert document['analysis']['text'] == 'Contrato de arrendamiento'
+
+    @pytest.mark.asyncio
+    async def test_single_media_message_and_text_only(self, dispatcher):
+        analysis = await dispatcher.analyze({**self.voice_note(0.5), 'caption': 'escucha'})
+        assert analysis['media_types'] == ['voice']
+        assert analysis['attachments'][0]['caption'] == 'escucha'
+
+        assert await dispatcher.analyze({'type': 'text', 'text': 'hola'}) == {
+            'has_media': False, 'media_types': [], 'processing_required': []}
+
+    @pytest.mark.asyncio
+    async def test_failed_attachment_does_not_fail_the_others(self, dispatcher):
+        async def flaky_store(attachment):
+            if attachment['type'] == 'image':
+                raise RuntimeError('S3 unavailable')
+            return 's3://media/voice.ogg'
+
+        analysis = await dispatcher.analyze({'attachments': [self.photo('red'), self.voice_note(1.0)]},
+                                            store=flaky_store)
+
+        image, voice = analysis['attachments']
+        assert image['errors'] == {'s3_url': 'S3 unavailable'}
+        assert image['analysis']['width'] == 800
+        assert voice['analysis']['duration_seconds'] == 1.0
+        assert analysis['s3_url'] == 's3://media/voice.ogg'
+
+    @pytest.mark.asyncio
+    async def test_images_are_measured_without_decoding(self, dispatcher, monkeypatch):
+        photo = self.photo('red')
+        broken = {'type': 'image', 'media_data': base64.b64encode(b'not an image').decode()}
+        monkeypatch.setattr(Image.Image, 'load', lambda image: pytest.fail('pixels were decoded'))
+
+        analysis = await dispatcher.analyze({'attachments': [photo, broken]})
+
+        photo, unreadable = analysis['attachments']
+        assert (photo['analysis']['width'], photo['analysis']['height']) == (800, 600)
+        assert 'analysis' in unreadable['errors']
+
+    def test_burst_merge_lists_every_attachment(self):
+        payloads = [{'message': {**self.photo('red'), 'text': 'mira'}},
+                    {'message': self.photo('blue')},
+                    {'message': {'type': 'text', 'text': 'ya se cayó el yeso'}}]
+        merged = Burst('conv-1', payloads, 'quiet').merged()['message']
+
+        assert len(merged['attachments']) == 2
+        assert merged['text'] == 'mira\nya se cayó el yeso'
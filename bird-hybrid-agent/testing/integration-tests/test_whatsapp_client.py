@@ -0,0 +1,998 @@
+"""
+WhatsApp Client Tests
+Exercises WhatsAppClient against a local fake Graph API server.
+"""
+
+import os
+import csv
+import sys
+import hashlib
+import time
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import boto3
+import pytest
+import requests
+from moto import mock_dynamodb, mock_s3
+
+# Add the WhatsApp integration package to path
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../whatsapp-integration'))
+from whatsapp_client import (WhatsAppClient, WhatsAppMessage, WhatsAppTemplateManager, CompiledWhatsAppTemplate,
+                             SendOutcomeUnknown, session_cache)
+from media_transfer import S3StreamUploader, MIN_PART_SIZE
+from graph_transport import RequestsTransport
+from bulk_sender import BulkSender, TokenBucket
+from outbound_dispatcher import OutboundDispatcher, DispatchQueueFull
+from broadcast import BroadcastJob, BroadcastCheckpoint, csv_recipients, dynamodb_recipients
+from property_catalog import PropertyCatalog, DynamoDBPropertyCatalog, CATALOG_PARTITION
+from fake_graph_server import FakeGraphServer, generated_media_bytes
+
+
+@pytest.fixture
+def fake_graph_server():
+    """Local fake Graph API with scripted errors and connection counting"""
+    server = FakeGraphServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def whatsapp_client(monkeypatch, fake_graph_server):
+    """WhatsApp client talking to the fake Graph server, with mocked DynamoDB and S3"""
+    monkeypatch.setenv('WHATSAPP_ACCESS_TOKEN', 'test-token')
+    monkeypatch.setenv('WHATSAPP_PHONE_NUMBER_ID', '1234567890')
+    monkeypatch.setenv('WHATSAPP_VERIFY_TOKEN', 'verify')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    # moto cannot decode the aws-chunked checksum trailers newer botocore sends on upload_part
+    monkeypatch.setenv('AWS_REQUEST_CHECKSUM_CALCULATION', 'when_required')
+
+    with mock_dynamodb(), mock_s3():
+        boto3.client('s3').create_bucket(Bucket='urbanhub-whatsapp-media')
+        boto3.resource('dynamodb').create_table(
+            TableName='whatsapp-sessions',
+            KeySchema=[{'AttributeName': 'phone', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'phone', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        boto3.resource('dynamodb').create_table(
+            TableName='whatsapp-broadcasts',
+            KeySchema=[{'AttributeName': 'job_id', 'KeyType': 'HASH'},
+                       {'AttributeName': 'recipient_id', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'job_id', 'AttributeType': 'S'},
+                                  {'AttributeName': 'recipient_id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        boto3.resource('dynamodb').create_table(
+            TableName='whatsapp-media-cache',
+            KeySchema=[{'AttributeName': 'asset_url', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'asset_url', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        boto3.resource('dynamodb').create_table(
+            TableName='whatsapp-send-ledger',
+            KeySchema=[{'AttributeName': 'idempotency_key', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'idempotency_key', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        client = WhatsAppClient(transport=RequestsTransport())
+        client.base_url = f"{fake_graph_server.base_url}/{client.api_version}"
+        yield client
+        client.transport.close()
+
+
+class TestPooledTransport:
+    """Keep-alive connection pooling for Graph API calls"""
+
+    def test_sends_reuse_one_connection(self, whatsapp_client, fake_graph_server):
+        for i in range(20):
+            result = whatsapp_client.send_text_message('5215512345678', f'Hola {i}')
+            assert result['messages'][0]['id'].startswith('wamid.')
+
+        assert whatsapp_client.mark_message_as_read('wamid.inbound1') is True
+        assert len(fake_graph_server.requests) == 21
+        assert fake_graph_server.connections == 1
+
+    def test_transport_is_shared_safely_across_threads(self, whatsapp_client, fake_graph_server):
+        errors = []
+
+        def send_batch(worker: int):
+            try:
+                for i in range(10):
+                    whatsapp_client.send_text_message('5215512345678', f'worker {worker} mensaje {i}')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=send_batch, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert len(fake_graph_server.requests) == 80
+        assert fake_graph_server.connections <= 8
+
+    def test_download_media_uses_pool(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.media['media123'] = b'\x89PNG fake image bytes'
+
+        assert whatsapp_client.download_media('media123') == b'\x89PNG fake image bytes'
+        assert whatsapp_client.download_media('missing') is None
+
+    def test_separate_connect_and_read_timeouts(self):
+        transport = RequestsTransport(connect_timeout=2.0, read_timeout=20.0)
+
+        assert transport.timeout() == (2.0, 20.0)
+        assert transport.timeout(read_timeout=60) == (2.0, 60)
+
+
+async def collect(results):
+    return [result async for result in results]
+
+
+class TestBulkSend:
+    """Async fan-out with per-recipient ordering and rate-limit retries"""
+
+    @pytest.mark.asyncio
+    async def test_streams_a_result_per_payload(self, whatsapp_client, fake_graph_server):
+        payloads = [whatsapp_client.build_text_message_payload(f'52155100000{i:02d}', f'Aviso {i}') for i in range(40)]
+
+        results = await collect(whatsapp_client.send_bulk(payloads, concurrency=8))
+
+        assert sorted(result['index'] for result in results) == list(range(40))
+        assert all(result['status'] == 'sent' and result['message_id'].startswith('wamid.') for result in results)
+        assert len(fake_graph_server.requests) == 40
+
+    @pytest.mark.asyncio
+    async def test_keeps_per_recipient_order(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.default_latency = 0.02
+        payloads = [
+            whatsapp_client.build_text_message_payload(recipient, f'{recipient} mensaje {i}')
+            for i in range(5)
+            for recipient in ('5215511111111', '5215522222222', '5215533333333')
+        ]
+
+        start = time.perf_counter()
+        results = await collect(whatsapp_client.send_bulk(payloads, concurrency=8))
+        elapsed = time.perf_counter() - start
+
+        assert len(results) == 15
+        for recipient in ('5215511111111', '5215522222222', '5215533333333'):
+            bodies = [request['body']['text']['body'] for request in fake_graph_server.requests
+                      if request['body']['to'] == recipient]
+            assert bodies == [f'{recipient} mensaje {i}' for i in range(5)]
+        # Recipients still go out in parallel with each other
+        assert elapsed < 15 * 0.02
+
+    @pytest.mark.asyncio
+    async def test_retries_rate_limit_errors(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.enqueue(429, 130429, count=2)
+        sender = BulkSender(whatsapp_client, base_delay=0.01, bucket=TokenBucket(1000))
+
+        results = await collect(sender.send([whatsapp_client.build_text_message_payload('5215512345678', 'Hola')]))
+
+        assert results[0]['status'] == 'sent'
+        assert results[0]['attempts'] == 3
+        assert len(fake_graph_server.requests) == 3
+
+    @pytest.mark.asyncio
+    async def test_does_not_retry_other_errors(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.enqueue(400, 131026)
+        sender = BulkSender(whatsapp_client, base_delay=0.01, bucket=TokenBucket(1000))
+        payloads = [whatsapp_client.build_text_message_payload('5215512345678', 'Hola'),
+                    whatsapp_client.build_text_message_payload('5215512345678', 'Seguimos')]
+
+        results = sorted(await collect(sender.send(payloads)), key=lambda result: result['index'])
+
+        assert results[0]['status'] == 'failed'
+        assert results[0]['error_code'] == 131026
+        assert results[0]['attempts'] == 1
+        assert results[1]['status'] == 'sent'
+
+    def test_token_bucket_spaces_sends(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+
+        delays = [bucket.reserve() for _ in range(3)]
+
+        assert delays[0] == 0.0
+        assert delays[1] == pytest.approx(0.01, abs=0.002)
+        assert delays[2] == pytest.approx(0.02, abs=0.002)
+
+
+def write_residents_csv(path, count):
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=['resident_id', 'phone', 'amount', 'due_date'])
+        writer.writeheader()
+        for i in range(count):
+            writer.writerow({'resident_id': f'R{i:04d}', 'phone': f'+5215520{i:06d}',
+                             'amount': f'{12000 + i:,}', 'due_date': '5 de noviembre'})
+    return path
+
+
+class TestBroadcast:
+    """Resumable template broadcasts"""
+
+    @pytest.mark.asyncio
+    async def test_sends_rendered_template_to_every_recipient(self, whatsapp_client, fake_graph_server, tmp_path):
+        path = write_residents_csv(tmp_path / 'residents.csv', 30)
+        job = BroadcastJob(whatsapp_client, 'pagos-noviembre', 'payment_reminder', csv_recipients(path),
+                           ['{amount}', '{due_date}'], id_field='resident_id')
+
+        stats = await job.run()
+
+        assert (stats.sent, stats.failed, stats.skipped) == (30, 0, 0)
+        first = next(request['body'] for request in fake_graph_server.requests if request['body']['to'] == '5215520000000')
+        assert '$12,000 MXN vence el 5 de noviembre' in first['template']['components'][0]['text']
+        last = next(request['body'] for request in fake_graph_server.requests if request['body']['to'] == '5215520000029')
+        assert '$12,029 MXN' in last['template']['components'][0]['text']
+
+        job_item = whatsapp_client.dynamodb.Table('whatsapp-broadcasts').get_item(
+            Key={'job_id': 'pagos-noviembre', 'recipient_id': '#job'})['Item']
+        assert job_item['status'] == 'completed'
+        assert job_item['sent'] == 30
+
+    @pytest.mark.asyncio
+    async def test_resumes_after_crash_without_duplicates(self, whatsapp_client, fake_graph_server, tmp_path):
+        path = write_residents_csv(tmp_path / 'residents.csv', 60)
+        fake_graph_server.default_latency = 0.01
+
+        def crashing_source():
+            for i, recipient in enumerate(csv_recipients(path)):
+                if i == 35:
+                    raise RuntimeError("worker lost")
+                yield recipient
+
+        job = BroadcastJob(whatsapp_client, 'mantenimiento', 'payment_reminder', crashing_source(),
+                           ['{amount}', '{due_date}'], id_field='resident_id', concurrency=4, claim_batch_size=10)
+        with pytest.raises(RuntimeError):
+            await job.run()
+
+        resumed = BroadcastJob(whatsapp_client, 'mantenimiento', 'payment_reminder', csv_recipients(path),
+                               ['{amount}', '{due_date}'], id_field='resident_id', concurrency=4, claim_batch_size=10)
+        stats = await resumed.run()
+
+        phones = [request['body']['to'] for request in fake_graph_server.requests]
+        assert len(phones) == len(set(phones))
+        # Claims left without an outcome are resent under the ledger, so everyone gets exactly one message
+        assert set(phones) == {f'52155200000{i:02d}' for i in range(60)}
+        assert stats.skip_reasons['already_sent'] + stats.sent == 60
+        assert stats.skip_reasons['already_sent'] <= 35
+
+    @pytest.mark.asyncio
+    async def test_unconfirmed_claims_are_resent_through_the_ledger(self, whatsapp_client, fake_graph_server, tmp_path):
+        path = write_residents_csv(tmp_path / 'residents.csv', 2)
+        checkpoint = BroadcastCheckpoint('recordatorio')
+        # A crash after the first message went out but before either outcome was written
+        checkpoint.write([{'recipient_id': 'R0000', 'status': 'sending'}, {'recipient_id': 'R0001', 'status': 'sending'}])
+        whatsapp_client.send_ledger.record('broadcast#recordatorio#R0000', {'messages': [{'id': 'wamid.before-crash'}]})
+
+        job = BroadcastJob(whatsapp_client, 'recordatorio', 'payment_reminder', csv_recipients(path),
+                           ['{amount}', '{due_date}'], id_field='resident_id', checkpoint=checkpoint)
+        stats = await job.run()
+
+        assert stats.sent == 2
+        assert [request['body']['to'] for request in fake_graph_server.requests] == ['5215520000001']
+        states = checkpoint.load()
+        assert {states['R0000']['status'], states['R0001']['status']} == {'sent'}
+
+    @pytest.mark.parametrize('result, retryable', [
+        ({'status_code': 429, 'error_code': None}, True),
+        ({'status_code': 400, 'error_code': 131056}, True),
+        ({'status_code': 503, 'error_code': 2}, True),
+        ({'error_code': None}, True),  # no response: outcome unknown, the ledger decides
+        ({'status_code': 400, 'error_code': 131026}, False),
+    ])
+    def test_only_definite_rejections_are_final(self, whatsapp_client, result, retryable):
+        job = BroadcastJob(whatsapp_client, 'clasificacion', 'payment_reminder', [], ['{amount}', '{due_date}'])
+        job._recipient_ids[0] = 'R000'
+
+        outcome = job._outcome({'index': 0, 'status': 'failed', 'attempts': 1, **result})
+
+        assert outcome['retryable'] is retryable
+
+    @pytest.mark.asyncio
+    async def test_skips_bad_rows_and_streams_dynamodb_source(self, whatsapp_client, fake_graph_server):
+        residents = whatsapp_client.dynamodb.Table('whatsapp-sessions')
+        residents.put_item(Item={'phone': '5215511111111', 'amount': '9,500', 'due_date': '1 de diciembre'})
+        residents.put_item(Item={'phone': '5215522222222', 'amount': '11,000'})
+
+        job = BroadcastJob(whatsapp_client, 'pagos-diciembre', 'payment_reminder',
+                           dynamodb_recipients('whatsapp-sessions', page_size=1), ['{amount}', '{due_date}'],
+                           checkpoint=BroadcastCheckpoint('pagos-diciembre'))
+        stats = await job.run()
+
+        assert stats.sent == 1
+        assert stats.skip_reasons['missing_parameters'] == 1
+        assert [request['body']['to'] for request in fake_graph_server.requests] == ['5215511111111']
+
+
+class TestTemplateRendering:
+    """Precompiled, immutable WhatsApp templates"""
+
+    def test_rendering_does_not_mutate_registry(self):
+        manager = WhatsAppTemplateManager()
+
+        first = manager.get_template('tour_confirmation', ['Josefa', 'lunes', '10:00'])
+        second = manager.get_template('tour_confirmation', ['Amsterdam', 'martes', '17:30'])
+
+        assert 'Josefa' in first['components'][0]['text']
+        assert 'Amsterdam está confirmado para el martes a las 17:30' in second['components'][0]['text']
+        assert '{{1}}' in manager.templates['tour_confirmation']['components'][0]['text']
+
+    def test_placeholder_count_is_validated(self):
+        manager = WhatsAppTemplateManager()
+
+        with pytest.raises(ValueError, match='expects 2 parameters, got 1'):
+            manager.get_template('payment_reminder', ['12,000'])
+        with pytest.raises(ValueError, match='without gaps'):
+            CompiledWhatsAppTemplate('broken', {'name': 'broken', 'language': 'es_MX',
+                                                'components': [{'type': 'BODY', 'text': 'Hola {{2}}'}]})
+
+    def test_cached_renders_return_fresh_payloads(self):
+        manager = WhatsAppTemplateManager(render_cache_size=2)
+
+        first = manager.get_template('payment_reminder', ['12,000', '5 de noviembre'])
+        first['components'][0]['text'] = 'modificado'
+        second = manager.get_template('payment_reminder', ['12,000', '5 de noviembre'])
+
+        assert second['components'][0]['text'].startswith('💰 Recordatorio: Tu pago de $12,000 MXN')
+        assert second is not first
+
+    def test_concurrent_renders_are_isolated(self):
+        manager = WhatsAppTemplateManager(render_cache_size=64)
+        errors = []
+
+        def render(worker: int):
+            for i in range(200):
+                ticket = f'{worker}-{i % 100}'
+                text = manager.get_template('maintenance_scheduled', [ticket, 'hoy', '9 y 11'])['components'][0]['text']
+                if f'#{ticket} ha sido' not in text:
+                    errors.append(text)
+
+        threads = [threading.Thread(target=render, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+
+
+class TestMediaStreaming:
+    """Graph media streamed into S3 multipart uploads"""
+
+    def test_small_media_uses_single_put(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.media['audio1'] = b'OggS fake voice note'
+
+        result = whatsapp_client.stream_media_to_s3('audio1', 'audio', 'conv-1')
+
+        assert result.parts == 1
+        assert result.size == 20
+        assert result.sha256 == hashlib.sha256(b'OggS fake voice note').hexdigest()
+        bucket, key = result.s3_uri[len('s3://'):].split('/', 1)
+        assert whatsapp_client.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read() == b'OggS fake voice note'
+
+    def test_large_media_is_uploaded_in_parts(self, whatsapp_client, fake_graph_server):
+        size = 2 * MIN_PART_SIZE + 12345
+        fake_graph_server.generated_media['video1'] = size
+        whatsapp_client.media_uploader = S3StreamUploader(whatsapp_client.s3_client, part_size=MIN_PART_SIZE)
+
+        result = whatsapp_client.stream_media_to_s3('video1', 'video', 'conv-1')
+
+        expected = generated_media_bytes(size)
+        assert (result.parts, result.size) == (3, size)
+        assert result.sha256 == hashlib.sha256(expected).hexdigest()
+        bucket, key = result.s3_uri[len('s3://'):].split('/', 1)
+        assert whatsapp_client.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read() == expected
+
+    def test_failed_upload_is_aborted(self, whatsapp_client):
+        def chunks():
+            yield b'x' * MIN_PART_SIZE
+            raise IOError("connection reset")
+
+        with pytest.raises(IOError):
+            S3StreamUploader(whatsapp_client.s3_client).upload(chunks(), 'urbanhub-whatsapp-media', 'broken.bin', 'video/mp4')
+
+        uploads = whatsapp_client.s3_client.list_multipart_uploads(Bucket='urbanhub-whatsapp-media')
+        assert uploads.get('Uploads', []) == []
+
+    def test_batch_streams_attachments_concurrently(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.default_latency = 0.1
+        for i in range(4):
+            fake_graph_server.media[f'img{i}'] = f'imagen {i}'.encode()
+
+        start = time.perf_counter()
+        results = whatsapp_client.stream_media_batch([(f'img{i}', 'image') for i in range(4)] + [('missing', 'image')],
+                                                     'conv-2')
+        elapsed = time.perf_counter() - start
+
+        assert [result.media_id for result in results[:4]] == ['img0', 'img1', 'img2', 'img3']
+        assert results[4] is None
+        assert elapsed < 4 * 0.1
+
+
+class TestMediaIdCache:
+    """Outbound assets uploaded once and sent by media ID"""
+
+    @pytest.fixture(autouse=True)
+    def upload_from_fake_server(self, monkeypatch):
+        monkeypatch.setenv('WHATSAPP_MEDIA_UPLOAD_HOSTS', '127.0.0.1')
+
+    def test_asset_is_uploaded_once_and_sent_by_id(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.assets['folleto.pdf'] = b'%PDF-1.4 folleto Josefa'
+        url = f"{fake_graph_server.base_url}/assets/folleto.pdf"
+
+        for phone in ('5215511111111', '5215522222222', '5215533333333'):
+            whatsapp_client.send_document_message(phone, url, 'folleto.pdf', 'Folleto Josefa')
+
+        sends = [request['body'] for request in fake_graph_server.requests if request['body'].get('type') == 'document']
+        assert len(fake_graph_server.uploads) == 1
+        assert fake_graph_server.asset_fetches == 1
+        assert {send['document'].get('id') for send in sends} == {'uploaded1'}
+        assert all('link' not in send['document'] for send in sends)
+
+    def test_building_payloads_does_not_upload(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.assets['folleto.pdf'] = b'%PDF-1.4 folleto Josefa'
+        url = f"{fake_graph_server.base_url}/assets/folleto.pdf"
+
+        image = whatsapp_client.build_image_message_payload('5215511111111', url, 'Fachada')
+        document = whatsapp_client.build_document_message_payload('5215511111111', url, 'folleto.pdf')
+
+        assert image['image'] == {'link': url, 'caption': 'Fachada'}
+        assert document['document'] == {'link': url, 'filename': 'folleto.pdf', 'caption': ''}
+        assert fake_graph_server.uploads == []
+        assert fake_graph_server.asset_fetches == 0
+        assert fake_graph_server.requests == []
+
+    def test_media_id_survives_cold_start(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.assets['fachada.jpg'] = b'\xff\xd8 fachada'
+        url = f"{fake_graph_server.base_url}/assets/fachada.jpg"
+        whatsapp_client.send_image_message('5215511111111', url)
+
+        fresh_client = WhatsAppClient(transport=whatsapp_client.transport)
+        fresh_client.base_url = whatsapp_client.base_url
+        fresh_client.send_image_message('5215522222222', url)
+
+        assert len(fake_graph_server.uploads) == 1
+        assert fake_graph_server.requests[-1]['body']['image']['id'] == 'uploaded1'
+
+    def test_expired_media_id_is_uploaded_again(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.assets['fachada.jpg'] = b'\xff\xd8 fachada'
+        url = f"{fake_graph_server.base_url}/assets/fachada.jpg"
+        whatsapp_client.media_uploads.table.put_item(Item={
+            'asset_url': url, 'media_id': 'stale', 'media_type': 'image', 'expires_at': int(time.time()) + 60
+        })
+
+        whatsapp_client.send_image_message('5215511111111', url)
+
+        assert fake_graph_server.requests[-1]['body']['image']['id'] == 'uploaded1'
+
+    def test_rejected_media_id_is_replaced(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.assets['fachada.jpg'] = b'\xff\xd8 fachada'
+        url = f"{fake_graph_server.base_url}/assets/fachada.jpg"
+        whatsapp_client.send_image_message('5215511111111', url)
+
+        fake_graph_server.enqueue(400, 131053)
+        result = whatsapp_client.send_image_message('5215522222222', url)
+
+        assert result['messages'][0]['id'].startswith('wamid.')
+        assert fake_graph_server.requests[-1]['body']['image']['id'] == 'uploaded2'
+
+    def test_falls_back_to_link_when_upload_fails(self, whatsapp_client, fake_graph_server):
+        url = f"{fake_graph_server.base_url}/assets/missing.jpg"
+
+        whatsapp_client.send_image_message('5215511111111', url)
+
+        assert fake_graph_server.requests[-1]['body']['image'] == {'link': url, 'caption': ''}
+
+    def test_one_off_link_is_not_uploaded(self, whatsapp_client, fake_graph_server, monkeypatch):
+        monkeypatch.setattr(whatsapp_client.media_uploads, 'upload_hosts', set())
+        fake_graph_server.assets['recibo.pdf'] = b'%PDF-1.4 recibo Matilde'
+        url = f"{fake_graph_server.base_url}/assets/recibo.pdf?X-Amz-Signature=abc"
+
+        whatsapp_client.send_document_message('5215511111111', url, 'recibo.pdf')
+
+        assert fake_graph_server.requests[-1]['body']['document']['link'] == url
+        assert fake_graph_server.uploads == []
+        assert fake_graph_server.asset_fetches == 0
+
+    def test_repeated_asset_is_uploaded_whatever_its_query(self, whatsapp_client, fake_graph_server, monkeypatch):
+        monkeypatch.setattr(whatsapp_client.media_uploads, 'upload_hosts', set())
+        fake_graph_server.assets['folleto.pdf'] = b'%PDF-1.4 folleto Josefa'
+        base = f"{fake_graph_server.base_url}/assets/folleto.pdf"
+
+        for signature in ('a1', 'b2', 'c3'):
+            whatsapp_client.send_document_message('5215511111111', f"{base}?X-Amz-Signature={signature}", 'folleto.pdf')
+
+        documents = [request['body']['document'] for request in fake_graph_server.requests]
+        assert documents[0]['link'] == f"{base}?X-Amz-Signature=a1"
+        assert [document.get('id') for document in documents[1:]] == ['uploaded1', 'uploaded1']
+        assert len(fake_graph_server.uploads) == 1
+
+    def test_upload_body_is_streamed_from_the_asset(self, whatsapp_client, fake_graph_server, monkeypatch):
+        content = b'\xff\xd8' + bytes(range(256)) * 1024
+        fake_graph_server.assets['plano.jpg'] = content
+        url = f"{fake_graph_server.base_url}/assets/plano.jpg"
+        calls = []
+        original = whatsapp_client.transport.request
+
+        def recorded(method, request_url, **kwargs):
+            calls.append((method, kwargs))
+            return original(method, request_url, **kwargs)
+
+        monkeypatch.setattr(whatsapp_client.transport, 'request', recorded)
+
+        whatsapp_client.send_image_message('5215511111111', url)
+
+        fetch, post = calls[0][1], calls[1][1]
+        assert fetch['stream'] is True
+        assert post.get('files') is None and not isinstance(post['data'], (bytes, dict))
+        upload = fake_graph_server.uploads[0]
+        assert not upload['chunked']
+        assert upload['content_type'].startswith('multipart/form-data; boundary=')
+        assert content in upload['body']
+        assert b'name="messaging_product"\r\n\r\nwhatsapp' in upload['body']
+        assert fake_graph_server.requests[-1]['body']['image']['id'] == 'uploaded1'
+
+
+class TestSessionTracking:
+    """One conditional UpdateItem per inbound message"""
+
+    @pytest.fixture(autouse=True)
+    def cold_session_cache(self):
+        session_cache.clear()
+        yield
+        session_cache.clear()
+
+    @staticmethod
+    def count_calls(monkeypatch, table):
+        calls = []
+        for name in ('get_item', 'put_item', 'update_item'):
+            original = getattr(table, name)
+
+            def counted(*args, _name=name, _original=original, **kwargs):
+                calls.append(_name)
+                return _original(*args, **kwargs)
+
+            monkeypatch.setattr(table, name, counted)
+        return calls
+
+    def test_active_session_costs_one_update(self, whatsapp_client, monkeypatch):
+        first = whatsapp_client.get_or_create_session('5215512345678')
+        calls = self.count_calls(monkeypatch, whatsapp_client.session_table)
+
+        for _ in range(3):
+            session = whatsapp_client.get_or_create_session('5215512345678')
+
+        assert calls == ['update_item'] * 3
+        assert session.session_id == first.session_id
+        assert session.message_count == 4
+
+    def test_cold_container_joins_existing_session(self, whatsapp_client):
+        first = whatsapp_client.get_or_create_session('5215512345678')
+        session_cache.clear()
+
+        session = whatsapp_client.get_or_create_session('5215512345678')
+
+        assert session.session_id == first.session_id
+        assert session.message_count == 2
+
+    def test_expired_session_is_replaced(self, whatsapp_client):
+        stale = (datetime.now() - timedelta(hours=25)).isoformat()
+        whatsapp_client.session_table.put_item(Item={
+            'phone': '5215512345678', 'session_id': 'old', 'start_time': stale, 'last_activity': stale,
+            'message_count': 12, 'session_type': 'standard', 'context': {}
+        })
+
+        session = whatsapp_client.get_or_create_session('5215512345678', 'support')
+
+        assert session.session_id != 'old'
+        assert (session.message_count, session.session_type) == (1, 'support')
+
+    def test_concurrent_messages_are_all_counted(self, whatsapp_client):
+        whatsapp_client.get_or_create_session('5215512345678')
+        session_cache.clear()
+
+        threads = [threading.Thread(target=whatsapp_client.get_or_create_session, args=('5215512345678',))
+                   for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        item = whatsapp_client.session_table.get_item(Key={'phone': '5215512345678'})['Item']
+        assert item['message_count'] == 17
+
+
+class TestServiceWindow:
+    """24h customer service window lookups"""
+
+    @pytest.fixture(autouse=True)
+    def cold_session_cache(self):
+        session_cache.clear()
+        yield
+        session_cache.clear()
+
+    def test_inbound_message_opens_window(self, whatsapp_client):
+        whatsapp_client.get_or_create_session('5215512345678')
+
+        assert whatsapp_client.can_send_free_form('5215512345678')
+        assert not whatsapp_client.can_send_free_form('5215599999999')
+
+    def test_expired_window_is_closed(self, whatsapp_client):
+        whatsapp_client.session_table.put_item(Item={
+            'phone': '5215512345678', 'last_inbound_at': int(time.time()) - 25 * 3600
+        })
+
+        assert not whatsapp_client.can_send_free_form('5215512345678')
+
+    def test_bulk_lookup_is_one_batch_read(self, whatsapp_client, monkeypatch):
+        phones = [f'52155200000{i:02d}' for i in range(60)]
+        for phone in phones[:20]:
+            whatsapp_client.get_or_create_session(phone)
+
+        index = whatsapp_client.service_windows
+        index._entries.clear()
+        calls = []
+        original = index.dynamodb.batch_get_item
+        monkeypatch.setattr(index.dynamodb, 'batch_get_item',
+                            lambda **kwargs: calls.append(kwargs) or original(**kwargs))
+
+        windows = index.bulk_is_open(phones)
+        assert sum(windows.values()) == 20
+        assert len(calls) == 1
+
+        # Answered from memory until the closed answers are due for a recheck
+        index.bulk_is_open(phones)
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_broadcast_uses_free_form_inside_window(self, whatsapp_client, fake_graph_server, tmp_path):
+        path = write_residents_csv(tmp_path / 'residents.csv', 10)
+        for i in range(4):
+            whatsapp_client.get_or_create_session(f'52155200000{i:02d}')
+
+        job = BroadcastJob(whatsapp_client, 'pagos-libre', 'payment_reminder', csv_recipients(path),
+                           ['{amount}', '{due_date}'], id_field='resident_id',
+                           free_form_text='Tu pago de {amount} vence el {due_date}')
+        stats = await job.run()
+
+        types = {request['body']['to']: request['body']['type'] for request in fake_graph_server.requests}
+        assert (stats.sent, stats.free_form) == (10, 4)
+        assert [types[f'52155200000{i:02d}'] for i in range(10)] == ['text'] * 4 + ['template'] * 6
+
+
+class TestReadReceipts:
+    """Background, coalesced read receipts"""
+
+    @staticmethod
+    def marked(server):
+        return [request['body']['message_id'] for request in server.requests if request['body'].get('status') == 'read']
+
+    def test_queueing_does_not_wait_on_graph(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.default_latency = 0.3
+
+        start = time.perf_counter()
+        whatsapp_client.queue_read_receipt('5215512345678', 'wamid.in1')
+        assert time.perf_counter() - start < 0.1
+
+        assert whatsapp_client.read_receipts.flush()
+        assert self.marked(fake_graph_server) == ['wamid.in1']
+
+    def test_only_newest_message_per_conversation_is_marked(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.default_latency = 0.1
+        now = time.time()
+        # Keep the sender busy so the rest of the burst queues up behind it
+        whatsapp_client.queue_read_receipt('5215599999999', 'wamid.other', now)
+        time.sleep(0.02)
+        for i in range(5):
+            whatsapp_client.queue_read_receipt('5215512345678', f'wamid.a{i}', now + i)
+        whatsapp_client.queue_read_receipt('5215587654321', 'wamid.b1', now)
+        whatsapp_client.queue_read_receipt('5215512345678', 'wamid.late', now - 1)
+
+        assert whatsapp_client.read_receipts.flush()
+        assert sorted(self.marked(fake_graph_server)) == ['wamid.a4', 'wamid.b1', 'wamid.other']
+
+    def test_stale_receipts_are_dropped(self, whatsapp_client, fake_graph_server):
+        whatsapp_client.queue_read_receipt('5215512345678', 'wamid.old', time.time() - 3600)
+        assert whatsapp_client.read_receipts.flush()
+
+        whatsapp_client.queue_read_receipt('5215512345678', 'wamid.new')
+        assert whatsapp_client.read_receipts.flush()
+
+        # Already covered by the newer receipt
+        whatsapp_client.queue_read_receipt('5215512345678', 'wamid.replayed', time.time() - 30)
+        assert whatsapp_client.read_receipts.flush()
+
+        assert self.marked(fake_graph_server) == ['wamid.new']
+
+
+class TestOutboundDispatcher:
+    """Priority classes, per-recipient order and backpressure"""
+
+    @pytest.fixture
+    def dispatcher(self, whatsapp_client):
+        dispatcher = OutboundDispatcher(whatsapp_client, workers=2, bucket=TokenBucket(200), base_delay=0.01)
+        whatsapp_client.outbound = dispatcher
+        yield dispatcher
+        dispatcher.close()
+
+    def test_emergency_overtakes_marketing_backlog(self, whatsapp_client, fake_graph_server, dispatcher):
+        fake_graph_server.default_latency = 0.01
+        marketing = [dispatcher.submit(whatsapp_client.build_text_message_payload(f'52155200{i:04d}', 'Promo'),
+                                       'marketing') for i in range(100)]
+        time.sleep(0.05)
+        urgent = dispatcher.submit(whatsapp_client.build_text_message_payload('5215599999999', 'Fuga atendida'),
+                                   'emergency')
+
+        assert urgent.result(timeout=5)['messages'][0]['id'].startswith('wamid.')
+        recipients = [request['body']['to'] for request in fake_graph_server.requests]
+        assert sum(1 for future in marketing if future.done()) < 50
+        assert recipients.index('5215599999999') < 20
+        for future in marketing:
+            future.result(timeout=5)
+        assert dispatcher.stats()['emergency']['dispatched'] == 1
+        assert dispatcher.stats()['marketing']['queued'] == 0
+
+    def test_messages_to_one_recipient_keep_their_order(self, whatsapp_client, fake_graph_server, dispatcher):
+        futures = [dispatcher.submit(whatsapp_client.build_text_message_payload('5215512345678', f'Paso {i}'),
+                                     'transactional') for i in range(20)]
+        for future in futures:
+            future.result(timeout=5)
+
+        bodies = [request['body']['text']['body'] for request in fake_graph_server.requests]
+        assert bodies == [f'Paso {i}' for i in range(20)]
+
+    def test_full_class_pushes_back_without_blocking_others(self, whatsapp_client, fake_graph_server):
+        fake_graph_server.default_latency = 0.2
+        dispatcher = OutboundDispatcher(whatsapp_client, workers=1, max_queued=3, bucket=TokenBucket(200))
+        try:
+            for i in range(4):
+                dispatcher.submit(whatsapp_client.build_text_message_payload(f'5215520000{i:03d}', 'Promo'),
+                                  'marketing')
+            with pytest.raises(DispatchQueueFull):
+                dispatcher.submit(whatsapp_client.build_text_message_payload('5215520000999', 'Promo'),
+                                  'marketing', timeout=0.05)
+            urgent = dispatcher.submit(whatsapp_client.build_text_message_payload('5215599999999', 'Urgente'),
+                                       'emergency', timeout=0.05)
+            assert urgent.result(timeout=5)
+        finally:
+            dispatcher.close()
+
+    def test_throttled_marketing_does_not_hold_workers(self, whatsapp_client, fake_graph_server):
+        dispatcher = OutboundDispatcher(whatsapp_client, workers=2, bucket=TokenBucket(200), base_delay=0.1)
+        try:
+            fake_graph_server.enqueue(status_code=429, error_code=131056, count=2)
+            marketing = [dispatcher.submit(whatsapp_client.build_text_message_payload(f'52155200{i:04d}', 'Promo'),
+                                           'marketing') for i in range(2)]
+            deadline = time.monotonic() + 2
+            while len(fake_graph_server.requests) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            # Both marketing messages are now backing off for ~0.6s; neither holds a worker meanwhile
+            start = time.monotonic()
+            urgent = dispatcher.submit(whatsapp_client.build_text_message_payload('5215599999999', 'Fuga atendida'),
+                                       'emergency')
+            assert urgent.result(timeout=5)['messages'][0]['id'].startswith('wamid.')
+            assert time.monotonic() - start < 0.3
+            assert not any(future.done() for future in marketing)
+
+            for future in marketing:
+                assert future.result(timeout=5)['messages'][0]['id'].startswith('wamid.')
+            assert len(fake_graph_server.requests) == 5
+        finally:
+            dispatcher.close()
+
+    def test_rate_limited_send_is_retried(self, whatsapp_client, fake_graph_server, dispatcher):
+        fake_graph_server.enqueue(status_code=429, error_code=130429)
+
+        result = whatsapp_client.dispatch(whatsapp_client.build_text_message_payload('5215512345678', 'Hola'),
+                                          'transactional').result(timeout=5)
+
+        assert result['messages'][0]['id'].startswith('wamid.')
+        assert len(fake_graph_server.requests) == 2
+
+
+class TestIdempotentSends:
+    """Keyed sends are delivered at most once"""
+
+    @staticmethod
+    def failing_transport(monkeypatch, client, error, after_sending=False, times=1):
+        original = client.transport.request
+        failures = [times]
+
+        def request(*args, **kwargs):
+            if failures[0] > 0:
+                failures[0] -= 1
+                if after_sending:
+                    original(*args, **kwargs)
+                raise error
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(client.transport, 'request', request)
+
+    def test_repeated_message_returns_recorded_result(self, whatsapp_client, fake_graph_server):
+        message = WhatsAppMessage(to='5215512345678', type='text', content='Tu visita está confirmada')
+
+        first = whatsapp_client.send_message(message)
+        second = whatsapp_client.send_message(message)
+
+        assert second == first
+        assert len(fake_graph_server.requests) == 1
+        item = whatsapp_client.send_ledger.table.get_item(Key={'idempotency_key': message.message_id})['Item']
+        assert (item['status'], item['wamid']) == ('sent', first['messages'][0]['id'])
+
+    def test_connect_failure_is_retried(self, whatsapp_client, fake_graph_server, monkeypatch):
+        self.failing_transport(monkeypatch, whatsapp_client, requests.exceptions.ConnectTimeout('connect timed out'))
+
+        result = whatsapp_client.send_message(WhatsAppMessage(to='5215512345678', type='text', content='Hola'))
+
+        assert result['messages'][0]['id'].startswith('wamid.')
+        assert len(fake_graph_server.requests) == 1
+
+    def test_ambiguous_failure_is_never_resent(self, whatsapp_client, fake_graph_server, monkeypatch):
+        message = WhatsAppMessage(to='5215512345678', type='text', content='Pago recibido')
+        self.failing_transport(monkeypatch, whatsapp_client, requests.exceptions.ReadTimeout('read timed out'),
+                               after_sending=True)
+
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            whatsapp_client.send_message(message)
+        with pytest.raises(SendOutcomeUnknown):
+            whatsapp_client.send_message(message)
+
+        assert len(fake_graph_server.requests) == 1
+
+    @staticmethod
+    def backdate_claim(ledger, key: str):
+        ledger.table.update_item(
+            Key={'idempotency_key': key},
+            UpdateExpression='SET claimed_at = :claimed_at',
+            ExpressionAttributeValues={':claimed_at': int(time.time()) - ledger.lease_seconds - 1}
+        )
+
+    def test_abandoned_claim_expires_after_lease(self, whatsapp_client, fake_graph_server):
+        message = WhatsAppMessage(to='5215512345678', type='text', content='Recordatorio de visita')
+        ledger = whatsapp_client.send_ledger
+
+        # An invocation that died between claiming the key and sending the request
+        assert ledger.claim(message.message_id) is None
+        with pytest.raises(SendOutcomeUnknown):
+            whatsapp_client.send_message(message)
+        assert fake_graph_server.requests == []
+
+        self.backdate_claim(ledger, message.message_id)
+        result = whatsapp_client.send_message(message)
+
+        assert result['messages'][0]['id'].startswith('wamid.')
+        assert len(fake_graph_server.requests) == 1
+
+    def test_unknown_outcome_is_never_claimable_again(self, whatsapp_client, fake_graph_server, monkeypatch):
+        message = WhatsAppMessage(to='5215512345678', type='text', content='Pago recibido')
+        ledger = whatsapp_client.send_ledger
+        self.failing_transport(monkeypatch, whatsapp_client, requests.exceptions.ReadTimeout('read timed out'),
+                               after_sending=True)
+
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            whatsapp_client.send_message(message)
+
+        item = ledger.table.get_item(Key={'idempotency_key': message.message_id})['Item']
+        assert item['status'] == 'unknown'
+        self.backdate_claim(ledger, message.message_id)
+        with pytest.raises(SendOutcomeUnknown):
+            whatsapp_client.send_message(message)
+        assert len(fake_graph_server.requests) == 1
+
+    def test_rejected_message_can_be_sent_again(self, whatsapp_client, fake_graph_server):
+        message = WhatsAppMessage(to='5215512345678', type='image', content={'link': 'https://example.com/a.jpg'})
+        fake_graph_server.enqueue(status_code=400, error_code=131053)
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            whatsapp_client.send_message(message)
+        result = whatsapp_client.send_message(message)
+
+        assert result['messages'][0]['id'].startswith('wamid.')
+        assert fake_graph_server.requests[-1]['body']['image'] == {'link': 'https://example.com/a.jpg'}
+
+
+def sample_properties():
+    return [
+        {'id': 'josefa', 'name': 'Josefa', 'price': 25000, 'location': 'Reforma',
+         'amenities': ['gym', 'Azotea'], 'pet_friendly': True},
+        {'id': 'ines', 'name': 'Inés', 'price': 35000, 'location': 'Nuevo Polanco',
+         'nearby': ['Reforma'], 'amenities': ['gym'], 'pet_friendly': True},
+        {'id': 'amalia', 'name': 'Amalia', 'price': 18500, 'location': 'Juárez',
+         'nearby': ['Reforma'], 'amenities': ['co-working'], 'pet_friendly': False},
+        {'id': 'matilde', 'name': 'Matilde', 'price': 21000, 'location': 'Roma Norte',
+         'amenities': ['azotea'], 'pet_friendly': True, 'available': False},
+    ]
+
+
+class TestPropertyCatalog:
+    """Indexed property search behind the interactive property list"""
+
+    def test_filters_combine_and_rank_by_price(self):
+        catalog = PropertyCatalog(sample_properties())
+
+        assert [p['id'] for p in catalog.search(location='reforma')] == ['amalia', 'josefa', 'ines']
+        assert [p['id'] for p in catalog.search(max_price=25000, pet_friendly=True, location='Reforma')] == ['josefa']
+        assert [p['id'] for p in catalog.search(amenities=['AZOTEA'], available_only=False)] == ['matilde', 'josefa']
+        assert [p['id'] for p in catalog.search(location='Juarez', pet_friendly=False)] == ['amalia']
+        assert [p['id'] for p in catalog.search(min_price=20000, descending=True)] == ['ines', 'josefa']
+        assert catalog.search(location='Condesa') == []
+
+    def test_incremental_changes(self):
+        catalog = PropertyCatalog(sample_properties())
+        catalog.search()
+
+        catalog.upsert([{'id': 'ines', 'name': 'Inés', 'price': 17000, 'location': 'Nuevo Polanco'},
+                        {'id': 'lucia', 'name': 'Lucía', 'price': 30000, 'location': 'Reforma', 'pet_friendly': True}])
+        catalog.remove(['amalia'])
+
+        assert [p['id'] for p in catalog.search()] == ['ines', 'josefa', 'lucia']
+        assert [p['id'] for p in catalog.search(location='Reforma', pet_friendly=True)] == ['josefa', 'lucia']
+
+    @staticmethod
+    def property_table():
+        return boto3.resource('dynamodb').create_table(
+            TableName='urbanhub-properties',
+            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'},
+                                  {'AttributeName': 'catalog', 'AttributeType': 'S'},
+                                  {'AttributeName': 'updated_at', 'AttributeType': 'N'}],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'updated_at-index',
+                'KeySchema': [{'AttributeName': 'catalog', 'KeyType': 'HASH'},
+                              {'AttributeName': 'updated_at', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            }],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+    def test_dynamodb_catalog_refreshes_only_changed_items(self, whatsapp_client, monkeypatch):
+        table = self.property_table()
+        for index, prop in enumerate(sample_properties()):
+            table.put_item(Item={**prop, 'price': Decimal(prop['price']), 'catalog': CATALOG_PARTITION,
+                                 'updated_at': 1000 + index * 10})
+        catalog = DynamoDBPropertyCatalog(refresh_seconds=3600)
+        read = []
+        original_query = catalog.table.query
+
+        def query(**kwargs):
+            page = original_query(**kwargs)
+            read.extend(item['id'] for item in page['Items'])
+            return page
+
+        monkeypatch.setattr(catalog.table, 'query', query)
+        monkeypatch.setattr(catalog.table, 'scan', lambda **kwargs: pytest.fail('refresh must not scan'))
+
+        rows = whatsapp_client.search_property_list(catalog=catalog, location='Reforma')['sections'][0]['rows']
+        assert [p['price'] for p in catalog.search(location='Reforma')] == [18500, 25000, 35000]
+        assert rows[1]['description'] == '$25,000 MXN - Reforma'
+
+        table.update_item(Key={'id': 'josefa'}, UpdateExpression='SET price = :price, updated_at = :updated_at',
+                          ExpressionAttributeValues={':price': Decimal('24500.5'), ':updated_at': 2000})
+        read.clear()
+        catalog.refresh()
+
+        # The change, plus the last item of the previous refresh from the one-second overlap
+        assert read == ['matilde', 'josefa']
+        assert catalog.search(location='Reforma')[1]['price'] == 24500.5
+
+    def test_results_paginate_into_list_messages(self, whatsapp_client):
+        catalog = PropertyCatalog({'id': f'p{i}', 'name': f'Depto {i}', 'price': 15000 + i * 100,
+                                   'location': 'Reforma'} for i in range(20))
+
+        first = whatsapp_client.search_property_list(catalog=catalog, location='Reforma')
+        rows = first['sections'][0]['rows']
+        assert len(rows) == 10
+        assert [row['id'] for row in rows[:9]] == [f'p{i}' for i in range(9)]
+        assert rows[-1]['id'] == 'properties_page_1'
+
+        second = whatsapp_client.search_property_list(page=1, catalog=catalog, location='Reforma')
+        assert second['sections'][0]['rows'][-1]['id'] == 'properties_page_2'
+        third = whatsapp_client.search_property_list(page=2, catalog=catalog, location='Reforma')
+        assert [row['id'] for row in third['sections'][0]['rows']] == ['p18', 'p19']
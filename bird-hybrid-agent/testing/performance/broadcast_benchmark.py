@@ -0,0 +1,142 @@
+"""
+Template Broadcast Benchmark
+Runs a payment-reminder broadcast end to end against the local fake Graph
+server (with injected send latency) and a mocked DynamoDB checkpoint table,
+compared with the old sequential send_template_message loop. A second job
+is interrupted partway and resumed to count duplicate sends.
+
+Usage: python broadcast_benchmark.py [recipients] [latency_ms]
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import tempfile
+
+import boto3
+from moto import mock_dynamodb
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../integration-tests'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../whatsapp-integration'))
+from fake_graph_server import FakeGraphServer  # noqa: E402
+from graph_transport import RequestsTransport  # noqa: E402
+from whatsapp_client import WhatsAppClient  # noqa: E402
+from broadcast import BroadcastJob, csv_recipients  # noqa: E402
+
+PARAMETERS = ['{amount}', '{due_date}']
+
+
+def write_residents_csv(path: str, count: int):
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=['resident_id', 'phone', 'amount', 'due_date'])
+        writer.writeheader()
+        for i in range(count):
+            writer.writerow({'resident_id': f'R{i:05d}', 'phone': f'52155{i:08d}',
+                             'amount': f'{12000 + i:,}', 'due_date': '5 de noviembre'})
+
+
+def create_tables():
+    dynamodb = boto3.resource('dynamodb')
+    dynamodb.create_table(
+        TableName='whatsapp-sessions',
+        KeySchema=[{'AttributeName': 'phone', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'phone', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName='whatsapp-broadcasts',
+        KeySchema=[{'AttributeName': 'job_id', 'KeyType': 'HASH'},
+                   {'AttributeName': 'recipient_id', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'job_id', 'AttributeType': 'S'},
+                              {'AttributeName': 'recipient_id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def sequential(client: WhatsAppClient, path: str, limit: int):
+    """The previous approach: one blocking send after another"""
+    start = time.perf_counter()
+    for i, recipient in enumerate(csv_recipients(path)):
+        if i == limit:
+            break
+        client.send_template_message(recipient['phone'], 'payment_reminder',
+                                     [recipient['amount'], recipient['due_date']])
+    return round(limit / (time.perf_counter() - start), 1)
+
+
+async def interrupted_then_resumed(client: WhatsAppClient, path: str, interrupt_after: float):
+    job = BroadcastJob(client, 'resume-check', 'payment_reminder', csv_recipients(path), PARAMETERS,
+                       id_field='resident_id')
+    task = asyncio.ensure_future(job.run())
+    await asyncio.sleep(interrupt_after)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+    resumed = BroadcastJob(client, 'resume-check', 'payment_reminder', csv_recipients(path), PARAMETERS,
+                           id_field='resident_id')
+    return job.stats, await resumed.run()
+
+
+def main():
+    recipients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    os.environ.update({
+        'WHATSAPP_ACCESS_TOKEN': 'test',
+        'WHATSAPP_PHONE_NUMBER_ID': '1234567890',
+        'WHATSAPP_VERIFY_TOKEN': 'verify',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing'
+    })
+
+    server = FakeGraphServer().start()
+    server.default_latency = latency_ms / 1000
+
+    with tempfile.TemporaryDirectory() as directory, mock_dynamodb():
+        path = os.path.join(directory, 'residents.csv')
+        write_residents_csv(path, recipients)
+        create_tables()
+
+        client = WhatsAppClient(transport=RequestsTransport())
+        client.base_url = f"{server.base_url}/{client.api_version}"
+
+        try:
+            sequential_rate = sequential(client, path, min(recipients, 100))
+
+            server.requests.clear()
+            start = time.perf_counter()
+            stats = asyncio.run(BroadcastJob(client, 'benchmark', 'payment_reminder', csv_recipients(path),
+                                             PARAMETERS, id_field='resident_id').run())
+            elapsed = time.perf_counter() - start
+
+            server.requests.clear()
+            interrupted, resumed = asyncio.run(interrupted_then_resumed(client, path, elapsed / 2))
+            phones = [request['body']['to'] for request in server.requests]
+        finally:
+            client.transport.close()
+            server.stop()
+
+    print(json.dumps({
+        'recipients': recipients,
+        'send_latency_ms': latency_ms,
+        'rate_limit_per_second': float(os.environ.get('WHATSAPP_MESSAGES_PER_SECOND', '80')),
+        'sequential_messages_per_second': sequential_rate,
+        'broadcast': {**stats.to_dict(), 'seconds': round(elapsed, 2)},
+        'resume': {
+            'sent_before_interrupt': interrupted.sent,
+            'resumed': resumed.to_dict(),
+            'duplicate_sends': len(phones) - len(set(phones)),
+            'recipients_never_sent': recipients - len(set(phones))
+        }
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
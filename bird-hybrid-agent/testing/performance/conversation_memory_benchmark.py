@@ -0,0 +1,92 @@
+"""
+Conversation Memory Benchmark
+Compares the warm-cache footprint of conversation contexts loaded as plain
+dataclasses with dict messages against the slotted, compact-record model.
+
+Usage: python conversation_memory_benchmark.py [conversations] [messages_per_conversation]
+"""
+
+import os
+import sys
+import json
+import tracemalloc
+from dataclasses import MISSING, fields, make_dataclass, field
+from datetime import datetime
+from typing import Callable, List, Any
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../aws-infrastructure/lambda-functions/claude-integration'))
+from claude_client import ConversationContext  # noqa: E402
+
+# Same fields as ConversationContext, without slots: the pre-compaction model
+LegacyConversationContext = make_dataclass(
+    'LegacyConversationContext',
+    [(f.name, f.type) if f.default is MISSING else (f.name, f.type, field(default=f.default))
+     for f in fields(ConversationContext)]
+)
+
+
+def make_item(index: int, message_count: int) -> str:
+    """A stored context item as JSON, so every load builds fresh objects like boto3 does"""
+    return json.dumps({
+        'conversation_id': f'conv_{index}',
+        'user_id': f'user_{index}',
+        'messages': [
+            {
+                'role': 'user' if turn % 2 == 0 else 'assistant',
+                'content': f'Mensaje {turn} sobre precios y disponibilidad en Josefa',
+                'timestamp': datetime(2024, 1, 1, 12, turn % 60).isoformat()
+            }
+            for turn in range(message_count)
+        ],
+        'user_preferences': {'budget': 25000},
+        'property_interests': ['Josefa'],
+        'session_start': '2024-01-01T12:00:00',
+        'last_updated': '2024-01-01T12:30:00',
+        'conversation_summary': '',
+        'total_tokens_used': 1200
+    })
+
+
+def load_legacy(item: dict) -> Any:
+    return LegacyConversationContext(
+        conversation_id=item['conversation_id'],
+        user_id=item['user_id'],
+        messages=item['messages'],
+        user_preferences=item['user_preferences'],
+        property_interests=item['property_interests'],
+        session_start=datetime.fromisoformat(item['session_start']),
+        last_updated=datetime.fromisoformat(item['last_updated']),
+        total_tokens_used=int(item['total_tokens_used']),
+        conversation_summary=item['conversation_summary']
+    )
+
+
+def measure(loader: Callable[[dict], Any], raw_items: List[str]) -> int:
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    contexts = [loader(json.loads(raw)) for raw in raw_items]
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del contexts
+    return used
+
+
+def main():
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    message_count = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    raw_items = [make_item(i, message_count) for i in range(conversations)]
+
+    legacy_bytes = measure(load_legacy, raw_items)
+    compact_bytes = measure(ConversationContext.from_dynamodb_item, raw_items)
+
+    print(json.dumps({
+        'conversations': conversations,
+        'messages_per_conversation': message_count,
+        'legacy_bytes_per_conversation': legacy_bytes // conversations,
+        'compact_bytes_per_conversation': compact_bytes // conversations,
+        'reduction_percent': round(100 * (1 - compact_bytes / legacy_bytes), 1)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Graph API Send Latency Benchmark
+Compares per-send latency of one-shot requests.post calls (a new TCP+TLS
+connection per send, the previous behaviour) with the pooled keep-alive
+transport, against the local fake Graph server over HTTPS.
+
+Usage: python graph_send_benchmark.py [sends]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import ipaddress
+import datetime
+import statistics
+
+import requests
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../integration-tests'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../whatsapp-integration'))
+from fake_graph_server import FakeGraphServer  # noqa: E402
+from graph_transport import RequestsTransport  # noqa: E402
+
+PAYLOAD = {
+    'messaging_product': 'whatsapp',
+    'to': '5215512345678',
+    'type': 'text',
+    'text': {'preview_url': True, 'body': '¡Hola! Tu tour en Josefa está confirmado.'}
+}
+
+
+def write_self_signed_cert(directory: str):
+    """Self-signed certificate for 127.0.0.1 so the benchmark includes TLS handshakes"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(hours=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]),
+                       critical=False)
+        .sign(key, hashes.SHA256())
+    )
+
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    with open(certfile, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+def run(send, sends: int):
+    latencies = []
+    for _ in range(sends):
+        start = time.perf_counter()
+        send().raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        'mean_ms': round(statistics.mean(latencies), 2)
+    }
+
+
+def main():
+    sends = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = write_self_signed_cert(directory)
+        server = FakeGraphServer(certfile=certfile, keyfile=keyfile).start()
+        url = f"{server.base_url}/v18.0/1234567890/messages"
+        headers = {'Authorization': 'Bearer test', 'Content-Type': 'application/json'}
+
+        try:
+            connections_before = server.connections
+            unpooled = run(lambda: requests.post(url, headers=headers, json=PAYLOAD, timeout=30, verify=certfile), sends)
+            unpooled['connections'] = server.connections - connections_before
+
+            transport = RequestsTransport(verify=certfile)
+            connections_before = server.connections
+            pooled = run(lambda: transport.request('POST', url, headers=headers, json=PAYLOAD), sends)
+            pooled['connections'] = server.connections - connections_before
+            transport.close()
+        finally:
+            server.stop()
+
+    print(json.dumps({'sends': sends, 'unpooled': unpooled, 'pooled': pooled}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
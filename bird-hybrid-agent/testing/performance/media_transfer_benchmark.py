@@ -0,0 +1,124 @@
+"""
+Media Transfer Benchmark
+Compares the buffered path (download_media then store_media_in_s3) with
+stream_media_to_s3 for 1, 16 and 100 MB files served by the local fake
+Graph server. Peak memory is measured with tracemalloc. S3 is a sink that
+only counts bytes and adds per-request latency plus a bandwidth cost, so
+the numbers measure the transfer itself rather than moto's in-memory store.
+
+Usage: python media_transfer_benchmark.py [sizes_mb ...]
+"""
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../integration-tests'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../whatsapp-integration'))
+os.environ.update({
+    'WHATSAPP_ACCESS_TOKEN': 'test',
+    'WHATSAPP_PHONE_NUMBER_ID': '1234567890',
+    'WHATSAPP_VERIFY_TOKEN': 'verify',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing'
+})
+from fake_graph_server import FakeGraphServer  # noqa: E402
+from graph_transport import RequestsTransport  # noqa: E402
+from whatsapp_client import WhatsAppClient  # noqa: E402
+from media_transfer import S3StreamUploader  # noqa: E402
+
+MB = 1024 * 1024
+
+# Rough figures for S3 from inside the region
+S3_REQUEST_LATENCY = 0.02
+S3_BANDWIDTH = 200 * MB
+
+
+class S3Sink:
+    """Accepts the S3 calls the client makes and discards the bytes"""
+
+    def __init__(self):
+        self.bytes_received = 0
+
+    def _receive(self, body):
+        size = len(body)
+        self.bytes_received += size
+        time.sleep(S3_REQUEST_LATENCY + size / S3_BANDWIDTH)
+
+    def put_object(self, Body, **kwargs):
+        self._receive(Body)
+        return {}
+
+    def create_multipart_upload(self, **kwargs):
+        time.sleep(S3_REQUEST_LATENCY)
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Body, PartNumber, **kwargs):
+        self._receive(Body)
+        return {'ETag': f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, **kwargs):
+        time.sleep(S3_REQUEST_LATENCY)
+        return {}
+
+    def abort_multipart_upload(self, **kwargs):
+        return {}
+
+
+def buffered(client, media_id):
+    content = client.download_media(media_id)
+    client.store_media_in_s3(content, 'video', 'benchmark')
+
+
+def streamed(client, media_id):
+    client.stream_media_to_s3(media_id, 'video', 'benchmark')
+
+
+def measure(transfer, client, media_id, size):
+    start = time.perf_counter()
+    transfer(client, media_id)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    transfer(client, media_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds': round(seconds, 3),
+        'throughput_mb_s': round(size / MB / seconds, 1),
+        'peak_memory_mb': round(peak / MB, 1)
+    }
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 16, 100]
+
+    server = FakeGraphServer().start()
+    client = WhatsAppClient(transport=RequestsTransport())
+    client.base_url = f"{server.base_url}/{client.api_version}"
+    client.s3_client = S3Sink()
+    client.media_uploader = S3StreamUploader(client.s3_client)
+
+    results = []
+    try:
+        for size_mb in sizes:
+            media_id = f'video{size_mb}'
+            server.generated_media[media_id] = size_mb * MB
+            results.append({
+                'size_mb': size_mb,
+                'buffered': measure(buffered, client, media_id, size_mb * MB),
+                'streamed': measure(streamed, client, media_id, size_mb * MB)
+            })
+    finally:
+        client.transport.close()
+        server.stop()
+
+    print(json.dumps({'part_size_mb': client.media_uploader.part_size // MB, 'results': results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
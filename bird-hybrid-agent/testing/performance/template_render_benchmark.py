@@ -0,0 +1,61 @@
+"""
+WhatsApp Template Rendering Benchmark
+Compares the previous get_template (copy the registry entry, then one
+str.replace pass per parameter) with the precompiled segment renderer, for
+unique parameters per recipient (broadcasts) and for repeated parameters
+(render cache hits).
+
+Usage: python template_render_benchmark.py [renders]
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../whatsapp-integration'))
+os.environ.setdefault('WHATSAPP_ACCESS_TOKEN', 'test')
+os.environ.setdefault('WHATSAPP_PHONE_NUMBER_ID', '1234567890')
+os.environ.setdefault('WHATSAPP_VERIFY_TOKEN', 'verify')
+from whatsapp_client import WhatsAppTemplateManager  # noqa: E402
+
+
+def replace_per_parameter(templates, template_name, parameters):
+    """The previous algorithm, with a deep copy so it does not corrupt the registry"""
+    template = copy.deepcopy(templates[template_name])
+    for component in template['components']:
+        if component['type'] == 'BODY':
+            text = component['text']
+            for i, param in enumerate(parameters, 1):
+                text = text.replace(f'{{{{{i}}}}}', param)
+            component['text'] = text
+    return template
+
+
+def per_second(render, parameter_sets):
+    start = time.perf_counter()
+    for parameters in parameter_sets:
+        render('maintenance_scheduled', parameters)
+    return round(len(parameter_sets) / (time.perf_counter() - start))
+
+
+def main():
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    unique = [[f'MT-{i:06d}', '12 de noviembre', '9:00 y 11:00'] for i in range(renders)]
+    repeated = [['MT-000001', '12 de noviembre', '9:00 y 11:00']] * renders
+
+    manager = WhatsAppTemplateManager(render_cache_size=renders + 1)
+    previous = lambda name, parameters: replace_per_parameter(manager.templates, name, parameters)  # noqa: E731
+
+    results = {
+        'renders': renders,
+        'previous_renders_per_second': per_second(previous, unique),
+        'compiled_unique_renders_per_second': per_second(manager.get_template, unique),
+        'compiled_cached_renders_per_second': per_second(manager.get_template, repeated)
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
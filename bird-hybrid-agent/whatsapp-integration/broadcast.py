@@ -0,0 +1,346 @@
+"""
+Template Broadcast Jobs for WhatsApp
+Sends one approved template (payment reminders, maintenance notices) to a
+streamed recipient list through the rate-limited bulk sender. Every
+recipient is checkpointed in DynamoDB and every send goes through the send
+ledger under a per-(job, recipient) key, so a restarted job resumes where
+it stopped without messaging anyone twice.
+"""
+
+import os
+import csv
+import time
+import asyncio
+import itertools
+from decimal import Decimal
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Iterable, Iterator, AsyncIterator, Callable, Union
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+from bulk_sender import BulkSender, RATE_LIMIT_ERROR_CODES
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
+
+# Sort key of the item holding job status and live counters
+JOB_ITEM = '#job'
+
+# Recipient states in the checkpoint table
+SENDING = 'sending'  # claimed right before sending; outcome not recorded yet, resent under the ledger
+SENT = 'sent'
+FAILED = 'failed'
+
+
+def csv_recipients(path: str, encoding: str = 'utf-8-sig') -> Iterator[Dict[str, str]]:
+    """Stream recipient rows from a CSV file with a header row"""
+    with open(path, newline='', encoding=encoding) as csv_file:
+        yield from csv.DictReader(csv_file)
+
+
+def dynamodb_recipients(table_name: str, page_size: int = 500, **scan_kwargs) -> Iterator[Dict[str, Any]]:
+    """Stream recipient items from a DynamoDB scan, one page at a time"""
+    table = boto3.resource('dynamodb').Table(table_name)
+    kwargs = {'Limit': page_size, **scan_kwargs}
+
+    while True:
+        page = table.scan(**kwargs)
+        yield from page.get('Items', [])
+        if 'LastEvaluatedKey' not in page:
+            return
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+@dataclass(slots=True)
+class BroadcastStats:
+    """Live counters for one run of a broadcast job"""
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    free_form: int = 0
+    skip_reasons: Counter = field(default_factory=Counter)
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float = None
+
+    def skip(self, reason: str):
+        self.skipped += 1
+        self.skip_reasons[reason] += 1
+
+    @property
+    def messages_per_second(self) -> float:
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return round((self.sent + self.failed) / elapsed, 1) if elapsed else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'free_form': self.free_form,
+            'skip_reasons': dict(self.skip_reasons),
+            'messages_per_second': self.messages_per_second
+        }
+
+
+class BroadcastCheckpoint:
+    """Per-recipient progress of one broadcast job, keyed by (job_id, recipient_id)"""
+
+    def __init__(self, job_id: str, table_name: str = None):
+        self.job_id = job_id
+        self.table = boto3.resource('dynamodb').Table(
+            table_name or os.environ.get('WHATSAPP_BROADCAST_TABLE', 'whatsapp-broadcasts')
+        )
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Recipient states recorded by earlier runs of this job"""
+        states = {}
+        kwargs = {
+            'KeyConditionExpression': Key('job_id').eq(self.job_id),
+            'ProjectionExpression': 'recipient_id, #status, retryable',
+            'ExpressionAttributeNames': {'#status': 'status'}
+        }
+
+        while True:
+            page = self.table.query(**kwargs)
+            for item in page.get('Items', []):
+                states[item['recipient_id']] = item
+            if 'LastEvaluatedKey' not in page:
+                break
+            kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+        states.pop(JOB_ITEM, None)
+        return states
+
+    def write(self, items: List[Dict[str, Any]]):
+        with self.table.batch_writer(overwrite_by_pkeys=['job_id', 'recipient_id']) as batch:
+            for item in items:
+                batch.put_item(Item={'job_id': self.job_id, **item})
+
+    def update_job(self, status: str, template_name: str, stats: BroadcastStats):
+        counters = stats.to_dict()
+        counters['messages_per_second'] = Decimal(str(counters['messages_per_second']))
+        self.table.put_item(Item={
+            'job_id': self.job_id,
+            'recipient_id': JOB_ITEM,
+            'status': status,
+            'template_name': template_name,
+            'updated_at': int(time.time()),
+            **counters
+        })
+
+
+class BroadcastJob:
+    """Sends a template to every recipient of a source, resumably
+
+    parameters is either a list of format strings filled from each
+    recipient row (e.g. ['{amount}', '{due_date}']) or a callable that
+    returns the parameter list for a recipient.
+
+    A recipient is claimed in the checkpoint just before its message is
+    handed to the sender. On resume, recipients already sent are skipped.
+    Claims without a recorded outcome are sent again under the same
+    idempotency key: the send ledger returns the earlier result if that
+    message did go out, instead of delivering it twice. Failures are
+    retried on resume unless Graph rejected the message outright (a 4xx
+    other than a rate limit).
+
+    With free_form_text (a format string or a callable, like parameters),
+    recipients inside their 24h customer service window get that text
+    instead of the template. Windows are looked up once per claim page.
+    """
+
+    def __init__(self, client: Any, job_id: str, template_name: str,
+                 recipients: Iterable[Dict[str, Any]],
+                 parameters: Union[List[str], Callable[[Dict[str, Any]], List[Any]]],
+                 id_field: str = 'phone', phone_field: str = 'phone',
+                 checkpoint: BroadcastCheckpoint = None, concurrency: int = None,
+                 claim_batch_size: int = 25, progress_interval: float = 5.0,
+                 free_form_text: Union[str, Callable[[Dict[str, Any]], str]] = None):
+        if template_name not in client.template_manager.templates:
+            raise ValueError(f"Template {template_name} not found")
+
+        self.client = client
+        self.job_id = job_id
+        self.template_name = template_name
+        self.recipients = recipients
+        self.parameters = parameters
+        self.id_field = id_field
+        self.phone_field = phone_field
+        self.checkpoint = checkpoint or BroadcastCheckpoint(job_id)
+        self.concurrency = concurrency
+        self.claim_batch_size = claim_batch_size
+        self.progress_interval = progress_interval
+        self.free_form_text = free_form_text
+        self.stats = BroadcastStats()
+        self._recipient_ids: Dict[int, str] = {}  # sender index -> recipient_id, while in flight
+
+    def render_parameters(self, recipient: Dict[str, Any]) -> List[str]:
+        if callable(self.parameters):
+            return [str(value) for value in self.parameters(recipient)]
+        return [parameter.format_map(recipient) for parameter in self.parameters]
+
+    def render_free_form(self, recipient: Dict[str, Any]) -> str:
+        if callable(self.free_form_text):
+            return str(self.free_form_text(recipient))
+        return self.free_form_text.format_map(recipient)
+
+    async def _use_open_windows(self, claimed: List[tuple]) -> List[tuple]:
+        """Swap the template for free-form text where the service window is open"""
+
+        windows = await asyncio.to_thread(self.client.service_windows.bulk_is_open,
+                                          [payload['to'] for _, payload, _ in claimed])
+        swapped = []
+        for recipient_id, payload, recipient in claimed:
+            if windows.get(payload['to']):
+                try:
+                    payload = self.client.build_text_message_payload(payload['to'], self.render_free_form(recipient))
+                    self.stats.free_form += 1
+                except (KeyError, IndexError, ValueError):
+                    pass  # the template still works for this recipient
+            swapped.append((recipient_id, payload, recipient))
+        return swapped
+
+    def _prepare(self, recipient: Dict[str, Any], states: Dict[str, Dict[str, Any]], seen: set):
+        """(recipient_id, payload) to send, or (None, skip reason)"""
+
+        phone = str(recipient.get(self.phone_field) or '').strip().lstrip('+')
+        recipient_id = str(recipient.get(self.id_field) or '').strip()
+        if not phone or not recipient_id:
+            return None, 'missing_phone'
+
+        if recipient_id in seen:
+            return None, 'duplicate'
+        seen.add(recipient_id)
+
+        state = states.get(recipient_id)
+        if state:
+            if state['status'] == SENT:
+                return None, 'already_sent'
+            if state['status'] == FAILED and not state.get('retryable'):
+                return None, 'already_failed'
+
+        try:
+            parameters = self.render_parameters(recipient)
+        except (KeyError, IndexError, ValueError):
+            return None, 'missing_parameters'
+
+        try:
+            return recipient_id, self.client.build_template_message_payload(phone, self.template_name, parameters)
+        except ValueError as e:
+            logger.info("Broadcast recipient rejected", recipient_id=recipient_id, reason=str(e))
+            return None, 'rejected'
+
+    async def _payloads(self, states: Dict[str, Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Read recipients a page at a time, claim the sendable ones, then release them to the sender"""
+
+        recipients = iter(self.recipients)
+        seen = set()
+        index = 0
+
+        while True:
+            page = await asyncio.to_thread(lambda: list(itertools.islice(recipients, self.claim_batch_size)))
+            if not page:
+                return
+
+            claimed = []
+            for recipient in page:
+                recipient_id, prepared = self._prepare(recipient, states, seen)
+                if recipient_id is None:
+                    self.stats.skip(prepared)
+                else:
+                    claimed.append((recipient_id, prepared, recipient))
+
+            if not claimed:
+                continue
+
+            if self.free_form_text is not None:
+                claimed = await self._use_open_windows(claimed)
+
+            await asyncio.to_thread(self.checkpoint.write,
+                                    [{'recipient_id': recipient_id, 'status': SENDING} for recipient_id, _, _ in claimed])
+
+            for recipient_id, payload, _ in claimed:
+                self._recipient_ids[index] = recipient_id
+                index += 1
+                yield payload
+
+    def _idempotency_key(self, index: int) -> str:
+        return f"broadcast#{self.job_id}#{self._recipient_ids[index]}"
+
+    def _outcome(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        outcome = {
+            'recipient_id': self._recipient_ids.pop(result['index']),
+            'status': result['status'],
+            'attempts': result['attempts']
+        }
+
+        if result['status'] == 'sent':
+            self.stats.sent += 1
+            if result.get('message_id'):
+                outcome['message_id'] = result['message_id']
+        else:
+            self.stats.failed += 1
+            status_code = result.get('status_code')
+            # Only a definite rejection is final; rate limits (with or without a Graph code),
+            # server errors and unknown outcomes are resent on resume, guarded by the ledger
+            outcome['retryable'] = result.get('error_code') in RATE_LIMIT_ERROR_CODES or status_code is None \
+                or status_code == 429 or status_code >= 500
+            if result.get('error_code') is not None:
+                outcome['error_code'] = result['error_code']
+
+        return outcome
+
+    async def run(self) -> BroadcastStats:
+        """Send to every remaining recipient; safe to call again after a crash"""
+
+        states = await asyncio.to_thread(self.checkpoint.load)
+        self.stats = BroadcastStats()
+        await asyncio.to_thread(self.checkpoint.update_job, 'running', self.template_name, self.stats)
+
+        concurrency = self.concurrency or int(os.environ.get('WHATSAPP_BULK_CONCURRENCY', '16'))
+        # Keep few claimed-but-unsent recipients around, they are what a crash leaves to be resent
+        sender = BulkSender(self.client, concurrency=concurrency, max_buffered=concurrency * 2)
+
+        logger.info("Broadcast started", job_id=self.job_id, template=self.template_name, resumed=len(states))
+
+        outcomes = []
+        last_progress = time.monotonic()
+
+        try:
+            async for result in sender.send(self._payloads(states), idempotency_keys=self._idempotency_key):
+                outcomes.append(self._outcome(result))
+                if len(outcomes) >= self.claim_batch_size:
+                    await asyncio.to_thread(self.checkpoint.write, outcomes)
+                    outcomes = []
+
+                if time.monotonic() - last_progress >= self.progress_interval:
+                    last_progress = time.monotonic()
+                    await asyncio.to_thread(self.checkpoint.update_job, 'running', self.template_name, self.stats)
+                    logger.info("Broadcast progress", job_id=self.job_id, **self.stats.to_dict())
+        finally:
+            # Record whatever already finished, even when the run is being torn down
+            if outcomes:
+                self.checkpoint.write(outcomes)
+
+        self.stats.finished_at = time.monotonic()
+        self.checkpoint.update_job('completed', self.template_name, self.stats)
+
+        metrics.add_metric(name="WhatsAppBroadcastSent", unit=MetricUnit.Count, value=self.stats.sent)
+        metrics.add_metric(name="WhatsAppBroadcastFailed", unit=MetricUnit.Count, value=self.stats.failed)
+        metrics.add_metric(name="WhatsAppBroadcastSkipped", unit=MetricUnit.Count, value=self.stats.skipped)
+        metrics.add_metric(name="WhatsAppBroadcastThroughput", unit=MetricUnit.CountPerSecond,
+                           value=self.stats.messages_per_second)
+
+        logger.info("Broadcast completed", job_id=self.job_id, **self.stats.to_dict())
+        return self.stats
+
+
+# Export main classes
+__all__ = ['BroadcastJob', 'BroadcastCheckpoint', 'BroadcastStats', 'csv_recipients', 'dynamodb_recipients']
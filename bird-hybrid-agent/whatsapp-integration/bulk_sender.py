@@ -0,0 +1,250 @@
+"""
+Async Bulk Sender for WhatsApp
+Fans out prebuilt message payloads with bounded concurrency under a
+token bucket per business phone number, keeps each recipient's messages
+in order, retries Graph rate-limit errors with backoff and streams
+per-message results back.
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, Callable, Iterable, AsyncIterable, AsyncIterator, Union
+
+import requests
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
+
+# Graph API error codes that mean "slow down", not "this message is bad"
+THROUGHPUT_ERROR_CODES = {
+    4,       # application request limit
+    80007,   # WhatsApp Business Account rate limit
+    130429,  # Cloud API throughput for this phone number
+}
+PAIR_RATE_LIMIT_CODE = 131056  # too many messages to the same recipient
+RATE_LIMIT_ERROR_CODES = THROUGHPUT_ERROR_CODES | {PAIR_RATE_LIMIT_CODE}
+
+# Meta's guidance is roughly one message every 6 seconds per business/recipient pair
+PAIR_RATE_LIMIT_DELAY = 6.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket with reservations, usable from any event loop"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take one token, possibly on credit; returns how long to wait before using it"""
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self) -> float:
+        """How long until a token is free, without taking one"""
+        with self._lock:
+            self._refill()
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Push every waiter back after Meta reports the number's throughput is exhausted"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_phone_number_bucket(phone_number_id: str) -> TokenBucket:
+    """One bucket per business phone number, shared by every sender in the process"""
+    with _buckets_lock:
+        if phone_number_id not in _buckets:
+            _buckets[phone_number_id] = TokenBucket(float(os.environ.get('WHATSAPP_MESSAGES_PER_SECOND', '80')))
+        return _buckets[phone_number_id]
+
+
+def graph_error_code(error: requests.exceptions.HTTPError) -> Optional[int]:
+    """Graph API error.code from a failed response, if there is one"""
+    try:
+        return int(error.response.json()['error']['code'])
+    except (AttributeError, ValueError, KeyError, TypeError):
+        return None
+
+
+async def _iterate(payloads: Union[Iterable, AsyncIterable]) -> AsyncIterator[Dict[str, Any]]:
+    if hasattr(payloads, '__aiter__'):
+        async for payload in payloads:
+            yield payload
+    else:
+        for payload in payloads:
+            yield payload
+
+
+_DONE = object()
+
+
+class BulkSender:
+    """Sends many payloads through one WhatsAppClient"""
+
+    def __init__(self, client: Any, concurrency: int = None, max_attempts: int = None,
+                 base_delay: float = 1.0, max_delay: float = 30.0, max_buffered: int = None,
+                 bucket: TokenBucket = None):
+        self.client = client
+        self.concurrency = concurrency or int(os.environ.get('WHATSAPP_BULK_CONCURRENCY', '16'))
+        self.max_attempts = max_attempts or int(os.environ.get('WHATSAPP_BULK_MAX_ATTEMPTS', '5'))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Payloads read from the input but not yet finished, so huge inputs are streamed
+        self.max_buffered = max_buffered or self.concurrency * 8
+        self.bucket = bucket or get_phone_number_bucket(client.phone_number_id)
+
+    def _backoff(self, attempt: int, error_code: Optional[int]) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        if error_code == PAIR_RATE_LIMIT_CODE:
+            delay = max(delay, PAIR_RATE_LIMIT_DELAY * self.base_delay)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _send_one(self, index: int, payload: Dict[str, Any], slots: asyncio.Semaphore,
+                        idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        result = {'index': index, 'to': payload.get('to'), 'attempts': 0}
+
+        for attempt in range(1, self.max_attempts + 1):
+            result['attempts'] = attempt
+            await self.bucket.acquire()
+
+            try:
+                async with slots:
+                    response = await asyncio.to_thread(self.client._send_message, payload,
+                                                       idempotency_key=idempotency_key)
+            except requests.exceptions.HTTPError as e:
+                error_code = graph_error_code(e)
+                status_code = getattr(e.response, 'status_code', None)
+                rate_limited = error_code in RATE_LIMIT_ERROR_CODES or status_code == 429
+
+                if rate_limited and attempt < self.max_attempts:
+                    delay = self._backoff(attempt, error_code)
+                    if error_code in THROUGHPUT_ERROR_CODES or status_code == 429:
+                        self.bucket.pause(delay)
+                    metrics.add_metric(name="WhatsAppRateLimited", unit=MetricUnit.Count, value=1)
+                    logger.warning("WhatsApp rate limited, backing off",
+                                   error_code=error_code, attempt=attempt, delay=round(delay, 2))
+                    await asyncio.sleep(delay)
+                    continue
+
+                return {**result, 'status': 'failed', 'error_code': error_code, 'status_code': status_code,
+                        'error': str(e)}
+            except requests.exceptions.RequestException as e:
+                # Delivery is unknown after a connection error, so never resend blindly
+                return {**result, 'status': 'failed', 'error_code': None, 'error': str(e)}
+
+            return {**result, 'status': 'sent', 'message_id': response.get('messages', [{}])[0].get('id')}
+
+        return {**result, 'status': 'failed', 'error_code': None, 'error': 'max attempts exceeded'}
+
+    async def send(self, payloads: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+                   idempotency_keys: Callable[[int], Optional[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Send every payload; yields one result per payload as each finishes
+
+        payloads may be a plain or an async iterable. Either way it is consumed
+        lazily, at most max_buffered payloads ahead of the sends.
+        idempotency_keys maps a payload's index to its send ledger key, so a
+        payload already delivered under that key is not sent again.
+        """
+
+        results = asyncio.Queue()
+        slots = asyncio.Semaphore(self.concurrency)
+        window = asyncio.Semaphore(self.max_buffered)
+        pending: Dict[str, deque] = {}
+        workers = set()
+
+        async def drain(recipient: str):
+            # Messages to one recipient go out strictly one after another
+            queue = pending[recipient]
+            while queue:
+                index, payload = queue[0]
+                key = idempotency_keys(index) if idempotency_keys else None
+                result = await self._send_one(index, payload, slots, key)
+                queue.popleft()
+                window.release()
+                results.put_nowait(result)
+            del pending[recipient]
+
+        async def dispatch():
+            try:
+                index = 0
+                async for payload in _iterate(payloads):
+                    await window.acquire()
+                    recipient = payload.get('to')
+                    if recipient in pending:
+                        pending[recipient].append((index, payload))
+                    else:
+                        pending[recipient] = deque([(index, payload)])
+                        worker = asyncio.ensure_future(drain(recipient))
+                        workers.add(worker)
+                        worker.add_done_callback(workers.discard)
+                    index += 1
+
+                while workers:
+                    await asyncio.gather(*list(workers))
+            finally:
+                results.put_nowait(_DONE)
+
+        dispatcher = asyncio.ensure_future(dispatch())
+        sent = failed = 0
+        start_time = time.perf_counter()
+
+        try:
+            while True:
+                result = await results.get()
+                if result is _DONE:
+                    break
+                if result['status'] == 'sent':
+                    sent += 1
+                else:
+                    failed += 1
+                yield result
+
+            # Surface errors raised while reading the payloads
+            await dispatcher
+        finally:
+            dispatcher.cancel()
+            for worker in list(workers):
+                worker.cancel()
+
+            elapsed = time.perf_counter() - start_time
+            metrics.add_metric(name="WhatsAppBulkSent", unit=MetricUnit.Count, value=sent)
+            metrics.add_metric(name="WhatsAppBulkFailed", unit=MetricUnit.Count, value=failed)
+            logger.info("Bulk send finished",
+                        sent=sent,
+                        failed=failed,
+                        messages_per_second=round((sent + failed) / elapsed, 1) if elapsed else 0.0)
+
+
+# Export main classes
+__all__ = ['BulkSender', 'TokenBucket', 'get_phone_number_bucket', 'graph_error_code', 'RATE_LIMIT_ERROR_CODES']
@@ -0,0 +1,201 @@
+"""
+HTTP Transport for the WhatsApp Graph API
+Pooled keep-alive connections shared by every WhatsAppClient in the
+process, with separate connect and read timeouts and an optional HTTP/2
+transport. Connection setup, not payload size, dominates our short sends.
+"""
+
+import os
+import socket
+import threading
+from typing import Dict, Any, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+
+Timeout = Tuple[float, float]
+
+
+class GraphConnectError(requests.exceptions.ConnectionError):
+    """The connection could not be opened, so the request was never sent"""
+
+
+class GraphTransport:
+    """Interface: send one request and return a requests-compatible response"""
+
+    def request(self, method: str, url: str, headers: Dict[str, str] = None, json: Any = None,
+                read_timeout: float = None, stream: bool = False, data: Any = None, files: Any = None) -> Any:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(GraphTransport):
+    """requests-based HTTP/1.1 transport with one shared, thread-safe connection pool
+
+    Sessions are per thread (requests.Session is not guaranteed thread-safe),
+    but they all mount the same adapter, so connections are pooled process-wide.
+    """
+
+    def __init__(self, pool_connections: int = None, pool_maxsize: int = None,
+                 connect_timeout: float = None, read_timeout: float = None,
+                 verify: Union[bool, str] = True):
+        self.pool_connections = pool_connections or int(os.environ.get('WHATSAPP_HTTP_POOL_CONNECTIONS', '4'))
+        self.pool_maxsize = pool_maxsize or int(os.environ.get('WHATSAPP_HTTP_POOL_MAXSIZE', '32'))
+        self.connect_timeout = connect_timeout or float(os.environ.get('WHATSAPP_HTTP_CONNECT_TIMEOUT', '3.05'))
+        self.read_timeout = read_timeout or float(os.environ.get('WHATSAPP_HTTP_READ_TIMEOUT', '30'))
+        self.verify = verify
+
+        self.adapter = _KeepAliveAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0,  # retries are decided by the caller, per error code
+            pool_block=False
+        )
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            self._local.session = session
+        return session
+
+    def timeout(self, read_timeout: float = None) -> Timeout:
+        return (self.connect_timeout, read_timeout or self.read_timeout)
+
+    def request(self, method: str, url: str, headers: Dict[str, str] = None, json: Any = None,
+                read_timeout: float = None, stream: bool = False, data: Any = None, files: Any = None) -> requests.Response:
+        return self.session.request(
+            method,
+            url,
+            headers=headers,
+            json=json,
+            data=data,
+            files=files,
+            timeout=self.timeout(read_timeout),
+            stream=stream,
+            verify=self.verify  # explicit, so REQUESTS_CA_BUNDLE cannot override it
+        )
+
+    def close(self):
+        self.adapter.close()
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """Enables TCP keep-alive so idle pooled connections survive between warm invocations"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60))
+        kwargs['socket_options'] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class _HttpxResponse:
+    """Makes an httpx response look like the requests responses callers expect"""
+
+    def __init__(self, response: Any):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    @property
+    def content(self) -> bytes:
+        return self._response.read()
+
+    @property
+    def text(self) -> str:
+        return self._response.text
+
+    def json(self) -> Any:
+        return self._response.json()
+
+    def iter_content(self, chunk_size: int = 65536):
+        return self._response.iter_bytes(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            error = requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self._response.url}")
+            error.response = self
+            raise error
+
+
+class Http2Transport(GraphTransport):
+    """Multiplexes requests over HTTP/2 via httpx (requires the httpx[http2] extra)"""
+
+    def __init__(self, max_connections: int = None, connect_timeout: float = None, read_timeout: float = None,
+                 verify: Union[bool, str] = True):
+        import httpx
+
+        self._httpx = httpx
+        self.connect_timeout = connect_timeout or float(os.environ.get('WHATSAPP_HTTP_CONNECT_TIMEOUT', '3.05'))
+        self.read_timeout = read_timeout or float(os.environ.get('WHATSAPP_HTTP_READ_TIMEOUT', '30'))
+
+        # httpx.Client is thread-safe and shares its pool across threads
+        self.client = httpx.Client(
+            http2=True,
+            verify=verify,
+            limits=httpx.Limits(
+                max_connections=max_connections or int(os.environ.get('WHATSAPP_HTTP_POOL_MAXSIZE', '32')),
+                keepalive_expiry=60
+            )
+        )
+
+    def request(self, method: str, url: str, headers: Dict[str, str] = None, json: Any = None,
+                read_timeout: float = None, stream: bool = False, data: Any = None, files: Any = None) -> _HttpxResponse:
+        timeout = self._httpx.Timeout(read_timeout or self.read_timeout, connect=self.connect_timeout)
+        try:
+            request = self.client.build_request(method, url, headers=headers, json=json, data=data,
+                                                files=files, timeout=timeout)
+            return _HttpxResponse(self.client.send(request, stream=stream))
+        except self._httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(str(e)) from e
+        except self._httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except self._httpx.ConnectError as e:
+            raise GraphConnectError(str(e)) from e
+        except self._httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    def close(self):
+        self.client.close()
+
+
+_transport: Optional[GraphTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_graph_transport() -> GraphTransport:
+    """Process-wide transport, so warm invocations reuse open connections"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                if os.environ.get('WHATSAPP_HTTP2', 'false').lower() == 'true':
+                    try:
+                        _transport = Http2Transport()
+                    except ImportError:
+                        logger.warning("HTTP/2 requested but httpx[http2] is not installed, using HTTP/1.1")
+                if _transport is None:
+                    _transport = RequestsTransport()
+    return _transport
+
+
+# Export main classes
+__all__ = ['GraphTransport', 'RequestsTransport', 'Http2Transport', 'GraphConnectError', 'get_graph_transport']
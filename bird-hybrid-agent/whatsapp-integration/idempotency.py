@@ -0,0 +1,142 @@
+"""
+Idempotent Outbound Sends for WhatsApp
+Records each logical message, keyed by its stable message_id, in a
+short-lived DynamoDB ledger together with the WAMID Graph returned. A
+repeated send of the same key returns the recorded result instead of
+messaging the user twice, and retries are limited to failures where the
+request provably never reached Meta.
+"""
+
+import os
+import json
+import time
+from typing import Dict, Any, Optional
+
+import requests
+from botocore.exceptions import ClientError
+from urllib3.exceptions import NewConnectionError
+
+from graph_transport import GraphConnectError
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
+
+# Ledger states
+PENDING = 'pending'  # claimed, request not sent yet; free again once the lease runs out
+UNKNOWN = 'unknown'  # the request went out without a recorded outcome; never claimable again
+SENT = 'sent'
+
+
+class SendOutcomeUnknown(requests.exceptions.RequestException):
+    """An earlier attempt with this key may have been delivered, so it is not sent again"""
+
+
+def request_never_sent(error: requests.exceptions.RequestException) -> bool:
+    """True when the connection failed before any bytes of the request went out"""
+
+    if isinstance(error, (requests.exceptions.ConnectTimeout, GraphConnectError)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # requests wraps urllib3's MaxRetryError, whose reason is the original failure
+        reason = getattr(error.args[0], 'reason', error.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def request_rejected(error: requests.exceptions.RequestException) -> bool:
+    """True when Graph answered with a 4xx, so the message was definitely not accepted"""
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(error, requests.exceptions.HTTPError) and status_code is not None and status_code < 500
+
+
+class SendLedger:
+    """Outcome of recent sends by idempotency key"""
+
+    def __init__(self, dynamodb: Any, table_name: str = None, ttl_seconds: int = None,
+                 lease_seconds: int = None):
+        self.table = dynamodb.Table(
+            table_name or os.environ.get('WHATSAPP_SEND_LEDGER_TABLE', 'whatsapp-send-ledger')
+        )
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('WHATSAPP_SEND_LEDGER_TTL_SECONDS', str(24 * 3600)))
+        # How long a claim abandoned before its request went out blocks retries
+        self.lease_seconds = lease_seconds or int(os.environ.get('WHATSAPP_SEND_LEDGER_LEASE_SECONDS', '300'))
+
+    def claim(self, key: str) -> Optional[Dict[str, Any]]:
+        """None when the caller now owns the send; the recorded response if it already landed
+
+        Raises SendOutcomeUnknown while another attempt holds the key without
+        a recorded outcome. A claim whose request never went out (PENDING)
+        may be taken over once it is older than the lease; a key marked
+        UNKNOWN stays blocked until the ledger TTL, since it may have been
+        delivered.
+        """
+
+        now = int(time.time())
+        for _ in range(2):
+            try:
+                self.table.put_item(
+                    Item={'idempotency_key': key, 'status': PENDING, 'claimed_at': now,
+                          'ttl': now + self.ttl_seconds},
+                    # DynamoDB deletes expired items lazily, so expired claims count as free
+                    ConditionExpression='attribute_not_exists(idempotency_key) OR #ttl < :now '
+                                        'OR (#status = :pending AND claimed_at < :lease_start)',
+                    ExpressionAttributeNames={'#ttl': 'ttl', '#status': 'status'},
+                    ExpressionAttributeValues={':now': now, ':pending': PENDING,
+                                               ':lease_start': now - self.lease_seconds}
+                )
+                return None
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+
+            item = self.table.get_item(Key={'idempotency_key': key}, ConsistentRead=True).get('Item')
+            if item is None:
+                continue  # released in between; claim again
+            if item['status'] == SENT:
+                metrics.add_metric(name="WhatsAppDuplicateSendAvoided", unit=MetricUnit.Count, value=1)
+                return json.loads(item['response'])
+            break
+
+        raise SendOutcomeUnknown(f"Message {key} was already attempted and its outcome is unknown")
+
+    def mark_sending(self, key: str):
+        """Mark a claim as sent out just before the request, so it is no longer leased
+
+        Raises SendOutcomeUnknown if the claim was taken over in the meantime.
+        """
+        try:
+            self.table.update_item(
+                Key={'idempotency_key': key},
+                UpdateExpression='SET #status = :unknown',
+                ConditionExpression='#status = :pending',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':unknown': UNKNOWN, ':pending': PENDING}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            raise SendOutcomeUnknown(f"Message {key} was claimed by another attempt")
+
+    def record(self, key: str, response: Dict[str, Any]):
+        now = int(time.time())
+        self.table.put_item(Item={
+            'idempotency_key': key,
+            'status': SENT,
+            'wamid': response.get('messages', [{}])[0].get('id'),
+            'response': json.dumps(response),
+            'sent_at': now,
+            'ttl': now + self.ttl_seconds
+        })
+
+    def release(self, key: str):
+        """Forget a claim whose send definitely failed, so the key can be sent again"""
+        self.table.delete_item(Key={'idempotency_key': key})
+
+
+# Export main classes
+__all__ = ['SendLedger', 'SendOutcomeUnknown', 'request_never_sent', 'request_rejected']
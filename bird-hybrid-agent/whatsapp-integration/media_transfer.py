@@ -0,0 +1,117 @@
+"""
+Streaming Media Transfer for WhatsApp
+Pipes a Graph API media download straight into an S3 multipart upload in
+fixed-size parts, hashing as it goes, so only a couple of parts are ever in
+memory regardless of the file size.
+"""
+
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Any, Iterable
+
+from botocore.exceptions import ClientError
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+
+# S3 rejects multipart parts below 5 MiB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Size of the reads from the HTTP response
+READ_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class MediaTransferResult:
+    """Where a media file ended up, and what was written"""
+    media_id: str
+    s3_uri: str
+    size: int
+    sha256: str
+    content_type: str
+    parts: int
+    seconds: float
+
+
+class S3StreamUploader:
+    """Uploads a stream of byte chunks to one S3 object in fixed-size parts
+
+    Parts are uploaded on a small thread pool while the next part is being
+    read, at most max_in_flight at a time. Objects smaller than one part
+    skip multipart entirely and are written with a single put_object.
+    """
+
+    def __init__(self, s3_client: Any, part_size: int = None, max_in_flight: int = None):
+        self.s3_client = s3_client
+        self.part_size = max(MIN_PART_SIZE, part_size or int(os.environ.get('WHATSAPP_MEDIA_PART_SIZE', str(8 * 1024 * 1024))))
+        self.max_in_flight = max_in_flight or int(os.environ.get('WHATSAPP_MEDIA_UPLOADS_IN_FLIGHT', '2'))
+
+    def upload(self, chunks: Iterable[bytes], bucket: str, key: str, content_type: str) -> Dict[str, Any]:
+        """Returns size, sha256 and part count of the uploaded object"""
+
+        digest = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        upload_id = None
+        in_flight = []
+        parts: List[Dict[str, Any]] = []
+
+        def upload_part(part_number: int, body: bytearray) -> Dict[str, Any]:
+            response = self.s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                  PartNumber=part_number, Body=body)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            try:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    digest.update(chunk)
+                    size += len(chunk)
+                    buffer += chunk
+
+                    if len(buffer) >= self.part_size:
+                        if upload_id is None:
+                            upload_id = self.s3_client.create_multipart_upload(
+                                Bucket=bucket, Key=key, ContentType=content_type)['UploadId']
+                        # Backpressure: stop reading until the oldest part is uploaded
+                        if len(in_flight) >= self.max_in_flight:
+                            parts.append(in_flight.pop(0).result())
+                        # Hand the filled buffer over as the part; only the small overflow is copied
+                        part, buffer = buffer, buffer[self.part_size:]
+                        del part[self.part_size:]
+                        in_flight.append(pool.submit(upload_part, len(parts) + len(in_flight) + 1, part))
+
+                if upload_id is None:
+                    self.s3_client.put_object(Bucket=bucket, Key=key, Body=bytes(buffer), ContentType=content_type)
+                    return {'size': size, 'sha256': digest.hexdigest(), 'parts': 1}
+
+                if buffer:
+                    in_flight.append(pool.submit(upload_part, len(parts) + len(in_flight) + 1, buffer))
+                    buffer = bytearray()
+                parts.extend(future.result() for future in in_flight)
+                in_flight = []
+
+                self.s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                         MultipartUpload={'Parts': parts})
+                return {'size': size, 'sha256': digest.hexdigest(), 'parts': len(parts)}
+
+            except BaseException:
+                for future in in_flight:
+                    future.cancel()
+                if upload_id is not None:
+                    # Incomplete uploads are billed until aborted
+                    try:
+                        self.s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+                    except ClientError as e:
+                        logger.warning(f"Failed to abort multipart upload: {str(e)}", key=key)
+                raise
+
+
+# Export main classes
+__all__ = ['S3StreamUploader', 'MediaTransferResult', 'MIN_PART_SIZE', 'READ_CHUNK_SIZE']
@@ -0,0 +1,242 @@
+"""
+Outbound Media ID Cache for WhatsApp
+Uploads frequently sent assets (brochure PDFs, property photos) to the
+Graph /media endpoint once and reuses the returned media ID, so Meta stops
+fetching the same file from our origin for every recipient. IDs are kept in
+an in-memory LRU backed by DynamoDB and re-uploaded when they expire.
+Only assets on allow-listed hosts, or sent repeatedly, are uploaded; a
+one-off link is cheaper to send as a link.
+"""
+
+import os
+import time
+import uuid
+import zlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Iterator, Iterable
+from urllib.parse import urlparse, urlunparse
+
+import requests
+from botocore.exceptions import ClientError
+
+from media_transfer import READ_CHUNK_SIZE
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
+
+# Uploaded media IDs are valid for 30 days; refresh a day early so none expire mid-broadcast
+MEDIA_ID_LIFETIME_SECONDS = 30 * 24 * 3600
+MEDIA_ID_REFRESH_MARGIN_SECONDS = 24 * 3600
+
+# Graph errors returned when a media ID is unknown or expired; the message was not sent
+MEDIA_ID_ERROR_CODES = {100, 131053}
+
+# Concurrent uploads of one asset share a lock; a fixed set of stripes keeps the lock count bounded
+UPLOAD_LOCK_STRIPES = 64
+
+
+def asset_key(url: str) -> str:
+    """Cache key for an asset: its URL without query string or fragment
+
+    Presigned and tracking URLs of the same file differ only in the query,
+    so they share one upload.
+    """
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
+
+
+class _MultipartUpload:
+    """multipart/form-data body for /media that streams the file part from the open asset response"""
+
+    def __init__(self, fields: Dict[str, str], filename: str, mime_type: str,
+                 asset: requests.Response, length: int):
+        boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        filename = filename.replace('"', '%22')
+        head = ''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                       for name, value in fields.items())
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: {mime_type}\r\n\r\n')
+        self.head = head.encode('utf-8')
+        self.tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        self.asset = asset
+        self.length = length
+
+    def __len__(self) -> int:
+        return len(self.head) + self.length + len(self.tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self.head
+        yield from self.asset.iter_content(READ_CHUNK_SIZE)
+        yield self.tail
+
+
+class MediaUploadManager:
+    """Maps asset URLs to uploaded WhatsApp media IDs
+
+    Assets on WHATSAPP_MEDIA_UPLOAD_HOSTS are uploaded on first use. Any
+    other asset is sent by link until it has been sent
+    WHATSAPP_MEDIA_UPLOAD_AFTER_SENDS times in this process, so one-off
+    links never pay for an upload.
+    """
+
+    def __init__(self, client: Any, table_name: str = None, capacity: int = None,
+                 upload_hosts: Iterable[str] = None, upload_after_sends: int = None):
+        self.client = client
+        self.table = client.dynamodb.Table(
+            table_name or os.environ.get('WHATSAPP_MEDIA_CACHE_TABLE', 'whatsapp-media-cache')
+        )
+        self.capacity = capacity or int(os.environ.get('WHATSAPP_MEDIA_ID_CACHE_SIZE', '256'))
+        if upload_hosts is None:
+            upload_hosts = os.environ.get('WHATSAPP_MEDIA_UPLOAD_HOSTS', '').split(',')
+        self.upload_hosts = {host.strip().lower() for host in upload_hosts if host.strip()}
+        self.upload_after_sends = upload_after_sends or int(os.environ.get('WHATSAPP_MEDIA_UPLOAD_AFTER_SENDS', '2'))
+        self._entries: 'OrderedDict[str, Tuple[str, int]]' = OrderedDict()  # key -> (media_id, expires_at)
+        self._sends: 'OrderedDict[str, int]' = OrderedDict()  # key -> link sends so far, for repeat detection
+        self._lock = threading.Lock()
+        self._upload_locks = [threading.Lock() for _ in range(UPLOAD_LOCK_STRIPES)]
+
+    def _upload_lock(self, key: str) -> threading.Lock:
+        return self._upload_locks[zlib.crc32(key.encode('utf-8')) % UPLOAD_LOCK_STRIPES]
+
+    def _remember(self, key: str, media_id: str, expires_at: int):
+        with self._lock:
+            self._entries[key] = (media_id, expires_at)
+            self._entries.move_to_end(key)
+            self._sends.pop(key, None)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def _cached(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] - MEDIA_ID_REFRESH_MARGIN_SECONDS > now:
+                self._entries.move_to_end(key)
+                return entry[0]
+        return None
+
+    def _worth_uploading(self, url: str, key: str) -> bool:
+        """Allow-listed host, or an asset sent often enough to be a repeat"""
+        if (urlparse(url).hostname or '').lower() in self.upload_hosts:
+            return True
+        with self._lock:
+            if key in self._entries:  # uploaded before; its media ID is only due for renewal
+                return True
+            sends = self._sends.pop(key, 0) + 1
+            self._sends[key] = sends
+            if len(self._sends) > self.capacity:
+                self._sends.popitem(last=False)
+        return sends >= self.upload_after_sends
+
+    def get_media_id(self, url: str, media_type: str) -> Optional[str]:
+        """Media ID for an asset, uploading it when worthwhile or after expiry; None to send by link"""
+
+        key = asset_key(url)
+        media_id = self._cached(key)
+        if media_id:
+            metrics.add_metric(name="WhatsAppMediaIdCacheHit", unit=MetricUnit.Count, value=1)
+            return media_id
+
+        if not self._worth_uploading(url, key):
+            return None
+
+        # One upload per asset even when many sends ask for it at once
+        with self._upload_lock(key):
+            media_id = self._cached(key) or self._load(key)
+            if media_id:
+                metrics.add_metric(name="WhatsAppMediaIdCacheHit", unit=MetricUnit.Count, value=1)
+                return media_id
+
+            metrics.add_metric(name="WhatsAppMediaIdCacheMiss", unit=MetricUnit.Count, value=1)
+            try:
+                return self._upload(url, key, media_type)
+            except (requests.exceptions.RequestException, ClientError, KeyError, ValueError) as e:
+                logger.warning(f"Media upload failed, sending by link: {str(e)}", url=url)
+                return None
+
+    def _load(self, key: str) -> Optional[str]:
+        try:
+            item = self.table.get_item(Key={'asset_url': key}).get('Item')
+        except ClientError as e:
+            logger.warning(f"Failed to read media ID cache: {str(e)}")
+            return None
+
+        if not item or int(item['expires_at']) - MEDIA_ID_REFRESH_MARGIN_SECONDS <= time.time():
+            return None
+
+        self._remember(key, item['media_id'], int(item['expires_at']))
+        return item['media_id']
+
+    def _post_media(self, url: str, media_type: str) -> requests.Response:
+        """Pipe the asset from our origin into /media without holding the whole file"""
+
+        asset = self.client.transport.request('GET', url, read_timeout=60, stream=True)
+        try:
+            asset.raise_for_status()
+            mime_type = asset.headers.get('content-type', '').split(';')[0].strip() \
+                or self.client._get_content_type(media_type)
+            filename = os.path.basename(urlparse(url).path) or f"asset.{self.client._get_file_extension(media_type)}"
+            fields = {'messaging_product': 'whatsapp', 'type': mime_type}
+            media_url = f"{self.client.base_url}/{self.client.phone_number_id}/media"
+            # multipart/form-data, so the JSON Content-Type header must not be sent
+            headers = {'Authorization': self.client.headers['Authorization']}
+
+            length = asset.headers.get('content-length')
+            if length is None or asset.headers.get('content-encoding'):
+                # Without the exact byte count the body cannot be streamed with a Content-Length
+                return self.client.transport.request('POST', media_url, headers=headers, data=fields,
+                                                     files={'file': (filename, asset.content, mime_type)},
+                                                     read_timeout=60)
+
+            body = _MultipartUpload(fields, filename, mime_type, asset, int(length))
+            headers.update({'Content-Type': body.content_type, 'Content-Length': str(len(body))})
+            return self.client.transport.request('POST', media_url, headers=headers, data=body, read_timeout=60)
+        finally:
+            asset.close()
+
+    def _upload(self, url: str, key: str, media_type: str) -> str:
+        start_time = time.time()
+
+        response = self._post_media(url, media_type)
+        response.raise_for_status()
+        media_id = response.json()['id']
+
+        expires_at = int(start_time) + MEDIA_ID_LIFETIME_SECONDS
+        self._remember(key, media_id, expires_at)
+        try:
+            self.table.put_item(Item={
+                'asset_url': key,
+                'media_id': media_id,
+                'media_type': media_type,
+                'expires_at': expires_at,
+                'ttl': expires_at
+            })
+        except ClientError as e:
+            logger.warning(f"Failed to persist media ID: {str(e)}")
+
+        metrics.add_metric(name="WhatsAppMediaUploaded", unit=MetricUnit.Count, value=1)
+        metrics.add_metric(name="WhatsAppMediaUploadLatency", unit=MetricUnit.Milliseconds,
+                           value=int((time.time() - start_time) * 1000))
+        logger.info("Uploaded media for reuse", url=url, media_id=media_id)
+        return media_id
+
+    def invalidate(self, url: str):
+        """Forget an asset's media ID, e.g. when Graph rejects it or the file changed"""
+        key = asset_key(url)
+        with self._lock:
+            self._entries.pop(key, None)
+        try:
+            self.table.delete_item(Key={'asset_url': key})
+        except ClientError as e:
+            logger.warning(f"Failed to delete media ID: {str(e)}")
+
+
+# Export main classes
+__all__ = ['MediaUploadManager', 'MEDIA_ID_ERROR_CODES', 'asset_key']
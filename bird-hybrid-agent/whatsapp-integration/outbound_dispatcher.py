@@ -0,0 +1,313 @@
+"""
+Priority Outbound Dispatcher for WhatsApp
+Queues outbound messages by class (emergency, transactional, conversational,
+marketing) and sends them from a small worker pool with weighted fair
+share between classes, so a marketing broadcast cannot starve maintenance
+confirmations. Each recipient has at most one message in flight, and
+messages of one class reach a recipient in the order they were queued.
+"""
+
+import os
+import time
+import heapq
+import random
+import threading
+import itertools
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Deque, Tuple, List
+
+import requests
+
+from bulk_sender import (TokenBucket, get_phone_number_bucket, graph_error_code,
+                         PAIR_RATE_LIMIT_CODE, PAIR_RATE_LIMIT_DELAY, RATE_LIMIT_ERROR_CODES)
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
+
+# Highest priority first; ties in the fair-share schedule go to the earlier class
+PRIORITY_CLASSES = ('emergency', 'transactional', 'conversational', 'marketing')
+
+# Relative share of sends each class gets while several are backlogged
+DEFAULT_WEIGHTS = {'emergency': 16, 'transactional': 8, 'conversational': 4, 'marketing': 1}
+
+
+class DispatchQueueFull(Exception):
+    """Raised when a priority class stays at its queue limit for the whole submit timeout"""
+
+
+def parse_weights(spec: str) -> Dict[str, int]:
+    """'emergency=16,marketing=1' -> weights, unspecified classes keep their default"""
+    weights = dict(DEFAULT_WEIGHTS)
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = entry.partition('=')
+        if name.strip() not in weights:
+            raise ValueError(f"Unknown priority class: {name.strip()}")
+        weights[name.strip()] = max(1, int(value))
+    return weights
+
+
+@dataclass(slots=True)
+class _PriorityClass:
+    name: str
+    weight: int
+    max_queued: int
+    queues: Dict[str, Deque[Tuple[Future, Dict[str, Any], float, int]]] = field(default_factory=dict)
+    ready: Deque[str] = field(default_factory=deque)  # recipients with queued messages, oldest first
+    pass_value: float = 0.0  # stride scheduling position; lowest goes next
+    depth: int = 0
+    dispatched: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class OutboundDispatcher:
+    """Sends queued payloads through one WhatsAppClient by priority class
+
+    submit() returns a Future for the Graph response. Sends are paced by the
+    phone number's shared token bucket; while it is saturated the queues
+    grow, and submit() blocks once a class holds max_queued messages, which
+    pushes back on whoever is producing them. Each class has its own limit,
+    so a full marketing queue never blocks an emergency.
+
+    A class that was idle re-enters the schedule at the current position
+    instead of its old one, so an urgent message waits at most for a free
+    worker and a token, not behind the backlog of a running broadcast.
+    Workers never sleep through a backoff: a rate-limited message is set
+    aside until its retry time and then rejoins the front of its
+    recipient's queue, and while the token bucket is empty workers wait
+    for the next token before choosing a message, so that token goes to
+    the highest-priority message queued by then.
+    """
+
+    def __init__(self, client: Any, workers: int = None, weights: Dict[str, int] = None,
+                 max_queued: int = None, max_attempts: int = None, bucket: TokenBucket = None,
+                 base_delay: float = 1.0, max_delay: float = 30.0):
+        self.client = client
+        self.workers = workers or int(os.environ.get('WHATSAPP_DISPATCH_WORKERS', '8'))
+        weights = weights or parse_weights(os.environ.get('WHATSAPP_DISPATCH_WEIGHTS', ''))
+        max_queued = max_queued or int(os.environ.get('WHATSAPP_DISPATCH_MAX_QUEUED', '1000'))
+        self.max_attempts = max_attempts or int(os.environ.get('WHATSAPP_BULK_MAX_ATTEMPTS', '5'))
+        self.bucket = bucket or get_phone_number_bucket(client.phone_number_id)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._classes = {name: _PriorityClass(name, weights[name], max_queued) for name in PRIORITY_CLASSES}
+        self._busy = set()  # recipients with a message in flight or backing off
+        self._deferred: List[Tuple[float, int, _PriorityClass, str, Tuple]] = []  # heap by retry time
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def submit(self, payload: Dict[str, Any], priority: str = 'conversational', timeout: float = None) -> Future:
+        """Queue a prebuilt payload; blocks while its class is full"""
+
+        priority_class = self._classes.get(priority)
+        if priority_class is None:
+            raise ValueError(f"Unknown priority class: {priority}")
+        recipient = payload.get('to')
+
+        future = Future()
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self._closed or priority_class.depth < priority_class.max_queued, timeout):
+                raise DispatchQueueFull(f"{priority} queue is full ({priority_class.max_queued} messages)")
+            if self._closed:
+                raise RuntimeError("Dispatcher is closed")
+
+            if priority_class.depth == 0:
+                # Idle classes rejoin at the current position rather than cashing in old credit
+                priority_class.pass_value = max(priority_class.pass_value, self._virtual_time)
+
+            queue = priority_class.queues.get(recipient)
+            if queue is None:
+                queue = priority_class.queues[recipient] = deque()
+                priority_class.ready.append(recipient)
+            queue.append((future, payload, time.monotonic(), 1))
+            priority_class.depth += 1
+
+            self._start_workers()
+            self._condition.notify_all()
+
+        return future
+
+    def send(self, payload: Dict[str, Any], priority: str = 'conversational', timeout: float = None) -> Dict[str, Any]:
+        """Queue a payload and wait for its Graph response"""
+        return self.submit(payload, priority, timeout).result()
+
+    def _start_workers(self):
+        # Caller holds the lock
+        if self._threads:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'whatsapp-dispatch-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _defer(self, priority_class: _PriorityClass, recipient: str, entry: Tuple, delay: float):
+        """Set a message aside until its retry time; the recipient stays busy, so nothing overtakes it"""
+        with self._condition:
+            heapq.heappush(self._deferred,
+                           (time.monotonic() + delay, next(self._sequence), priority_class, recipient, entry))
+            self._condition.notify_all()
+
+    def _release_due(self) -> Optional[float]:
+        """Requeue deferred messages whose time has come; seconds until the next one. Caller holds the lock"""
+
+        now = time.monotonic()
+        while self._deferred and self._deferred[0][0] <= now:
+            _, _, priority_class, recipient, entry = heapq.heappop(self._deferred)
+            self._busy.discard(recipient)
+            if priority_class.depth == 0:
+                priority_class.pass_value = max(priority_class.pass_value, self._virtual_time)
+
+            queue = priority_class.queues.get(recipient)
+            if queue is None:
+                queue = priority_class.queues[recipient] = deque()
+                priority_class.ready.appendleft(recipient)
+            queue.appendleft(entry)
+            priority_class.depth += 1
+
+        return self._deferred[0][0] - now if self._deferred else None
+
+    def _next(self) -> Optional[Tuple[_PriorityClass, str, Future, Dict[str, Any], float, int]]:
+        """Take the next sendable message; caller holds the lock"""
+
+        for priority_class in sorted(self._classes.values(), key=lambda cls: cls.pass_value):
+            # Skip recipients that already have a message in flight; their next message waits for it
+            for _ in range(len(priority_class.ready)):
+                recipient = priority_class.ready[0]
+                if recipient not in self._busy:
+                    break
+                priority_class.ready.rotate(-1)
+            else:
+                continue
+
+            priority_class.ready.popleft()
+            queue = priority_class.queues[recipient]
+            future, payload, enqueued_at, attempt = queue.popleft()
+            if queue:
+                priority_class.ready.append(recipient)
+            else:
+                del priority_class.queues[recipient]
+
+            priority_class.depth -= 1
+            self._virtual_time = priority_class.pass_value
+            priority_class.pass_value += 1.0 / priority_class.weight
+            self._busy.add(recipient)
+            return priority_class, recipient, future, payload, enqueued_at, attempt
+
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                picked = None
+                while picked is None:
+                    next_release = self._release_due()
+                    queued = any(cls.depth for cls in self._classes.values())
+                    # Choose only once a token is free, so it goes to whatever is most urgent by then
+                    token_wait = self.bucket.wait_time() if queued else 0.0
+                    if not token_wait:
+                        picked = self._next()
+                    if picked is None:
+                        if self._closed and not queued and next_release is None:
+                            return
+                        timeouts = [wait for wait in (token_wait, next_release) if wait]
+                        self._condition.wait(min(timeouts) if timeouts else None)
+                # A slot opened up in this class
+                self._condition.notify_all()
+
+            priority_class, recipient, future, payload, enqueued_at, attempt = picked
+            deferred = False
+            try:
+                if attempt > 1 or future.set_running_or_notify_cancel():
+                    if attempt == 1:
+                        self._record_wait(priority_class, time.monotonic() - enqueued_at)
+                    try:
+                        future.set_result(self._deliver(payload))
+                    except requests.exceptions.HTTPError as e:
+                        delay = self._backoff(e, attempt)
+                        if delay is None:
+                            future.set_exception(e)
+                        else:
+                            self._defer(priority_class, recipient, (future, payload, enqueued_at, attempt + 1), delay)
+                            deferred = True
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                if not deferred:
+                    with self._condition:
+                        self._busy.discard(recipient)
+                        self._condition.notify_all()
+
+    def _record_wait(self, priority_class: _PriorityClass, wait: float):
+        with self._condition:
+            priority_class.dispatched += 1
+            priority_class.total_wait += wait
+            priority_class.max_wait = max(priority_class.max_wait, wait)
+            depth = priority_class.depth
+
+        name = priority_class.name.capitalize()
+        metrics.add_metric(name=f"WhatsAppDispatch{name}Wait", unit=MetricUnit.Milliseconds, value=int(wait * 1000))
+        metrics.add_metric(name=f"WhatsAppDispatch{name}QueueDepth", unit=MetricUnit.Count, value=depth)
+
+    def _deliver(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # Workers only pick a message once a token is free, so this wait is at most a few token intervals
+        delay = self.bucket.reserve()
+        if delay:
+            time.sleep(delay)
+        return self.client._send_message(payload)
+
+    def _backoff(self, error: requests.exceptions.HTTPError, attempt: int) -> Optional[float]:
+        """Seconds until a rate-limited message may be retried; None when it should fail instead"""
+
+        error_code = graph_error_code(error)
+        status_code = getattr(error.response, 'status_code', None)
+        if not (error_code in RATE_LIMIT_ERROR_CODES or status_code == 429) or attempt >= self.max_attempts:
+            return None
+
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        if error_code == PAIR_RATE_LIMIT_CODE:
+            delay = max(delay, PAIR_RATE_LIMIT_DELAY * self.base_delay)
+        else:
+            self.bucket.pause(delay)
+        delay *= random.uniform(0.8, 1.2)
+        metrics.add_metric(name="WhatsAppRateLimited", unit=MetricUnit.Count, value=1)
+        logger.warning("WhatsApp rate limited, backing off",
+                       error_code=error_code, attempt=attempt, delay=round(delay, 2))
+        return delay
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Queue depth and wait times per priority class"""
+        with self._condition:
+            return {
+                cls.name: {
+                    'queued': cls.depth,
+                    'dispatched': cls.dispatched,
+                    'average_wait_ms': int(cls.total_wait / cls.dispatched * 1000) if cls.dispatched else 0,
+                    'max_wait_ms': int(cls.max_wait * 1000)
+                }
+                for cls in self._classes.values()
+            }
+
+    def close(self, wait: bool = True):
+        """Stop accepting messages; with wait, send everything already queued first"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+# Export main classes
+__all__ = ['OutboundDispatcher', 'DispatchQueueFull', 'PRIORITY_CLASSES', 'DEFAULT_WEIGHTS']
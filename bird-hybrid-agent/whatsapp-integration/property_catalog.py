@@ -0,0 +1,236 @@
+"""
+Property Catalog Index for WhatsApp Leasing Conversations
+Keeps the property catalog in memory as bitmaps so filtered, price-ranked
+lookups ("<= 25k MXN, pet friendly, near Reforma") cost a few integer ANDs
+instead of a pass over every property dict. Bit i of every bitmap is the
+i-th cheapest property, so a price range is one mask and matches come out
+already sorted by price.
+"""
+
+import os
+import time
+import bisect
+import threading
+import unicodedata
+from decimal import Decimal
+from typing import Dict, List, Any, Optional, Iterable
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
+
+
+def normalize(term: str) -> str:
+    """Case- and accent-insensitive key, so 'Juárez' and 'juarez' match"""
+    folded = unicodedata.normalize('NFKD', str(term).strip().lower())
+    return ''.join(char for char in folded if not unicodedata.combining(char))
+
+
+def _from_dynamodb(value: Any) -> Any:
+    """DynamoDB Decimals as int when integral (prices, ids), float otherwise"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, list):
+        return [_from_dynamodb(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _from_dynamodb(item) for key, item in value.items()}
+    return value
+
+
+def _bits(mask: int) -> Iterable[int]:
+    """Positions of the set bits, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class PropertyCatalog:
+    """In-memory index over property dicts
+
+    Properties need id, name, price and location. Optional fields are
+    'nearby' (landmarks and neighbourhoods that also match a location
+    query), 'amenities', 'pet_friendly' and 'available' (default True).
+
+    upsert() and remove() only touch the changed properties; the bitmaps
+    are rebuilt once, on the next search after a batch of changes.
+    """
+
+    def __init__(self, properties: Iterable[Dict[str, Any]] = ()):
+        self._properties: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = True
+
+        # Index state, replaced as a whole on rebuild
+        self._ranked: List[Dict[str, Any]] = []
+        self._prices: List[float] = []
+        self._all = 0
+        self._available = 0
+        self._pet_friendly = 0
+        self._locations: Dict[str, int] = {}
+        self._amenities: Dict[str, int] = {}
+
+        self.upsert(properties)
+
+    def __len__(self) -> int:
+        return len(self._properties)
+
+    def upsert(self, properties: Iterable[Dict[str, Any]]):
+        with self._lock:
+            for prop in properties:
+                self._properties[str(prop['id'])] = prop
+                self._dirty = True
+
+    def remove(self, property_ids: Iterable[str]):
+        with self._lock:
+            for property_id in property_ids:
+                if self._properties.pop(str(property_id), None) is not None:
+                    self._dirty = True
+
+    def _rebuild(self):
+        # Caller holds the lock
+        ranked = sorted(self._properties.values(), key=lambda prop: (float(prop['price']), str(prop['id'])))
+        available = pet_friendly = 0
+        locations: Dict[str, int] = {}
+        amenities: Dict[str, int] = {}
+
+        for rank, prop in enumerate(ranked):
+            bit = 1 << rank
+            if prop.get('available', True):
+                available |= bit
+            if prop.get('pet_friendly'):
+                pet_friendly |= bit
+            for place in [prop['location'], *prop.get('nearby', ())]:
+                key = normalize(place)
+                locations[key] = locations.get(key, 0) | bit
+            for amenity in prop.get('amenities', ()):
+                key = normalize(amenity)
+                amenities[key] = amenities.get(key, 0) | bit
+
+        self._ranked = ranked
+        self._prices = [float(prop['price']) for prop in ranked]
+        self._all = (1 << len(ranked)) - 1
+        self._available = available
+        self._pet_friendly = pet_friendly
+        self._locations = locations
+        self._amenities = amenities
+        self._dirty = False
+
+    def search(self, max_price: float = None, min_price: float = None, location: str = None,
+               amenities: Iterable[str] = (), pet_friendly: bool = None, available_only: bool = True,
+               descending: bool = False) -> List[Dict[str, Any]]:
+        """Matching properties, cheapest first unless descending"""
+
+        with self._lock:
+            if self._dirty:
+                self._rebuild()
+            prices, ranked = self._prices, self._ranked
+
+            mask = self._available if available_only else self._all
+            if pet_friendly is not None:
+                mask &= self._pet_friendly if pet_friendly else ~self._pet_friendly
+            if location:
+                mask &= self._locations.get(normalize(location), 0)
+            for amenity in amenities:
+                mask &= self._amenities.get(normalize(amenity), 0)
+
+        if min_price is not None or max_price is not None:
+            low = bisect.bisect_left(prices, min_price) if min_price is not None else 0
+            high = bisect.bisect_right(prices, max_price) if max_price is not None else len(prices)
+            mask &= ((1 << high) - 1) ^ ((1 << low) - 1)
+
+        matches = [ranked[rank] for rank in _bits(mask & ((1 << len(ranked)) - 1))]
+        return matches[::-1] if descending else matches
+
+
+# Partition key value of every item in the properties table's updated_at index
+CATALOG_PARTITION = 'properties'
+
+
+class DynamoDBPropertyCatalog(PropertyCatalog):
+    """Catalog loaded from the properties table and refreshed with only the items changed since
+
+    Items carry an 'updated_at' epoch and catalog = CATALOG_PARTITION, the
+    keys of the table's updated_at index, so a refresh is one Query that
+    reads only changed items. Removed properties stay in the table with
+    'deleted' set so refreshes can see them.
+    """
+
+    def __init__(self, table_name: str = None, refresh_seconds: float = None, index_name: str = None):
+        super().__init__()
+        self.table = boto3.resource('dynamodb').Table(
+            table_name or os.environ.get('WHATSAPP_PROPERTY_TABLE', 'urbanhub-properties')
+        )
+        self.index_name = index_name or os.environ.get('WHATSAPP_PROPERTY_UPDATED_INDEX', 'updated_at-index')
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None \
+            else float(os.environ.get('WHATSAPP_CATALOG_REFRESH_SECONDS', '300'))
+        self._synced_at: Optional[int] = None  # updated_at high-water mark
+        self._checked_at = 0.0
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """Apply changes since the last refresh (everything on the first call)"""
+
+        with self._refresh_lock:
+            # Overlap by a second so items written during the last refresh are not missed
+            since = self._synced_at - 1 if self._synced_at is not None else 0
+            kwargs = {
+                'IndexName': self.index_name,
+                'KeyConditionExpression': Key('catalog').eq(CATALOG_PARTITION) & Key('updated_at').gte(since)
+            }
+
+            changed, removed = [], []
+            synced_at = self._synced_at or 0
+            while True:
+                page = self.table.query(**kwargs)
+                for item in page.get('Items', []):
+                    synced_at = max(synced_at, int(item.get('updated_at', 0)))
+                    if item.get('deleted'):
+                        removed.append(item['id'])
+                    else:
+                        changed.append(_from_dynamodb(item))
+                if 'LastEvaluatedKey' not in page:
+                    break
+                kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+            self.upsert(changed)
+            self.remove(removed)
+            self._synced_at = synced_at
+            self._checked_at = time.monotonic()
+
+        metrics.add_metric(name="WhatsAppCatalogRefreshed", unit=MetricUnit.Count, value=len(changed) + len(removed))
+
+    def search(self, *args, **kwargs) -> List[Dict[str, Any]]:
+        if self._synced_at is None or time.monotonic() - self._checked_at >= self.refresh_seconds:
+            try:
+                self.refresh()
+            except ClientError as e:
+                # Serve the catalog we have; try again on the next search
+                logger.warning(f"Failed to refresh property catalog: {str(e)}")
+        return super().search(*args, **kwargs)
+
+
+_catalog: Optional[PropertyCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_property_catalog() -> PropertyCatalog:
+    """Process-wide catalog, loaded on first use and kept fresh by its searches"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = DynamoDBPropertyCatalog()
+    return _catalog
+
+
+# Export main classes
+__all__ = ['PropertyCatalog', 'DynamoDBPropertyCatalog', 'get_property_catalog', 'normalize', 'CATALOG_PARTITION']
@@ -0,0 +1,121 @@
+"""
+Background Read Receipts for WhatsApp
+Takes read receipts off the inbound path: receipts are queued per
+conversation and a background thread sends them on the pooled transport.
+Marking a message read implicitly marks everything before it, so only the
+newest queued message of each conversation is sent.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple, Union
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
+
+# Conversations whose last marked message is remembered, to drop late receipts
+MARKED_CAPACITY = 10000
+
+
+class ReadReceiptSender:
+    """Coalesces read receipts per conversation and sends them in the background
+
+    submit() never blocks on Meta. Receipts older than max_age when their
+    turn comes, or older than a receipt already sent for the conversation,
+    are dropped: the user has either moved on or they are already covered.
+    In Lambda, call flush() before returning so the frozen container does
+    not hold receipts until the next invocation.
+    """
+
+    def __init__(self, client: Any, max_age: float = None, workers: int = None):
+        self.client = client
+        self.max_age = max_age or float(os.environ.get('WHATSAPP_READ_RECEIPT_MAX_AGE_SECONDS', '60'))
+        self.workers = workers or int(os.environ.get('WHATSAPP_READ_RECEIPT_WORKERS', '4'))
+        self._pending: Dict[str, Tuple[str, float]] = {}  # conversation -> (message_id, received_at)
+        self._marked: 'OrderedDict[str, float]' = OrderedDict()  # conversation -> received_at last sent
+        self._sending = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def submit(self, conversation_id: str, message_id: str, received_at: Union[float, str] = None):
+        """Queue a receipt; received_at is the webhook's message timestamp (epoch seconds)"""
+
+        received_at = float(received_at) if received_at is not None else time.time()
+        with self._condition:
+            current = self._pending.get(conversation_id)
+            if current is not None:
+                metrics.add_metric(name="WhatsAppReadReceiptsCoalesced", unit=MetricUnit.Count, value=1)
+                if current[1] > received_at:
+                    return
+            self._pending[conversation_id] = (message_id, received_at)
+            self._ensure_worker()
+            self._condition.notify_all()
+
+    def _ensure_worker(self):
+        # Caller holds the lock
+        if self._thread is None or not self._thread.is_alive():
+            self._pool = self._pool or ThreadPoolExecutor(max_workers=self.workers,
+                                                          thread_name_prefix='whatsapp-read-receipts')
+            self._thread = threading.Thread(target=self._run, name='whatsapp-read-receipts', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                batch, self._pending = self._pending, {}
+                self._sending += 1
+
+            try:
+                receipts = self._fresh(batch)
+                if receipts:
+                    list(self._pool.map(self._send, receipts))
+            finally:
+                with self._condition:
+                    self._sending -= 1
+                    self._condition.notify_all()
+
+    def _fresh(self, batch: Dict[str, Tuple[str, float]]):
+        """Receipts still worth sending; records them as marked"""
+
+        now = time.time()
+        receipts = []
+        dropped = 0
+        with self._condition:
+            for conversation_id, (message_id, received_at) in batch.items():
+                marked_at = self._marked.get(conversation_id)
+                if now - received_at > self.max_age or (marked_at is not None and received_at <= marked_at):
+                    dropped += 1
+                    continue
+                self._marked[conversation_id] = received_at
+                self._marked.move_to_end(conversation_id)
+                if len(self._marked) > MARKED_CAPACITY:
+                    self._marked.popitem(last=False)
+                receipts.append(message_id)
+
+        if dropped:
+            metrics.add_metric(name="WhatsAppReadReceiptsDropped", unit=MetricUnit.Count, value=dropped)
+        return receipts
+
+    def _send(self, message_id: str):
+        if self.client.mark_message_as_read(message_id):
+            metrics.add_metric(name="WhatsAppReadReceiptsSent", unit=MetricUnit.Count, value=1)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until every queued receipt has been sent or dropped; False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._sending, timeout)
+
+
+# Export main classes
+__all__ = ['ReadReceiptSender']
@@ -0,0 +1,141 @@
+"""
+24-Hour Customer Service Window Index for WhatsApp
+Answers "can we send this user a free-form message?" from a warm in-memory
+map of last inbound timestamps, falling back to the session table, with
+bulk lookups in BatchGetItem sweeps for whole recipient lists.
+
+The timestamps are written through by get_or_create_session, which already
+updates the session item on every inbound message, so ingest costs nothing
+extra.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+from botocore.exceptions import ClientError
+
+# AWS Powertools for observability
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Initialize observability tools
+logger = Logger(service="whatsapp-integration")
+metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
+
+# Free-form messages are allowed for 24h after the user's last inbound message
+SERVICE_WINDOW_SECONDS = 24 * 3600
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+
+
+class ServiceWindowIndex:
+    """Last inbound message time per phone, for the 24h customer service window
+
+    An open window stays open until it expires, since the last inbound time
+    only moves forward. A closed or unknown answer may have been opened by a
+    message handled in another container, so those are re-read once they are
+    older than recheck_seconds.
+    """
+
+    def __init__(self, dynamodb: Any, table_name: str, capacity: int = None, recheck_seconds: float = None):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.table = dynamodb.Table(table_name)
+        self.capacity = capacity or int(os.environ.get('WHATSAPP_WINDOW_CACHE_SIZE', '10000'))
+        self.recheck_seconds = recheck_seconds if recheck_seconds is not None \
+            else float(os.environ.get('WHATSAPP_WINDOW_RECHECK_SECONDS', '60'))
+        # phone -> (last inbound epoch or None, when it was read)
+        self._entries: 'OrderedDict[str, Tuple[Optional[float], float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, phone: str, inbound_at: float):
+        """Note an inbound message; called from the ingest path after the session write"""
+        with self._lock:
+            current = self._entries.get(phone)
+            if current is None or current[0] is None or inbound_at > current[0]:
+                self._store(phone, inbound_at, time.time())
+
+    def _store(self, phone: str, inbound_at: Optional[float], checked_at: float):
+        # Caller holds the lock
+        self._entries[phone] = (inbound_at, checked_at)
+        self._entries.move_to_end(phone)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def _answer(self, phone: str, now: float) -> Optional[bool]:
+        """Window state from memory, or None when it has to be read"""
+        with self._lock:
+            entry = self._entries.get(phone)
+        if entry is None:
+            return None
+        inbound_at, checked_at = entry
+        if inbound_at is not None and now - inbound_at < SERVICE_WINDOW_SECONDS:
+            return True
+        if now - checked_at < self.recheck_seconds:
+            return False
+        return None
+
+    def is_open(self, phone: str, now: float = None) -> bool:
+        """True while the user's last inbound message is less than 24h old"""
+        return self.bulk_is_open([phone], now)[phone]
+
+    def bulk_is_open(self, phones: Iterable[str], now: float = None) -> Dict[str, bool]:
+        """Window state for many phones, reading the unknown ones in BatchGetItem sweeps"""
+
+        now = now or time.time()
+        answers: Dict[str, bool] = {}
+        unknown: List[str] = []
+        for phone in phones:
+            if phone in answers:
+                continue
+            answer = self._answer(phone, now)
+            if answer is None:
+                unknown.append(phone)
+                answers[phone] = False
+            else:
+                answers[phone] = answer
+
+        if unknown:
+            metrics.add_metric(name="WhatsAppWindowCacheMiss", unit=MetricUnit.Count, value=len(unknown))
+            try:
+                found = self._batch_read(unknown)
+            except ClientError as e:
+                # Unknown windows count as closed, which only ever costs a template send
+                logger.warning(f"Failed to read service windows: {str(e)}")
+                return answers
+
+            checked_at = time.time()
+            with self._lock:
+                for phone in unknown:
+                    inbound_at = found.get(phone)
+                    self._store(phone, inbound_at, checked_at)
+                    answers[phone] = inbound_at is not None and now - inbound_at < SERVICE_WINDOW_SECONDS
+
+        return answers
+
+    def _batch_read(self, phones: List[str]) -> Dict[str, float]:
+        found = {}
+        for start in range(0, len(phones), BATCH_GET_LIMIT):
+            request = {self.table_name: {
+                'Keys': [{'phone': phone} for phone in phones[start:start + BATCH_GET_LIMIT]],
+                'ProjectionExpression': 'phone, last_inbound_at'
+            }}
+            attempt = 0
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    if 'last_inbound_at' in item:
+                        found[item['phone']] = float(item['last_inbound_at'])
+                request = response.get('UnprocessedKeys') or None
+                if request:
+                    attempt += 1
+                    time.sleep(min(1.0, 0.05 * (2 ** attempt)))
+        return found
+
+
+# Export main classes
+__all__ = ['ServiceWindowIndex', 'SERVICE_WINDOW_SECONDS']
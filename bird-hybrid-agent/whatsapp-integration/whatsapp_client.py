@@ -5,17 +5,32 @@ message templates, rich media, session management, and compliance.
 """
 
 import os
+import re
+import copy
 import json
 import time
 import uuid
 import base64
-from typing import Dict, List, Any, Optional, Union
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Any, Optional, Union, Iterable, AsyncIterator, Tuple
 from datetime import datetime, timedelta
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, replace
 import requests
 import boto3
 from botocore.exceptions import ClientError
 
+from graph_transport import GraphTransport, get_graph_transport
+from bulk_sender import BulkSender, graph_error_code
+from media_uploads import MediaUploadManager, MEDIA_ID_ERROR_CODES
+from service_window import ServiceWindowIndex
+from read_receipts import ReadReceiptSender
+from outbound_dispatcher import OutboundDispatcher
+from idempotency import SendLedger, SendOutcomeUnknown, request_never_sent, request_rejected
+from property_catalog import PropertyCatalog, get_property_catalog
+from media_transfer import S3StreamUploader, MediaTransferResult, READ_CHUNK_SIZE
+
 # AWS Powertools for observability
 from aws_lambda_powertools import Logger, Tracer, Metrics
 from aws_lambda_powertools.metrics import MetricUnit
@@ -25,7 +40,7 @@ logger = Logger(service="whatsapp-integration")
 tracer = Tracer(service="whatsapp-integration")
 metrics = Metrics(namespace="UrbanHub/WhatsAppIntegration")
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WhatsAppMessage:
     """Structure for WhatsApp messages"""
     to: str  # Phone number in international format
@@ -36,12 +51,13 @@ class WhatsAppMessage:
     reply_to: str = None  # Message ID being replied to
     
     def __post_init__(self):
+        # Frozen: defaults are filled in once at construction
         if self.message_id is None:
-            self.message_id = str(uuid.uuid4())
+            object.__setattr__(self, 'message_id', str(uuid.uuid4()))
         if self.timestamp is None:
-            self.timestamp = datetime.now()
+            object.__setattr__(self, 'timestamp', datetime.now())
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WhatsAppUser:
     """Structure for WhatsApp users"""
     phone: str
@@ -51,7 +67,7 @@ class WhatsAppUser:
     is_business: bool = False
     last_seen: datetime = None
 
-@dataclass  
+@dataclass(slots=True)
 class WhatsAppSession:
     """Structure for WhatsApp conversation sessions"""
     phone: str
@@ -65,11 +81,134 @@ class WhatsAppSession:
     def __post_init__(self):
         if self.context is None:
             self.context = {}
+    
+    @classmethod
+    def from_dynamodb_item(cls, item: Dict[str, Any]) -> 'WhatsAppSession':
+        return cls(
+            phone=item['phone'],
+            session_id=item['session_id'],
+            start_time=datetime.fromisoformat(item['start_time']),
+            last_activity=datetime.fromisoformat(item['last_activity']),
+            message_count=int(item.get('message_count', 0)),
+            session_type=item.get('session_type', 'standard'),
+            context=item.get('context', {})
+        )
+    
+    def to_dynamodb_item(self) -> Dict[str, Any]:
+        return {
+            'phone': self.phone,
+            'session_id': self.session_id,
+            'start_time': self.start_time.isoformat(),
+            'last_activity': self.last_activity.isoformat(),
+            'message_count': self.message_count,
+            'session_type': self.session_type,
+            'context': self.context
+        }
+
+# Inactivity after which the next message starts a new session
+SESSION_TIMEOUT = timedelta(hours=24)
+
+# Rows allowed in one interactive list message
+PROPERTY_LIST_ROWS = 10
+
+class SessionCache:
+    """Process-wide LRU of recently seen sessions, kept warm across invocations"""
+    
+    def __init__(self, capacity: int = None):
+        self.capacity = capacity or int(os.environ.get('WHATSAPP_SESSION_CACHE_SIZE', '1024'))
+        self._sessions: 'OrderedDict[str, WhatsAppSession]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, phone: str) -> Optional[WhatsAppSession]:
+        with self._lock:
+            session = self._sessions.get(phone)
+            if session is not None:
+                self._sessions.move_to_end(phone)
+            return session
+    
+    def put(self, session: WhatsAppSession):
+        with self._lock:
+            self._sessions[session.phone] = session
+            self._sessions.move_to_end(session.phone)
+            if len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+    
+    def discard(self, phone: str):
+        with self._lock:
+            self._sessions.pop(phone, None)
+    
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+session_cache = SessionCache()
+
+# WhatsApp template placeholders are positional: {{1}}, {{2}}, ...
+TEMPLATE_PLACEHOLDER_PATTERN = re.compile(r'\{\{(\d+)\}\}')
+
+class CompiledWhatsAppTemplate:
+    """Approved template split once into immutable literal and placeholder segments"""
+    
+    __slots__ = ('name', 'language', 'components', 'placeholder_count')
+    
+    def __init__(self, key: str, definition: Dict[str, Any]):
+        self.name = definition['name']
+        self.language = definition['language']
+        
+        # (static fields, segments, flat) per component. Segments are the leading
+        # literal plus (zero-based parameter index, following literal) pairs, or
+        # None for components without body text; flat static fields need no deepcopy
+        components = []
+        placeholders = set()
+        for component in definition['components']:
+            if component['type'] == 'BODY' and 'text' in component:
+                static = tuple((field, value) for field, value in component.items() if field != 'text')
+                # re.split with one group alternates literal, placeholder, literal, ...
+                parts = TEMPLATE_PLACEHOLDER_PATTERN.split(component['text'])
+                indexes = tuple(int(number) - 1 for number in parts[1::2])
+                segments = (parts[0], tuple(zip(indexes, parts[2::2])))
+                placeholders.update(indexes)
+            else:
+                static = tuple(component.items())
+                segments = None
+            flat = all(isinstance(value, (str, int, float, bool)) for _, value in static)
+            components.append((static, segments, flat))
+        
+        if placeholders != set(range(len(placeholders))):
+            raise ValueError(f"Template {key} placeholders must be numbered {{{{1}}}}..{{{{n}}}} without gaps")
+        
+        self.components = tuple(components)
+        self.placeholder_count = len(placeholders)
+    
+    def render_texts(self, parameters: Tuple[str, ...]) -> Tuple[Optional[str], ...]:
+        """Body text per component, each built in a single join"""
+        texts = []
+        for _, segments, _ in self.components:
+            if segments is None:
+                texts.append(None)
+                continue
+            head, pairs = segments
+            parts = [head]
+            for index, literal in pairs:
+                parts += (parameters[index], literal)
+            texts.append(''.join(parts))
+        return tuple(texts)
+    
+    def to_payload(self, texts: Tuple[Optional[str], ...]) -> Dict[str, Any]:
+        """Fresh template dict; nothing in it is shared with the compiled template"""
+        components = []
+        for (static, segments, flat), text in zip(self.components, texts):
+            component = dict(static) if flat else copy.deepcopy(dict(static))
+            if segments is not None:
+                component['text'] = text
+            components.append(component)
+        
+        return {'name': self.name, 'language': self.language, 'components': components}
 
 class WhatsAppTemplateManager:
     """Manages WhatsApp message templates and compliance"""
     
-    def __init__(self):
+    def __init__(self, render_cache_size: int = None):
         # Pre-approved message templates (these need Meta approval)
         self.templates = {
             'welcome': {
@@ -116,37 +255,63 @@ class WhatsAppTemplateManager:
                 ]
             }
         }
+        
+        # Compiled once per cold start; renders are cached per parameter tuple
+        self._compiled = {name: CompiledWhatsAppTemplate(name, definition) for name, definition in self.templates.items()}
+        self.render_cache_size = render_cache_size or int(os.environ.get('WHATSAPP_TEMPLATE_CACHE_SIZE', '1024'))
+        self._render_cache: 'OrderedDict[Tuple[str, Tuple[str, ...]], Tuple[Optional[str], ...]]' = OrderedDict()
+        self._render_lock = threading.Lock()
+    
+    def get_compiled_template(self, template_name: str) -> CompiledWhatsAppTemplate:
+        """Compiled form of a template, compiled on first use"""
+        
+        compiled = self._compiled.get(template_name)
+        if compiled is None:
+            if template_name not in self.templates:
+                raise ValueError(f"Template {template_name} not found")
+            compiled = CompiledWhatsAppTemplate(template_name, self.templates[template_name])
+            self._compiled[template_name] = compiled
+        return compiled
     
     def get_template(self, template_name: str, parameters: List[str]) -> Dict[str, Any]:
         """Get formatted template with parameters"""
         
-        if template_name not in self.templates:
-            raise ValueError(f"Template {template_name} not found")
+        compiled = self.get_compiled_template(template_name)
         
-        template = self.templates[template_name].copy()
+        parameters = tuple(map(str, parameters))
+        if len(parameters) != compiled.placeholder_count:
+            raise ValueError(f"Template {template_name} expects {compiled.placeholder_count} "
+                             f"parameters, got {len(parameters)}")
         
-        # Replace parameters in template
-        for component in template['components']:
-            if component['type'] == 'BODY':
-                text = component['text']
-                for i, param in enumerate(parameters, 1):
-                    text = text.replace(f'{{{{{i}}}}}', param)
-                component['text'] = text
+        # Rendered texts are immutable, so cached entries are safe to share;
+        # the payload dicts handed out are always fresh
+        key = (template_name, parameters)
+        with self._render_lock:
+            texts = self._render_cache.get(key)
+            if texts is not None:
+                self._render_cache.move_to_end(key)
         
-        return template
+        if texts is None:
+            texts = compiled.render_texts(parameters)
+            with self._render_lock:
+                self._render_cache[key] = texts
+                if len(self._render_cache) > self.render_cache_size:
+                    self._render_cache.popitem(last=False)
+        
+        return compiled.to_payload(texts)
     
     def validate_template_usage(self, template_name: str, user_phone: str) -> bool:
         """Validate if template can be sent to user (24h rule compliance)"""
         
-        # Check 24-hour window for template messages
-        # This would typically query a database of recent messages
-        # For now, return True (implement proper validation in production)
-        return True
+        # Approved templates may be sent at any time, they are how we reach users
+        # outside the 24h window; the window only restricts free-form messages
+        # (see WhatsAppClient.can_send_free_form)
+        return template_name in self.templates
 
 class WhatsAppClient:
     """Main WhatsApp Business API client"""
     
-    def __init__(self):
+    def __init__(self, transport: GraphTransport = None):
         self.api_version = "v18.0"
         self.base_url = f"https://graph.facebook.com/{self.api_version}"
         self.access_token = os.environ['WHATSAPP_ACCESS_TOKEN']
@@ -160,10 +325,31 @@ class WhatsAppClient:
         # Storage configuration
         self.media_bucket = os.environ.get('WHATSAPP_MEDIA_BUCKET', 'urbanhub-whatsapp-media')
         self.session_table = self.dynamodb.Table(os.environ.get('WHATSAPP_SESSION_TABLE', 'whatsapp-sessions'))
+        self.media_uploader = S3StreamUploader(self.s3_client)
+        
+        # Last inbound message per phone, for the 24h customer service window
+        self.service_windows = ServiceWindowIndex(self.dynamodb, self.session_table.name)
+        
+        # Outbound assets are uploaded once and sent by media ID afterwards
+        media_id_cache = os.environ.get('WHATSAPP_MEDIA_ID_CACHE', 'true').lower() == 'true'
+        self.media_uploads = MediaUploadManager(self) if media_id_cache else None
         
         # Initialize template manager
         self.template_manager = WhatsAppTemplateManager()
         
+        # Pooled keep-alive HTTP transport, shared across clients in this process
+        self.transport = transport or get_graph_transport()
+        
+        # Read receipts are sent in the background, newest message per conversation only
+        self.read_receipts = ReadReceiptSender(self)
+        
+        # Outcomes of keyed sends, so retries never message a user twice
+        self.send_ledger = SendLedger(self.dynamodb)
+        self.send_attempts = int(os.environ.get('WHATSAPP_SEND_MAX_ATTEMPTS', '3'))
+        
+        # Prioritized sending; worker threads start on the first dispatch
+        self.outbound = OutboundDispatcher(self)
+        
         # Headers for API requests
         self.headers = {
             'Authorization': f'Bearer {self.access_token}',
@@ -173,6 +359,10 @@ class WhatsAppClient:
     @tracer.capture_method
     def send_text_message(self, to: str, text: str, reply_to: str = None) -> Dict[str, Any]:
         """Send a text message"""
+        return self._send_message(self.build_text_message_payload(to, text, reply_to))
+    
+    def build_text_message_payload(self, to: str, text: str, reply_to: str = None) -> Dict[str, Any]:
+        """Build a text message payload"""
         
         message_payload = {
             'messaging_product': 'whatsapp',
@@ -188,15 +378,19 @@ class WhatsAppClient:
         if reply_to:
             message_payload['context'] = {'message_id': reply_to}
         
-        return self._send_message(message_payload)
+        return message_payload
     
     @tracer.capture_method
     def send_template_message(self, to: str, template_name: str, parameters: List[str]) -> Dict[str, Any]:
         """Send a template message (for notifications outside 24h window)"""
+        return self._send_message(self.build_template_message_payload(to, template_name, parameters))
+    
+    def build_template_message_payload(self, to: str, template_name: str, parameters: List[str]) -> Dict[str, Any]:
+        """Build a template message payload, enforcing template usage rules"""
         
         # Validate template usage
         if not self.template_manager.validate_template_usage(template_name, to):
-            raise ValueError(f"Template {template_name} cannot be sent to {to} - 24h window exceeded")
+            raise ValueError(f"Template {template_name} cannot be sent to {to} - not an approved template")
         
         # Get template
         template = self.template_manager.get_template(template_name, parameters)
@@ -214,11 +408,15 @@ class WhatsAppClient:
             }
         }
         
-        return self._send_message(message_payload)
+        return message_payload
     
     @tracer.capture_method
     def send_image_message(self, to: str, image_url: str, caption: str = "", reply_to: str = None) -> Dict[str, Any]:
         """Send an image message"""
+        return self._send_media_message(self.build_image_message_payload(to, image_url, caption, reply_to), image_url)
+    
+    def build_image_message_payload(self, to: str, image_url: str, caption: str = "", reply_to: str = None) -> Dict[str, Any]:
+        """Build an image message payload"""
         
         message_payload = {
             'messaging_product': 'whatsapp',
@@ -233,11 +431,16 @@ class WhatsAppClient:
         if reply_to:
             message_payload['context'] = {'message_id': reply_to}
         
-        return self._send_message(message_payload)
+        return message_payload
     
     @tracer.capture_method
     def send_document_message(self, to: str, document_url: str, filename: str, caption: str = "", reply_to: str = None) -> Dict[str, Any]:
         """Send a document message"""
+        return self._send_media_message(self.build_document_message_payload(to, document_url, filename, caption, reply_to),
+                                        document_url)
+    
+    def build_document_message_payload(self, to: str, document_url: str, filename: str, caption: str = "", reply_to: str = None) -> Dict[str, Any]:
+        """Build a document message payload"""
         
         message_payload = {
             'messaging_product': 'whatsapp',
@@ -253,11 +456,45 @@ class WhatsAppClient:
         if reply_to:
             message_payload['context'] = {'message_id': reply_to}
         
-        return self._send_message(message_payload)
+        return message_payload
+    
+    def _with_media_id(self, payload: Dict[str, Any], url: str) -> Dict[str, Any]:
+        """Copy of a link payload that references the asset's uploaded media ID, when one is available"""
+        
+        media_type = payload['type']
+        media_id = self.media_uploads.get_media_id(url, media_type) if self.media_uploads else None
+        if not media_id:
+            return payload
+        
+        media = {key: value for key, value in payload[media_type].items() if key != 'link'}
+        return {**payload, media_type: {'id': media_id, **media}}
+    
+    def _send_media_message(self, payload: Dict[str, Any], url: str) -> Dict[str, Any]:
+        """Send a media payload by uploaded media ID, re-uploading once if Graph rejects a cached ID
+        
+        The upload-or-reuse step happens here rather than in the builders, so
+        building a payload never touches the network.
+        """
+        
+        media_payload = self._with_media_id(payload, url)
+        try:
+            return self._send_message(media_payload)
+        except requests.exceptions.HTTPError as e:
+            if media_payload is payload or graph_error_code(e) not in MEDIA_ID_ERROR_CODES:
+                raise
+            
+            logger.warning("Cached media ID rejected, uploading again", url=url,
+                           media_id=media_payload[payload['type']]['id'])
+            self.media_uploads.invalidate(url)
+            return self._send_message(self._with_media_id(payload, url))
     
     @tracer.capture_method
     def send_audio_message(self, to: str, audio_url: str, reply_to: str = None) -> Dict[str, Any]:
         """Send an audio message"""
+        return self._send_message(self.build_audio_message_payload(to, audio_url, reply_to))
+    
+    def build_audio_message_payload(self, to: str, audio_url: str, reply_to: str = None) -> Dict[str, Any]:
+        """Build an audio message payload"""
         
         message_payload = {
             'messaging_product': 'whatsapp',
@@ -271,12 +508,17 @@ class WhatsAppClient:
         if reply_to:
             message_payload['context'] = {'message_id': reply_to}
         
-        return self._send_message(message_payload)
+        return message_payload
     
     @tracer.capture_method
     def send_interactive_list(self, to: str, header_text: str, body_text: str, footer_text: str, 
                             button_text: str, sections: List[Dict], reply_to: str = None) -> Dict[str, Any]:
         """Send an interactive list message"""
+        return self._send_message(self.build_interactive_list_payload(to, header_text, body_text, footer_text, button_text, sections, reply_to))
+    
+    def build_interactive_list_payload(self, to: str, header_text: str, body_text: str, footer_text: str, 
+                            button_text: str, sections: List[Dict], reply_to: str = None) -> Dict[str, Any]:
+        """Build an interactive list message payload"""
         
         message_payload = {
             'messaging_product': 'whatsapp',
@@ -304,12 +546,17 @@ class WhatsAppClient:
         if reply_to:
             message_payload['context'] = {'message_id': reply_to}
         
-        return self._send_message(message_payload)
+        return message_payload
     
     @tracer.capture_method
     def send_interactive_buttons(self, to: str, body_text: str, buttons: List[Dict], 
                                 header_text: str = "", footer_text: str = "", reply_to: str = None) -> Dict[str, Any]:
         """Send an interactive buttons message"""
+        return self._send_message(self.build_interactive_buttons_payload(to, body_text, buttons, header_text, footer_text, reply_to))
+    
+    def build_interactive_buttons_payload(self, to: str, body_text: str, buttons: List[Dict], 
+                                header_text: str = "", footer_text: str = "", reply_to: str = None) -> Dict[str, Any]:
+        """Build an interactive buttons message payload"""
         
         interactive_payload = {
             'type': 'button',
@@ -333,56 +580,152 @@ class WhatsAppClient:
         if reply_to:
             message_payload['context'] = {'message_id': reply_to}
         
-        return self._send_message(message_payload)
+        return message_payload
+    
+    def send_message(self, message: WhatsAppMessage) -> Dict[str, Any]:
+        """Send a WhatsAppMessage at most once per message_id
+        
+        Text content is the message body; for other types content is the Graph
+        object for that type, e.g. {'link': ..., 'caption': ...} for an image.
+        Calling again with the same message returns the recorded response.
+        """
+        
+        if message.type == 'text':
+            payload = self.build_text_message_payload(message.to, message.content, message.reply_to)
+        else:
+            payload = {
+                'messaging_product': 'whatsapp',
+                'to': message.to,
+                'type': message.type,
+                message.type: message.content
+            }
+            if message.reply_to:
+                payload['context'] = {'message_id': message.reply_to}
+        
+        return self._send_message(payload, idempotency_key=message.message_id)
     
     @tracer.capture_method
-    def _send_message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        """Internal method to send message via WhatsApp API"""
+    def _send_message(self, payload: Dict[str, Any], idempotency_key: str = None) -> Dict[str, Any]:
+        """Internal method to send message via WhatsApp API
         
-        url = f"{self.base_url}/{self.phone_number_id}/messages"
+        With an idempotency_key the outcome is recorded in the send ledger, and
+        a repeated key returns the recorded response instead of sending again.
+        A key whose earlier attempt ended ambiguously (e.g. a read timeout)
+        raises SendOutcomeUnknown rather than risking a duplicate. The claim
+        is marked as sent out before the POST, so only claims that never got
+        that far can be taken over once their lease runs out.
+        """
+        
+        if idempotency_key:
+            try:
+                recorded = self.send_ledger.claim(idempotency_key)
+            except ClientError as e:
+                # Sending without the ledger beats not sending at all
+                logger.warning(f"Send ledger unavailable, sending without idempotency: {str(e)}")
+                idempotency_key = None
+            else:
+                if recorded is not None:
+                    logger.info("Duplicate send avoided", idempotency_key=idempotency_key)
+                    return recorded
+                
+                try:
+                    self.send_ledger.mark_sending(idempotency_key)
+                except ClientError:
+                    # Nothing went out; free the key rather than leave a claim that could be leased mid-send
+                    try:
+                        self.send_ledger.release(idempotency_key)
+                    except ClientError as release_error:
+                        logger.warning(f"Failed to release send claim: {str(release_error)}")
+                    raise
         
         try:
-            start_time = time.time()
-            
-            response = requests.post(
-                url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            
-            processing_time_ms = int((time.time() - start_time) * 1000)
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            # Add metrics
-            metrics.add_metric("WhatsAppMessageSent", 1, MetricUnit.Count)
-            metrics.add_metric("WhatsAppAPILatency", processing_time_ms, MetricUnit.Milliseconds)
-            
-            logger.info("WhatsApp message sent successfully", 
-                       message_id=result.get('messages', [{}])[0].get('id'),
-                       to=payload.get('to'),
-                       type=payload.get('type'))
-            
-            return result
-            
+            result = self._post_message(payload)
         except requests.exceptions.RequestException as e:
-            logger.error(f"WhatsApp API request failed: {str(e)}")
-            metrics.add_metric("WhatsAppAPIErrors", 1, MetricUnit.Count)
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected error sending WhatsApp message: {str(e)}")
+            if idempotency_key and (request_never_sent(e) or request_rejected(e)):
+                # Definitely not delivered, so the same message may be sent again later
+                try:
+                    self.send_ledger.release(idempotency_key)
+                except ClientError as release_error:
+                    logger.warning(f"Failed to release send claim: {str(release_error)}")
             raise
+        
+        if idempotency_key:
+            try:
+                self.send_ledger.record(idempotency_key, result)
+            except ClientError as e:
+                # The key stays unknown, so a retry reports an unknown outcome instead of resending
+                logger.warning(f"Failed to record send: {str(e)}", idempotency_key=idempotency_key)
+        
+        return result
+    
+    def _post_message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST to the messages endpoint, retrying only requests that never left this process"""
+        
+        url = f"{self.base_url}/{self.phone_number_id}/messages"
+        
+        for attempt in range(1, self.send_attempts + 1):
+            try:
+                start_time = time.time()
+                
+                response = self.transport.request('POST', url, headers=self.headers, json=payload)
+                
+                processing_time_ms = int((time.time() - start_time) * 1000)
+                
+                response.raise_for_status()
+                result = response.json()
+                
+                # Add metrics
+                metrics.add_metric(name="WhatsAppMessageSent", unit=MetricUnit.Count, value=1)
+                metrics.add_metric(name="WhatsAppAPILatency", unit=MetricUnit.Milliseconds, value=processing_time_ms)
+                
+                logger.info("WhatsApp message sent successfully", 
+                           message_id=result.get('messages', [{}])[0].get('id'),
+                           to=payload.get('to'),
+                           type=payload.get('type'))
+                
+                return result
+                
+            except requests.exceptions.RequestException as e:
+                if request_never_sent(e) and attempt < self.send_attempts:
+                    logger.warning(f"WhatsApp connection failed, retrying: {str(e)}", attempt=attempt)
+                    metrics.add_metric(name="WhatsAppSendRetried", unit=MetricUnit.Count, value=1)
+                    time.sleep(0.1 * (2 ** (attempt - 1)))
+                    continue
+                logger.error(f"WhatsApp API request failed: {str(e)}")
+                metrics.add_metric(name="WhatsAppAPIErrors", unit=MetricUnit.Count, value=1)
+                raise
+            except Exception as e:
+                logger.error(f"Unexpected error sending WhatsApp message: {str(e)}")
+                raise
+    
+    def send_bulk(self, payloads: Iterable[Dict[str, Any]], concurrency: int = None) -> AsyncIterator[Dict[str, Any]]:
+        """Send many prebuilt payloads concurrently; async-iterate to get per-message results
+        
+        Payloads come from the build_*_payload methods. Messages to the same
+        recipient are sent in input order, and rate-limit errors are retried
+        under this phone number's shared token bucket.
+        """
+        
+        return BulkSender(self, concurrency=concurrency).send(payloads)
+    
+    def dispatch(self, payload: Dict[str, Any], priority: str = 'conversational') -> Future:
+        """Queue a prebuilt payload by priority class; the Future resolves to the Graph response
+        
+        Classes are emergency, transactional, conversational and marketing.
+        Use this instead of the send_* methods when a large send may be running
+        from the same process, so urgent messages are not stuck behind it.
+        """
+        
+        return self.outbound.submit(payload, priority)
     
     @tracer.capture_method
     def download_media(self, media_id: str) -> Optional[bytes]:
-        """Download media from WhatsApp"""
+        """Download media from WhatsApp into memory (use stream_media_to_s3 for anything large)"""
         
         try:
             # Get media URL
             url = f"{self.base_url}/{media_id}"
-            response = requests.get(url, headers=self.headers, timeout=30)
+            response = self.transport.request('GET', url, headers=self.headers)
             response.raise_for_status()
             
             media_info = response.json()
@@ -393,11 +736,7 @@ class WhatsAppClient:
                 return None
             
             # Download media content
-            media_response = requests.get(
-                media_url, 
-                headers=self.headers,
-                timeout=60
-            )
+            media_response = self.transport.request('GET', media_url, headers=self.headers, read_timeout=60)
             media_response.raise_for_status()
             
             return media_response.content
@@ -406,23 +745,77 @@ class WhatsAppClient:
             logger.error(f"Failed to download media {media_id}: {str(e)}")
             return None
     
+    @tracer.capture_method
+    def stream_media_to_s3(self, media_id: str, media_type: str, conversation_id: str) -> Optional[MediaTransferResult]:
+        """Stream media from WhatsApp into S3 without holding the whole file in memory"""
+        
+        start_time = time.perf_counter()
+        
+        try:
+            # Get media URL
+            response = self.transport.request('GET', f"{self.base_url}/{media_id}", headers=self.headers)
+            response.raise_for_status()
+            
+            media_info = response.json()
+            media_url = media_info.get('url')
+            
+            if not media_url:
+                logger.error(f"No URL found for media {media_id}")
+                return None
+            
+            content_type = media_info.get('mime_type') or self._get_content_type(media_type)
+            s3_key = f"whatsapp-media/{conversation_id}/{int(time.time())}-{media_id}.{self._get_file_extension(media_type)}"
+            
+            # Pipe the response body into the multipart upload part by part
+            media_response = self.transport.request('GET', media_url, headers=self.headers, read_timeout=60, stream=True)
+            try:
+                media_response.raise_for_status()
+                upload = self.media_uploader.upload(media_response.iter_content(READ_CHUNK_SIZE),
+                                                    self.media_bucket, s3_key, content_type)
+            finally:
+                media_response.close()
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to download media {media_id}: {str(e)}")
+            return None
+        except ClientError as e:
+            logger.error(f"Failed to store media in S3: {str(e)}")
+            raise
+        
+        result = MediaTransferResult(
+            media_id=media_id,
+            s3_uri=f"s3://{self.media_bucket}/{s3_key}",
+            size=upload['size'],
+            sha256=upload['sha256'],
+            content_type=content_type,
+            parts=upload['parts'],
+            seconds=round(time.perf_counter() - start_time, 3)
+        )
+        
+        metrics.add_metric(name="WhatsAppMediaBytesTransferred", unit=MetricUnit.Bytes, value=result.size)
+        metrics.add_metric(name="WhatsAppMediaTransferLatency", unit=MetricUnit.Milliseconds, value=int(result.seconds * 1000))
+        
+        return result
+    
+    def stream_media_batch(self, media: List[Tuple[str, str]], conversation_id: str,
+                           max_workers: int = None) -> List[Optional[MediaTransferResult]]:
+        """Stream several (media_id, media_type) attachments of one message concurrently, in input order"""
+        
+        if not media:
+            return []
+        
+        max_workers = max_workers or int(os.environ.get('WHATSAPP_MEDIA_DOWNLOAD_CONCURRENCY', '4'))
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(media))) as pool:
+            return list(pool.map(lambda item: self.stream_media_to_s3(item[0], item[1], conversation_id), media))
+    
     @tracer.capture_method
     def store_media_in_s3(self, media_content: bytes, media_type: str, conversation_id: str) -> str:
         """Store media content in S3"""
         
         timestamp = int(time.time())
         
-        # Determine file extension
-        extensions = {
-            'image': 'jpg',
-            'audio': 'ogg',
-            'document': 'pdf',
-            'video': 'mp4'
-        }
-        extension = extensions.get(media_type, 'bin')
-        
         # Generate S3 key
-        s3_key = f"whatsapp-media/{conversation_id}/{timestamp}.{extension}"
+        s3_key = f"whatsapp-media/{conversation_id}/{timestamp}.{self._get_file_extension(media_type)}"
         
         try:
             self.s3_client.put_object(
@@ -438,6 +831,16 @@ class WhatsAppClient:
             logger.error(f"Failed to store media in S3: {str(e)}")
             raise
     
+    def _get_file_extension(self, media_type: str) -> str:
+        """Get file extension for media"""
+        extensions = {
+            'image': 'jpg',
+            'audio': 'ogg',
+            'document': 'pdf',
+            'video': 'mp4'
+        }
+        return extensions.get(media_type, 'bin')
+    
     def _get_content_type(self, media_type: str) -> str:
         """Get MIME content type for media"""
         types = {
@@ -450,80 +853,119 @@ class WhatsAppClient:
     
     @tracer.capture_method
     def get_or_create_session(self, phone: str, message_type: str = "standard") -> WhatsAppSession:
-        """Get existing session or create new one"""
+        """Record an inbound message on the user's session, starting a new one if missing or expired
+        
+        An active session costs one conditional UpdateItem: the counter is an
+        atomic ADD, so concurrent messages never lose counts.
+        """
+        
+        now = datetime.now()
+        cutoff = (now - SESSION_TIMEOUT).isoformat()
+        cached = session_cache.get(phone)
         
         try:
-            # Check for existing active session
-            response = self.session_table.get_item(
-                Key={'phone': phone}
-            )
-            
-            if 'Item' in response:
-                item = response['Item']
-                
-                # Check if session is still active (within 24 hours)
-                last_activity = datetime.fromisoformat(item['last_activity'])
-                if datetime.now() - last_activity < timedelta(hours=24):
-                    # Update last activity
-                    session = WhatsAppSession(
-                        phone=item['phone'],
-                        session_id=item['session_id'],
-                        start_time=datetime.fromisoformat(item['start_time']),
-                        last_activity=datetime.now(),
-                        message_count=item.get('message_count', 0) + 1,
-                        session_type=item.get('session_type', 'standard'),
-                        context=item.get('context', {})
-                    )
-                    
-                    self._save_session(session)
+            # Skip straight to a new session when the cache knows this one has expired
+            if cached is None or cached.last_activity.isoformat() > cutoff:
+                session = self._touch_session(phone, now, cutoff, cached)
+                if session:
                     return session
             
-            # Create new session
-            session = WhatsAppSession(
-                phone=phone,
-                session_id=str(uuid.uuid4()),
-                start_time=datetime.now(),
-                last_activity=datetime.now(),
-                message_count=1,
-                session_type=message_type,
-                context={}
-            )
-            
-            self._save_session(session)
-            return session
+            # A concurrent message may have started the session first; then join it
+            return self._start_session(phone, message_type, now, cutoff) \
+                or self._touch_session(phone, now, cutoff, None)
             
         except ClientError as e:
             logger.error(f"Failed to get/create session: {str(e)}")
-            # Return temporary session
-            return WhatsAppSession(
-                phone=phone,
-                session_id=str(uuid.uuid4()),
-                start_time=datetime.now(),
-                last_activity=datetime.now(),
-                session_type=message_type
+        
+        # Return temporary session
+        return WhatsAppSession(
+            phone=phone,
+            session_id=str(uuid.uuid4()),
+            start_time=now,
+            last_activity=now,
+            session_type=message_type
+        )
+    
+    def _touch_session(self, phone: str, now: datetime, cutoff: str,
+                       cached: Optional[WhatsAppSession]) -> Optional[WhatsAppSession]:
+        """Bump an active session in place; None when it is missing or expired"""
+        
+        try:
+            response = self.session_table.update_item(
+                Key={'phone': phone},
+                UpdateExpression='SET last_activity = :now, last_inbound_at = :inbound_at, #ttl = :ttl '
+                                 'ADD message_count :one',
+                # ISO timestamps in one format order correctly as strings
+                ConditionExpression='last_activity > :cutoff',
+                ExpressionAttributeNames={'#ttl': 'ttl'},
+                ExpressionAttributeValues={
+                    ':now': now.isoformat(),
+                    ':inbound_at': int(now.timestamp()),
+                    ':ttl': int(time.time()) + (7 * 24 * 3600),  # 7 days TTL
+                    ':one': 1,
+                    ':cutoff': cutoff
+                },
+                # The cached copy already has everything except the updated fields
+                ReturnValues='UPDATED_NEW' if cached else 'ALL_NEW'
             )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            session_cache.discard(phone)
+            return None
+        
+        self.service_windows.record(phone, int(now.timestamp()))
+        
+        attributes = response['Attributes']
+        if cached:
+            session = replace(cached, last_activity=now, message_count=int(attributes['message_count']))
+        else:
+            session = WhatsAppSession.from_dynamodb_item(attributes)
+        
+        session_cache.put(session)
+        return session
     
-    @tracer.capture_method  
-    def _save_session(self, session: WhatsAppSession):
-        """Save session to DynamoDB"""
+    def _start_session(self, phone: str, message_type: str, now: datetime, cutoff: str) -> Optional[WhatsAppSession]:
+        """Create a session unless another message created an active one first"""
+        
+        session = WhatsAppSession(
+            phone=phone,
+            session_id=str(uuid.uuid4()),
+            start_time=now,
+            last_activity=now,
+            message_count=1,
+            session_type=message_type,
+            context={}
+        )
         
         try:
             self.session_table.put_item(
                 Item={
-                    'phone': session.phone,
-                    'session_id': session.session_id,
-                    'start_time': session.start_time.isoformat(),
-                    'last_activity': session.last_activity.isoformat(),
-                    'message_count': session.message_count,
-                    'session_type': session.session_type,
-                    'context': session.context,
+                    **session.to_dynamodb_item(),
+                    'last_inbound_at': int(now.timestamp()),
                     'ttl': int(time.time()) + (7 * 24 * 3600)  # 7 days TTL
-                }
+                },
+                ConditionExpression='attribute_not_exists(phone) OR last_activity <= :cutoff',
+                ExpressionAttributeValues={':cutoff': cutoff}
             )
         except ClientError as e:
-            logger.error(f"Failed to save session: {str(e)}")
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return None
+        
+        self.service_windows.record(phone, int(now.timestamp()))
+        session_cache.put(session)
+        return session
+    
+    def can_send_free_form(self, phone: str) -> bool:
+        """True inside the 24h customer service window, when non-template messages are allowed"""
+        return self.service_windows.is_open(phone)
     
     @tracer.capture_method
+    def queue_read_receipt(self, conversation_id: str, message_id: str, timestamp: str = None):
+        """Mark message as read in the background; returns without waiting on Meta"""
+        self.read_receipts.submit(conversation_id, message_id, timestamp)
+    
     def mark_message_as_read(self, message_id: str) -> bool:
         """Mark message as read"""
         
@@ -536,7 +978,7 @@ class WhatsAppClient:
         }
         
         try:
-            response = requests.post(url, headers=self.headers, json=payload, timeout=10)
+            response = self.transport.request('POST', url, headers=self.headers, json=payload, read_timeout=10)
             response.raise_for_status()
             return True
         except requests.exceptions.RequestException as e:
@@ -545,21 +987,38 @@ class WhatsAppClient:
     
     # Helper methods for creating interactive content
     
-    def create_property_list(self, properties: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Create interactive list for property selection"""
+    def create_property_list(self, properties: List[Dict[str, Any]], page: int = 0) -> Dict[str, Any]:
+        """Create interactive list for property selection
+        
+        properties is the full ranked result; page picks which 10 rows are shown
+        (WhatsApp's limit). When more follow, the last row asks for the next page
+        and carries its number in the row id (properties_page_<n>).
+        """
+        
+        start = page * (PROPERTY_LIST_ROWS - 1)
+        remaining = properties[start:]
+        has_more = len(remaining) > PROPERTY_LIST_ROWS
+        shown = remaining[:PROPERTY_LIST_ROWS - 1] if has_more else remaining
         
         sections = [{
             'title': 'Propiedades Disponibles',
             'rows': []
         }]
         
-        for prop in properties[:10]:  # WhatsApp limit is 10 items
+        for prop in shown:
             sections[0]['rows'].append({
                 'id': prop['id'],
                 'title': prop['name'],
                 'description': f"${prop['price']:,} MXN - {prop['location']}"
             })
         
+        if has_more:
+            sections[0]['rows'].append({
+                'id': f'properties_page_{page + 1}',
+                'title': 'Ver más propiedades',
+                'description': f"{len(remaining) - len(shown)} opciones más"
+            })
+        
         return {
             'header_text': '🏠 Propiedades UrbanHub',
             'body_text': 'Selecciona una propiedad para obtener más información:',
@@ -568,6 +1027,16 @@ class WhatsAppClient:
             'sections': sections
         }
     
+    def search_property_list(self, page: int = 0, catalog: PropertyCatalog = None, **filters) -> Dict[str, Any]:
+        """Property list for a filtered catalog search, e.g. max_price=25000, pet_friendly=True, location='Reforma'
+        
+        Filters are those of PropertyCatalog.search. The search runs on the
+        in-memory catalog index, so repeating it for every page is cheap.
+        """
+        
+        catalog = catalog or get_property_catalog()
+        return self.create_property_list(catalog.search(**filters), page)
+    
     def create_tour_buttons(self, property_name: str) -> List[Dict[str, Any]]:
         """Create interactive buttons for tour booking"""
         
@@ -609,4 +1078,4 @@ def verify_webhook(mode: str, token: str, challenge: str) -> Optional[str]:
         return None
 
 # Export main classes
-__all__ = ['WhatsAppClient', 'WhatsAppMessage', 'WhatsAppSession', 'WhatsAppTemplateManager', 'verify_webhook']
\ No newline at end of file
+__all__ = ['WhatsAppClient', 'WhatsAppMessage', 'WhatsAppSession', 'WhatsAppTemplateManager', 'SessionCache', 'SendOutcomeUnknown', 'verify_webhook']
\ No newline at end of file